@@ -1,28 +1,67 @@
-from flask import Flask
-from routes import api_blueprint, worker_blueprint
+import logging
+import os
+from flask import Flask, g, request
+from common.logging_config import configure_logging
+from common.tracing import TRACING_ENABLED, Span
+from routes import api_blueprint, worker_blueprint, admin_blueprint
 from database.session import init_db
 from worker_manager import check_and_update_worker_state, stop_worker
+from maintenance import start_purge_loop, start_lease_monitor, stop_purge_loop
+from similarity import start_warmup
+
+logger = logging.getLogger(__name__)
+
+COLLECTOR_PORT = int(os.getenv('COLLECTOR_PORT', 5001))
 
 # Initialize Flask app
 app = Flask(__name__)
 
 # Register Blueprints
 app.register_blueprint(api_blueprint, url_prefix='/api')
+# The exporter calls the API without the /api prefix.
+app.register_blueprint(api_blueprint, url_prefix='', name='exporter_api')
 app.register_blueprint(worker_blueprint, url_prefix='/worker')
+app.register_blueprint(admin_blueprint, url_prefix='/admin')
+
+if TRACING_ENABLED:
+    @app.before_request
+    def start_request_span():
+        """
+        Time the request, including all CRUD spans and statements it runs.
+        """
+        g.trace_span = Span(f"route:{request.endpoint or 'UNKNOWN'}", detail=f"{request.method} {request.path}")
+
+    @app.teardown_request
+    def finish_request_span(exc=None):
+        trace_span = g.pop('trace_span', None)
+        if trace_span is not None:
+            trace_span.finish()
 
 if __name__ == '__main__':
+    configure_logging()
+
     logger.info("Initializing database...")
     init_db()
 
     logger.info("Starting worker manager...")
     check_and_update_worker_state()
 
+    logger.info("Starting tombstone purge...")
+    start_purge_loop()
+
+    logger.info("Starting lease monitor...")
+    start_lease_monitor()
+
+    logger.info("Warming up similarity index...")
+    start_warmup()
+
     try:
         logger.info("Starting Flask server...")
-        app.run(host='0.0.0.0', port=5001)
+        app.run(host='0.0.0.0', port=COLLECTOR_PORT)
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
 
     logger.info("Stopping worker...")
     stop_worker()
+    stop_purge_loop()
     logger.info("Server stopped.")
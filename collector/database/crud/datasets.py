@@ -0,0 +1,228 @@
+# crud/datasets.py
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import Dataset
+from .leases import touch_exporter
+
+SCAN_TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M"
+DEFAULT_FILE_EXTENSIONS = [".mp4", ".mkv", ".avi", ".mov", ".wmv", ".m4v", ".mpg", ".webm"]
+
+
+class AmbiguousDatasetError(ValueError):
+    """
+    Raised when a dataset name exists in several clusters and no cluster was given.
+    """
+
+
+def parse_extensions(value):
+    """
+    Convert the stored comma-separated extension list into a list.
+    """
+    if not value:
+        return list(DEFAULT_FILE_EXTENSIONS)
+    return [ext.strip() for ext in value.split(",") if ext.strip()]
+
+
+def serialize_extensions(extensions):
+    """
+    Normalize a list of extensions (leading dot, lower case) into the stored format.
+    """
+    if not extensions:
+        return None
+    normalized = []
+    for ext in extensions:
+        ext = ext.strip().lower()
+        if ext and not ext.startswith("."):
+            ext = f".{ext}"
+        if ext and ext not in normalized:
+            normalized.append(ext)
+    return ",".join(normalized) or None
+
+
+def dataset_to_dict(dataset):
+    """
+    Convert a dataset row into the dictionary format used by the exporter.
+    """
+    return {
+        "dataset": dataset.name,
+        "cluster": dataset.cluster,
+        "path": dataset.path,
+        "enabled": bool(dataset.enabled),
+        "weight": dataset.weight,
+        "owner": dataset.owner,
+        "file_extensions": parse_extensions(dataset.file_extensions),
+        "status": dataset.status,
+        "scan_type": dataset.scan_type,
+        "last_scan": dataset.last_scan.strftime(SCAN_TIMESTAMP_FORMAT) if dataset.last_scan else None,
+        "last_snapshot": dataset.last_snapshot,
+        "scan_duration": dataset.scan_duration,
+        "files_seen": dataset.files_seen,
+        "files_sent": dataset.files_sent,
+    }
+
+
+def find_dataset(session, name, cluster=None):
+    """
+    Look up a dataset by name and, if given, cluster.
+
+    Raises:
+        AmbiguousDatasetError: If the name exists in several clusters and no cluster is given.
+    """
+    query = session.query(Dataset).filter_by(name=name)
+    if cluster is not None:
+        query = query.filter_by(cluster=cluster)
+    records = query.limit(2).all()
+    if len(records) > 1:
+        raise AmbiguousDatasetError(f"Dataset {name} exists in several clusters; the cluster is required.")
+    return records[0] if records else None
+
+
+@traced()
+def register_datasets(datasets, exporter=None):
+    """
+    Insert newly discovered datasets and refresh the path of known ones.
+    Datasets are matched by cluster and name; a row registered before it
+    had a cluster is adopted by the first cluster reporting its name.
+
+    New datasets are registered disabled so that nothing is scanned before
+    an administrator has enabled it. If the reporting exporter is given, it
+    becomes the owner of the datasets, since they are stored on its host.
+    """
+    with SessionLocal() as session:
+        try:
+            keys = [(d.get("cluster"), d["dataset"]) for d in datasets]
+            names = {name for _, name in keys}
+            known = {(d.cluster, d.name): d for d in session.query(Dataset).filter(Dataset.name.in_(names))}
+            now = datetime.now()
+            for entry, key in zip(datasets, keys):
+                record = known.get(key)
+                if record is None and key[0] is not None:
+                    record = known.pop((None, key[1]), None)
+                if record is None:
+                    record = Dataset(name=key[1], enabled=False, weight=1)
+                    session.add(record)
+                record.cluster = key[0]
+                known[key] = record
+                record.path = entry.get("path", record.path)
+                if exporter:
+                    record.owner = exporter
+                record.updated_at = now
+            if exporter:
+                touch_exporter(session, exporter, now)
+            session.commit()
+            return [dataset_to_dict(known[key]) for key in keys]
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error registering datasets: {e}")
+
+
+@traced()
+def fetch_datasets(enabled_only=False):
+    """
+    Fetch all datasets from the registry.
+    """
+    with SessionLocal() as session:
+        try:
+            query = session.query(Dataset)
+            if enabled_only:
+                query = query.filter(Dataset.enabled.is_(True))
+            return [dataset_to_dict(d) for d in query.order_by(Dataset.name, Dataset.cluster)]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching datasets: {e}")
+
+
+@traced()
+def fetch_dataset(name, cluster=None):
+    """
+    Fetch a single dataset from the registry.
+    """
+    with SessionLocal() as session:
+        try:
+            record = find_dataset(session, name, cluster)
+            return dataset_to_dict(record) if record else None
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching dataset {name}: {e}")
+
+
+@traced()
+def update_dataset_config(name, enabled=None, file_extensions=None, weight=None, cluster=None):
+    """
+    Change the enabled flag, the file extensions and/or the task queue weight of a dataset.
+    Returns the updated dataset, or None if it does not exist.
+    """
+    with SessionLocal() as session:
+        try:
+            record = find_dataset(session, name, cluster)
+            if record is None:
+                return None
+            if enabled is not None:
+                record.enabled = bool(enabled)
+            if file_extensions is not None:
+                record.file_extensions = serialize_extensions(file_extensions)
+            if weight is not None:
+                record.weight = max(int(weight), 1)
+            record.updated_at = datetime.now()
+            session.commit()
+            return dataset_to_dict(record)
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error updating dataset {name}: {e}")
+
+
+@traced()
+def reset_dataset_cursor(name, cluster=None):
+    """
+    Clear the scan cursor of a dataset so the next run performs a full scan.
+    Returns the updated dataset, or None if it does not exist.
+    """
+    with SessionLocal() as session:
+        try:
+            record = find_dataset(session, name, cluster)
+            if record is None:
+                return None
+            record.last_scan = None
+            record.last_snapshot = None
+            record.status = None
+            record.updated_at = datetime.now()
+            session.commit()
+            return dataset_to_dict(record)
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error resetting dataset {name}: {e}")
+
+
+@traced()
+def record_scan_status(name, status, scan_type=None, last_scan=None, last_snapshot=None,
+                       scan_duration=None, files_seen=None, files_sent=None, cluster=None):
+    """
+    Store the result of a scan run.
+
+    The scan cursor (last_scan, last_snapshot) only advances on SUCCESS, so a
+    failed run never moves the watermark past files that were not submitted.
+    Returns the updated dataset, or None if it does not exist.
+    """
+    with SessionLocal() as session:
+        try:
+            record = find_dataset(session, name, cluster)
+            if record is None:
+                return None
+            record.status = status
+            record.scan_type = scan_type
+            record.scan_duration = scan_duration
+            record.files_seen = files_seen
+            record.files_sent = files_sent
+            if status == "SUCCESS":
+                if last_scan:
+                    record.last_scan = datetime.strptime(last_scan, SCAN_TIMESTAMP_FORMAT)
+                if last_snapshot:
+                    record.last_snapshot = last_snapshot
+            record.updated_at = datetime.now()
+            session.commit()
+            return dataset_to_dict(record)
+        except AmbiguousDatasetError:
+            raise
+        except (SQLAlchemyError, ValueError) as e:
+            session.rollback()
+            raise RuntimeError(f"Error recording scan status for {name}: {e}")
@@ -0,0 +1,185 @@
+# crud/directories.py
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, delete, exists
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import aliased
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import Directory, Inventory
+
+DIRECTORY_CACHE_SIZE = int(os.getenv('DIRECTORY_CACHE_SIZE', 100000))
+
+_directory_cache = OrderedDict()
+_directory_cache_lock = threading.Lock()
+
+
+def path_hash(path):
+    """
+    Compute the fixed-length key a directory path is interned under.
+    """
+    return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+def normalize_directory(path):
+    """
+    Normalize a directory path (no trailing slash, no duplicate separators).
+    """
+    return os.path.normpath(path) if path else os.sep
+
+
+def _cache_get(dataset, path):
+    with _directory_cache_lock:
+        directory_id = _directory_cache.get((dataset, path))
+        if directory_id is not None:
+            _directory_cache.move_to_end((dataset, path))
+        return directory_id
+
+
+def _cache_put(dataset, path, directory_id):
+    with _directory_cache_lock:
+        _directory_cache[(dataset, path)] = directory_id
+        _directory_cache.move_to_end((dataset, path))
+        while len(_directory_cache) > DIRECTORY_CACHE_SIZE:
+            _directory_cache.popitem(last=False)
+
+
+def clear_directory_cache():
+    """
+    Drop all cached directory ids.
+    """
+    with _directory_cache_lock:
+        _directory_cache.clear()
+
+
+@traced()
+def get_or_create_directory(session, dataset, path):
+    """
+    Return the id of an interned directory, creating it and its missing parents.
+
+    Ids are cached per process, so ingesting many files of the same directory
+    hits the database only once. Runs inside the caller's session; the
+    directories are flushed but not committed.
+    """
+    path = normalize_directory(path)
+    directory_id = _cache_get(dataset, path)
+    if directory_id is not None:
+        return directory_id
+
+    key = path_hash(path)
+    directory_id = session.execute(
+        select(Directory.id).where(Directory.dataset == dataset, Directory.path_hash == key)
+    ).scalar()
+    if directory_id is None:
+        parent_path = os.path.dirname(path)
+        parent_id = get_or_create_directory(session, dataset, parent_path) if parent_path != path else None
+        try:
+            with session.begin_nested():
+                directory = Directory(dataset=dataset, path_hash=key, path=path, parent_id=parent_id)
+                session.add(directory)
+            directory_id = directory.id
+        except IntegrityError:
+            # Created concurrently by another request.
+            directory_id = session.execute(
+                select(Directory.id).where(Directory.dataset == dataset, Directory.path_hash == key)
+            ).scalar()
+
+    _cache_put(dataset, path, directory_id)
+    return directory_id
+
+
+@traced()
+def purge_orphan_directories(chunk_size=1000):
+    """
+    Delete directories without files and without subdirectories, e.g. after
+    their tombstoned files were purged. Emptied parents are deleted in later
+    rounds. Each chunk is deleted in its own transaction, and the directory
+    cache is cleared afterwards.
+    Returns the number of deleted directories.
+    """
+    child = aliased(Directory)
+    orphaned = (
+        ~exists().where(Inventory.directory_id == Directory.id),
+        ~exists().where(child.parent_id == Directory.id),
+    )
+    purged = 0
+    try:
+        while True:
+            with SessionLocal() as session:
+                try:
+                    ids = [row.id for row in session.query(Directory.id)
+                           .filter(*orphaned)
+                           .order_by(Directory.id)
+                           .limit(chunk_size)]
+                    if not ids:
+                        break
+                    result = session.execute(
+                        delete(Directory)
+                        .where(Directory.id.in_(ids), *orphaned)
+                        .execution_options(synchronize_session=False)
+                    )
+                    session.commit()
+                    purged += result.rowcount
+                except SQLAlchemyError as e:
+                    session.rollback()
+                    raise RuntimeError(f"Error purging orphaned directories: {e}")
+    finally:
+        if purged:
+            clear_directory_cache()
+    return purged
+
+
+@traced()
+def fetch_directory(dataset, path):
+    """
+    Fetch an interned directory by dataset and path.
+    """
+    with SessionLocal() as session:
+        try:
+            return session.query(Directory).filter_by(
+                dataset=dataset, path_hash=path_hash(normalize_directory(path))
+            ).first()
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching directory: {e}")
+
+
+@traced()
+def list_child_directories(directory_id):
+    """
+    List the direct subdirectories of a directory.
+    """
+    with SessionLocal() as session:
+        try:
+            rows = session.query(Directory).filter_by(parent_id=directory_id).order_by(Directory.path)
+            return [{"directory_id": d.id, "path": d.path} for d in rows]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error listing subdirectories: {e}")
+
+
+@traced()
+def list_directory_files(directory_id, recursive=False, after_id=0, limit=1000):
+    """
+    List the live files of a directory, or of its whole subtree.
+
+    The subtree is resolved with a recursive CTE over the indexed parent_id
+    column and joined on the indexed directory_id, so no path prefix scan
+    is needed. Results are paged by inventory id.
+    """
+    with SessionLocal() as session:
+        try:
+            if recursive:
+                subtree = select(Directory.id).where(Directory.id == directory_id).cte(recursive=True)
+                subtree = subtree.union_all(select(Directory.id).where(Directory.parent_id == subtree.c.id))
+                directory_filter = Inventory.directory_id.in_(select(subtree.c.id))
+            else:
+                directory_filter = Inventory.directory_id == directory_id
+            rows = (session.query(Inventory)
+                    .filter(directory_filter, Inventory.deleted_at.is_(None), Inventory.id > after_id)
+                    .order_by(Inventory.id)
+                    .limit(limit))
+            return [{"id": r.id, "file_id": r.file_id, "path": r.full_path, "filename": r.filename,
+                     "size_bytes": r.size_bytes, "mime_type": r.mime_type} for r in rows]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error listing directory files: {e}")
@@ -1 +1,33 @@
-# duplicates-funktionen
\ No newline at end of file
+# crud/duplicates.py
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import Inventory
+
+@traced()
+def update_duplicates_table(checksum, file_id, size_bytes):
+    """
+    Store the content checksum of a file. Files sharing a checksum are duplicates.
+    """
+    with SessionLocal() as session:
+        try:
+            record = session.query(Inventory).filter_by(file_id=file_id).first()
+            if record is not None:
+                record.checksum = checksum
+                record.size_bytes = size_bytes
+                session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error updating duplicates: {e}")
+
+@traced()
+def fetch_duplicates(checksum):
+    """
+    Fetch all live files with the given checksum.
+    """
+    with SessionLocal() as session:
+        try:
+            rows = session.query(Inventory).filter_by(checksum=checksum, deleted_at=None).order_by(Inventory.id)
+            return [{"file_id": r.file_id, "path": r.full_path, "size_bytes": r.size_bytes} for r in rows]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching duplicates: {e}")
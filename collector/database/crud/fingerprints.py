@@ -0,0 +1,76 @@
+# crud/fingerprints.py
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import VideoFingerprint, Inventory
+
+
+@traced()
+def store_fingerprint(checksum, signature, frames=None):
+    """
+    Store the fingerprint of a file content. If the content was stored
+    concurrently, the existing row is kept.
+    """
+    with SessionLocal() as session:
+        try:
+            session.add(VideoFingerprint(checksum=checksum, signature=f"{signature:016x}", frames=frames,
+                                         created_at=datetime.now()))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error storing fingerprint: {e}")
+
+
+@traced()
+def fetch_fingerprint(checksum):
+    """
+    Fetch the signature of a file content as integer, or None if it has no fingerprint yet.
+    """
+    with SessionLocal() as session:
+        try:
+            row = session.query(VideoFingerprint.signature).filter_by(checksum=checksum).first()
+            return int(row.signature, 16) if row else None
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching fingerprint: {e}")
+
+
+@traced()
+def fetch_fingerprints_after(last_id, limit=10000):
+    """
+    Fetch fingerprints with an id greater than `last_id`, in id order.
+
+    Returns:
+        list: Tuples of (id, checksum, signature as integer).
+    """
+    with SessionLocal() as session:
+        try:
+            rows = (session.query(VideoFingerprint.id, VideoFingerprint.checksum, VideoFingerprint.signature)
+                    .filter(VideoFingerprint.id > last_id)
+                    .order_by(VideoFingerprint.id)
+                    .limit(limit))
+            return [(r.id, r.checksum, int(r.signature, 16)) for r in rows]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching fingerprints: {e}")
+
+
+@traced()
+def fetch_files_by_checksums(checksums):
+    """
+    Fetch the live files of the given contents, grouped by checksum.
+    """
+    with SessionLocal() as session:
+        try:
+            rows = (session.query(Inventory)
+                    .filter(Inventory.checksum.in_(list(checksums)), Inventory.deleted_at.is_(None))
+                    .order_by(Inventory.id))
+            files = {}
+            for r in rows:
+                files.setdefault(r.checksum, []).append(
+                    {"file_id": r.file_id, "path": r.full_path, "size_bytes": r.size_bytes, "dataset": r.dataset}
+                )
+            return files
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching files by checksum: {e}")
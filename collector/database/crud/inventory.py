@@ -1,34 +1,63 @@
 # crud/inventory.py
-from sqlalchemy.exc import SQLAlchemyError
+import os
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from common.tracing import traced
 from ..session import SessionLocal
 from ..models import Inventory
+from .directories import get_or_create_directory, clear_directory_cache
 
-def insert_inventory(file_id, path, filename, size_bytes, mime_type, dataset=None):
+@traced()
+def upsert_inventory(file_id, path, filename, size_bytes, mime_type, dataset=None, scan_generation=None,
+                     extension=None):
     """
-    Insert a new record into the inventory table.
+    Insert a record into the inventory table, or refresh an existing one.
+
+    An existing record is stamped with the scan generation and revived if it
+    was tombstoned. If another request inserts the same file between the
+    lookup and the insert, the insert is retried as an update of that row.
+    Returns True if a new record was inserted.
     """
-    with SessionLocal() as session:
-        try:
-            new_record = Inventory(
-                file_id=file_id,
-                path=path,
-                filename=filename,
-                size_bytes=size_bytes,
-                mime_type=mime_type,
-                dataset=dataset,
-            )
-            session.add(new_record)
-            session.commit()
-        except SQLAlchemyError as e:
-            session.rollback()
-            raise RuntimeError(f"Error inserting inventory: {e}")
+    for attempt in range(2):
+        with SessionLocal() as session:
+            created = False
+            try:
+                directory_id = get_or_create_directory(session, dataset, os.path.dirname(path))
+                record = session.query(Inventory).filter_by(file_id=file_id).first()
+                created = record is None
+                if created:
+                    record = Inventory(file_id=file_id)
+                    session.add(record)
+                record.directory_id = directory_id
+                record.path = None
+                record.filename = filename
+                record.extension = (extension or os.path.splitext(filename)[1]).lower() or None
+                record.size_bytes = size_bytes
+                record.mime_type = mime_type
+                record.dataset = dataset
+                if scan_generation is not None:
+                    record.scan_generation = scan_generation
+                record.deleted_at = None
+                record.deleted_in_generation = None
+                session.commit()
+                return created
+            except IntegrityError as e:
+                session.rollback()
+                clear_directory_cache()
+                if not (created and attempt == 0):
+                    raise RuntimeError(f"Error upserting inventory: {e}")
+            except SQLAlchemyError as e:
+                session.rollback()
+                clear_directory_cache()
+                raise RuntimeError(f"Error upserting inventory: {e}")
 
+@traced()
 def fetch_file_info(file_id):
     """
     Fetch information about a file from the inventory table.
+    Tombstoned files are not returned.
     """
     with SessionLocal() as session:
         try:
-            return session.query(Inventory).filter_by(file_id=file_id).first()
+            return session.query(Inventory).filter_by(file_id=file_id, deleted_at=None).first()
         except SQLAlchemyError as e:
             raise RuntimeError(f"Error fetching file info: {e}")
@@ -0,0 +1,206 @@
+# crud/leases.py
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import TaskQueue, Dataset, ExporterNode, Inventory
+from .task_queue import LOCAL_TASK_TYPES, TASK_MAX_ATTEMPTS, _ready, files_below
+
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', 600))
+MAX_LEASE_BATCH = int(os.getenv('MAX_LEASE_BATCH', 500))
+EXPORTER_TOUCH_SECONDS = float(os.getenv('EXPORTER_TOUCH_SECONDS', 30))
+
+_touched = {}
+_touched_lock = threading.Lock()
+
+
+def touch_exporter(session, name, now=None):
+    """
+    Record that an exporter is alive. Runs inside the caller's session.
+    """
+    now = now or datetime.now()
+    exporter = session.get(ExporterNode, name)
+    if exporter is None:
+        session.add(ExporterNode(name=name, last_seen=now))
+    else:
+        exporter.last_seen = now
+
+
+@traced()
+def record_exporter_activity(name):
+    """
+    Record the heartbeat of an exporter that is sending scan data. Written at
+    most every EXPORTER_TOUCH_SECONDS per exporter, so a busy ingest does not
+    contend on the exporter row. Returns True if the heartbeat was written.
+    """
+    now = time.monotonic()
+    with _touched_lock:
+        if now - _touched.get(name, -EXPORTER_TOUCH_SECONDS) < EXPORTER_TOUCH_SECONDS:
+            return False
+        _touched[name] = now
+    with SessionLocal() as session:
+        try:
+            touch_exporter(session, name)
+            session.commit()
+            return True
+        except SQLAlchemyError as e:
+            session.rollback()
+            with _touched_lock:
+                _touched.pop(name, None)
+            raise RuntimeError(f"Error recording heartbeat of {name}: {e}")
+
+
+@traced()
+def lease_tasks(exporter, task_types=LOCAL_TASK_TYPES, limit=100, lease_seconds=LEASE_SECONDS):
+    """
+    Lease ready tasks of the datasets owned by an exporter. If a dataset name
+    is registered in several clusters, only the files below the paths of the
+    exporter's registrations are leased.
+
+    The tasks are switched to RUNNING with the exporter as lease owner. A
+    lease that is not completed or renewed before it expires is handed back
+    to the queue by `expire_leases`.
+
+    Returns:
+        list: Dictionaries with queue_id, task_type, file_id, dataset and the
+        path of the file (None if the file is no longer in the inventory).
+    """
+    now = datetime.now()
+    task_types = [t for t in task_types if t in LOCAL_TASK_TYPES]
+    with SessionLocal(expire_on_commit=False) as session:
+        try:
+            touch_exporter(session, exporter, now)
+            owned = _owned_scope(session, exporter)
+            tasks = []
+            if owned and task_types:
+                tasks = (session.query(TaskQueue)
+                         .filter(*_ready(now), or_(*owned), TaskQueue.task_type.in_(task_types))
+                         .order_by(TaskQueue.priority.desc(), TaskQueue.id)
+                         .limit(min(limit, MAX_LEASE_BATCH))
+                         .with_for_update(skip_locked=True)
+                         .all())
+                for task in tasks:
+                    task.status = "RUNNING"
+                    task.started_at = now
+                    task.attempts = (task.attempts or 0) + 1
+                    task.lease_owner = exporter
+                    task.lease_expires_at = now + timedelta(seconds=lease_seconds)
+            session.commit()
+
+            files = {}
+            if tasks:
+                rows = session.query(Inventory).filter(Inventory.file_id.in_([t.file_id for t in tasks]),
+                                                       Inventory.deleted_at.is_(None))
+                files = {r.file_id: r.full_path for r in rows}
+            return [{"queue_id": t.id, "task_type": t.task_type, "file_id": t.file_id, "dataset": t.dataset,
+                     "path": files.get(t.file_id)} for t in tasks]
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error leasing tasks to {exporter}: {e}")
+
+
+def _owned_scope(session, exporter):
+    """
+    One filter per dataset name the exporter owns, limited to the paths of
+    its registrations if other registrations of the name belong to others.
+    """
+    names = session.query(Dataset.name).filter_by(owner=exporter).scalar_subquery()
+    owned = {}
+    for name, owner, path in session.query(Dataset.name, Dataset.owner, Dataset.path).filter(Dataset.name.in_(names)):
+        owned.setdefault(name, []).append((owner, path))
+    scope = []
+    for name, registrations in owned.items():
+        if all(owner == exporter for owner, _ in registrations):
+            scope.append(TaskQueue.dataset == name)
+        else:
+            paths = [path for owner, path in registrations if owner == exporter]
+            scope.append(and_(TaskQueue.dataset == name, TaskQueue.file_id.in_(files_below(name, paths))))
+    return scope
+
+
+@traced()
+def renew_leases(exporter, lease_seconds=LEASE_SECONDS):
+    """
+    Extend all running leases of an exporter and record its heartbeat.
+    Returns the number of renewed leases.
+    """
+    now = datetime.now()
+    with SessionLocal() as session:
+        try:
+            touch_exporter(session, exporter, now)
+            result = session.execute(
+                update(TaskQueue)
+                .where(TaskQueue.status == "RUNNING", TaskQueue.lease_owner == exporter)
+                .values(lease_expires_at=now + timedelta(seconds=lease_seconds))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return result.rowcount
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error renewing leases of {exporter}: {e}")
+
+
+@traced()
+def fetch_leased_task(exporter, queue_id):
+    """
+    Fetch a running task if it is leased by the exporter, otherwise None.
+    """
+    with SessionLocal() as session:
+        try:
+            return (session.query(TaskQueue)
+                    .filter_by(id=queue_id, status="RUNNING", lease_owner=exporter)
+                    .first())
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching leased task {queue_id}: {e}")
+
+
+@traced()
+def expire_leases():
+    """
+    Hand expired leases back to the queue. The attempt counter is kept, so a
+    file that keeps killing exporters still ends up dead-lettered.
+    Returns the number of expired leases.
+    """
+    now = datetime.now()
+    expired = (TaskQueue.status == "RUNNING", TaskQueue.lease_owner.isnot(None), TaskQueue.lease_expires_at < now)
+    with SessionLocal() as session:
+        try:
+            dead = session.execute(
+                update(TaskQueue)
+                .where(*expired, TaskQueue.attempts >= TASK_MAX_ATTEMPTS)
+                .values(status="DEAD", is_completed=True, finished_at=now, last_error="Lease expired",
+                        lease_owner=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            requeued = session.execute(
+                update(TaskQueue)
+                .where(*expired)
+                .values(status="PENDING", lease_owner=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return dead.rowcount + requeued.rowcount
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error expiring leases: {e}")
+
+
+@traced()
+def fetch_exporters():
+    """
+    List the known exporters with their last heartbeat and owned datasets.
+    """
+    with SessionLocal() as session:
+        try:
+            owned = {}
+            for name, owner in session.query(Dataset.name, Dataset.owner).filter(Dataset.owner.isnot(None)):
+                owned.setdefault(owner, []).append(name)
+            return [{"name": e.name, "last_seen": e.last_seen.isoformat(), "datasets": owned.get(e.name, [])}
+                    for e in session.query(ExporterNode).order_by(ExporterNode.name)]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching exporters: {e}")
@@ -0,0 +1,65 @@
+# crud/media.py
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import MediaMetadata, Inventory
+
+MEDIA_FIELDS = ("format_name", "duration", "bitrate", "video_codec", "audio_codec", "width", "height", "frame_rate")
+
+
+def media_to_dict(media):
+    """
+    Convert a media metadata row into a dictionary.
+    """
+    result = {"checksum": media.checksum, "probed_at": media.probed_at.isoformat()}
+    result.update({field: getattr(media, field) for field in MEDIA_FIELDS})
+    return result
+
+
+@traced()
+def fetch_media_metadata(checksum):
+    """
+    Fetch the probed metadata of a file content, or None if it was not probed yet.
+    """
+    with SessionLocal() as session:
+        try:
+            media = session.query(MediaMetadata).filter_by(checksum=checksum).first()
+            return media_to_dict(media) if media else None
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching media metadata: {e}")
+
+
+@traced()
+def fetch_file_media_metadata(file_id):
+    """
+    Fetch the probed metadata of a file by its file id.
+    """
+    with SessionLocal() as session:
+        try:
+            media = (session.query(MediaMetadata)
+                     .join(Inventory, Inventory.checksum == MediaMetadata.checksum)
+                     .filter(Inventory.file_id == file_id)
+                     .first())
+            return media_to_dict(media) if media else None
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching media metadata of file {file_id}: {e}")
+
+
+@traced()
+def store_media_metadata(checksum, metadata):
+    """
+    Store probed metadata for a file content. If the content was stored
+    concurrently, the existing row is kept.
+    """
+    with SessionLocal() as session:
+        try:
+            media = MediaMetadata(checksum=checksum, probed_at=datetime.now(),
+                                  **{field: metadata.get(field) for field in MEDIA_FIELDS})
+            session.add(media)
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error storing media metadata: {e}")
@@ -0,0 +1,274 @@
+# crud/scans.py
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import Inventory, ScanGeneration, Dataset, Directory
+
+SWEEP_CHUNK_SIZE = int(os.getenv('SWEEP_CHUNK_SIZE', 1000))
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def generation_to_dict(generation):
+    """
+    Convert a scan generation row into a dictionary.
+    """
+    return {
+        "generation_id": generation.id,
+        "dataset": generation.dataset,
+        "cluster": generation.cluster,
+        "scan_type": generation.scan_type,
+        "status": generation.status,
+        "started_at": generation.started_at.isoformat() if generation.started_at else None,
+        "finished_at": generation.finished_at.isoformat() if generation.finished_at else None,
+        "files_seen": generation.files_seen,
+        "files_removed": generation.files_removed,
+    }
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@traced()
+def start_scan_generation(dataset, scan_type, cluster=None):
+    """
+    Open a new scan generation for a dataset and return it.
+    """
+    with SessionLocal() as session:
+        try:
+            generation = ScanGeneration(dataset=dataset, cluster=cluster, scan_type=scan_type, status="RUNNING",
+                                        started_at=datetime.now())
+            session.add(generation)
+            session.commit()
+            return generation_to_dict(generation)
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error starting scan generation: {e}")
+
+
+@traced()
+def fetch_scan_generation(generation_id):
+    """
+    Fetch a scan generation by id.
+    """
+    with SessionLocal() as session:
+        try:
+            generation = session.get(ScanGeneration, generation_id)
+            return generation_to_dict(generation) if generation else None
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching scan generation: {e}")
+
+
+@traced()
+def fetch_scan_generations(dataset=None, limit=50):
+    """
+    Fetch the most recent scan generations, optionally for one dataset only.
+    """
+    with SessionLocal() as session:
+        try:
+            query = session.query(ScanGeneration)
+            if dataset:
+                query = query.filter_by(dataset=dataset)
+            return [generation_to_dict(g) for g in query.order_by(ScanGeneration.id.desc()).limit(limit)]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching scan generations: {e}")
+
+
+@traced()
+def stamp_generation(generation_id, dataset, file_ids, chunk_size=SWEEP_CHUNK_SIZE):
+    """
+    Mark files as seen by a scan generation. Tombstoned files are revived.
+    Each chunk is committed separately to keep lock times short.
+    Returns the ids of the files that are not in the inventory of the dataset,
+    so the exporter only sends the full records of those.
+    """
+    unknown = []
+    for chunk in _chunks(list(file_ids), chunk_size):
+        with SessionLocal() as session:
+            try:
+                known = set(session.execute(
+                    select(Inventory.file_id).where(Inventory.dataset == dataset, Inventory.file_id.in_(chunk))
+                ).scalars())
+                if known:
+                    session.execute(
+                        update(Inventory)
+                        .where(Inventory.dataset == dataset, Inventory.file_id.in_(known))
+                        .values(scan_generation=generation_id, deleted_at=None, deleted_in_generation=None)
+                        .execution_options(synchronize_session=False)
+                    )
+                    session.commit()
+                unknown.extend(file_id for file_id in chunk if file_id not in known)
+            except SQLAlchemyError as e:
+                session.rollback()
+                raise RuntimeError(f"Error stamping scan generation {generation_id}: {e}")
+    return unknown
+
+
+@traced()
+def finish_scan_generation(generation_id, status, files_seen=None):
+    """
+    Close a scan generation. Returns the updated generation, or None if it does not exist.
+
+    A successful full scan that saw no files while the dataset still has
+    live files is closed as FAILURE: an unmounted or unreadable dataset
+    looks empty, and sweeping it would tombstone every file.
+    """
+    with SessionLocal() as session:
+        try:
+            generation = session.get(ScanGeneration, generation_id)
+            if generation is None:
+                return None
+            if (status == "SUCCESS" and generation.scan_type == "full" and files_seen == 0
+                    and _has_live_files(session, generation_to_dict(generation))):
+                status = "FAILURE"
+            generation.status = status
+            generation.files_seen = files_seen
+            generation.finished_at = datetime.now()
+            session.commit()
+            return generation_to_dict(generation)
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error finishing scan generation {generation_id}: {e}")
+
+
+def _sweep_scope(generation):
+    """
+    Restrict a sweep to the files of the generation's cluster.
+
+    Inventory rows carry the dataset name only. If the name is registered in
+    several clusters, the sweep is limited to the directories below the
+    dataset path of the generation's cluster.
+    """
+    with SessionLocal() as session:
+        datasets = session.query(Dataset.cluster, Dataset.path).filter_by(name=generation["dataset"]).all()
+    if len(datasets) < 2:
+        return ()
+    root = next((path for cluster, path in datasets if cluster == generation["cluster"]), None)
+    if generation["cluster"] is None or not root:
+        raise RuntimeError(f"Dataset {generation['dataset']} exists in several clusters; "
+                           f"scan generation {generation['generation_id']} has no cluster to sweep.")
+    root = root.rstrip("/")
+    directories = select(Directory.id).where(Directory.dataset == generation["dataset"],
+                                             or_(Directory.path == root,
+                                                 Directory.path.startswith(f"{root}/", autoescape=True)))
+    return (Inventory.directory_id.in_(directories),)
+
+
+def _has_live_files(session, generation):
+    try:
+        scope = _sweep_scope(generation)
+    except RuntimeError:
+        scope = ()
+    return session.query(Inventory.id).filter(Inventory.dataset == generation["dataset"],
+                                              Inventory.deleted_at.is_(None), *scope).first() is not None
+
+
+@traced()
+def sweep_generation(generation_id, chunk_size=SWEEP_CHUNK_SIZE):
+    """
+    Tombstone all live files of the generation's dataset that the scan did not see.
+
+    The candidate rows are walked in primary key order and updated in chunks,
+    each in its own transaction, so the table is never locked for long. If
+    the dataset name is shared by several clusters, only the files below the
+    dataset path of the generation's cluster are swept.
+    Returns the number of tombstoned rows.
+    """
+    generation = fetch_scan_generation(generation_id)
+    if generation is None:
+        raise RuntimeError(f"Unknown scan generation {generation_id}")
+
+    not_seen = (
+        Inventory.dataset == generation["dataset"],
+        Inventory.deleted_at.is_(None),
+        or_(Inventory.scan_generation.is_(None), Inventory.scan_generation < generation_id),
+        *_sweep_scope(generation),
+    )
+    removed = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as session:
+            try:
+                ids = [row.id for row in session.query(Inventory.id)
+                       .filter(*not_seen, Inventory.id > last_id)
+                       .order_by(Inventory.id)
+                       .limit(chunk_size)]
+                if not ids:
+                    break
+                result = session.execute(
+                    update(Inventory)
+                    .where(Inventory.id.in_(ids), *not_seen)
+                    .values(deleted_at=datetime.now(), deleted_in_generation=generation_id)
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+                removed += result.rowcount
+                last_id = ids[-1]
+            except SQLAlchemyError as e:
+                session.rollback()
+                raise RuntimeError(f"Error sweeping scan generation {generation_id}: {e}")
+
+    with SessionLocal() as session:
+        try:
+            session.execute(
+                update(ScanGeneration)
+                .where(ScanGeneration.id == generation_id)
+                .values(files_removed=removed)
+            )
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error recording sweep result of generation {generation_id}: {e}")
+    return removed
+
+
+@traced()
+def fetch_removed_files(generation_id, limit=1000):
+    """
+    Fetch the files tombstoned by the sweep of a scan generation.
+    """
+    with SessionLocal() as session:
+        try:
+            rows = (session.query(Inventory)
+                    .filter_by(deleted_in_generation=generation_id)
+                    .order_by(Inventory.id)
+                    .limit(limit))
+            return [{"file_id": r.file_id, "path": r.full_path, "size_bytes": r.size_bytes,
+                     "deleted_at": r.deleted_at.isoformat() if r.deleted_at else None} for r in rows]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching removed files: {e}")
+
+
+@traced()
+def purge_tombstones(retention_days=TOMBSTONE_RETENTION_DAYS, chunk_size=SWEEP_CHUNK_SIZE):
+    """
+    Permanently delete files that have been tombstoned for longer than the retention period.
+    Rows are deleted in chunks, each in its own transaction.
+    Returns the number of deleted rows.
+    """
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    purged = 0
+    while True:
+        with SessionLocal() as session:
+            try:
+                ids = [row.id for row in session.query(Inventory.id)
+                       .filter(Inventory.deleted_at.isnot(None), Inventory.deleted_at < cutoff)
+                       .order_by(Inventory.id)
+                       .limit(chunk_size)]
+                if not ids:
+                    break
+                result = session.execute(
+                    delete(Inventory)
+                    .where(Inventory.id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+                purged += result.rowcount
+            except SQLAlchemyError as e:
+                session.rollback()
+                raise RuntimeError(f"Error purging tombstones: {e}")
+    return purged
@@ -0,0 +1,143 @@
+# crud/search.py
+import base64
+import json
+import os
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import Inventory, Directory
+
+FULLTEXT_INDEX_NAME = "ft_inventory_filename"
+SEARCH_FULLTEXT = os.getenv('SEARCH_FULLTEXT', '').lower() in ('1', 'true', 'yes')
+STREAM_BATCH_SIZE = int(os.getenv('SEARCH_STREAM_BATCH_SIZE', 500))
+MAX_PAGE_SIZE = 1000
+NGRAM_TOKEN_SIZE = 2
+
+
+def encode_page_token(last_id):
+    """
+    Encode the keyset position after the last returned row into an opaque token.
+    """
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode("utf-8")).decode("ascii")
+
+
+def decode_page_token(token):
+    """
+    Decode a page token into the id to continue after. Raises ValueError on invalid tokens.
+    """
+    if not token:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(token.encode("ascii")))["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page token: {e}")
+
+
+def fulltext_phrases(term):
+    """
+    Turn a filename substring into a BOOLEAN MODE search string that requires
+    every part of it as a phrase. Double quotes cannot be escaped inside a
+    phrase, so the term is split on them; parts shorter than an n-gram token
+    cannot be matched by the index and are left to the LIKE recheck.
+    Returns None if no part can use the index.
+    """
+    parts = [part for part in term.split('"') if len(part.strip()) >= NGRAM_TOKEN_SIZE]
+    return " ".join(f'+"{part}"' for part in parts) or None
+
+
+def build_search_query(filters, after_id=0, limit=None):
+    """
+    Build the search statement for the given filters.
+
+    Rows are ordered by id and continued with `id > after_id` (keyset
+    pagination), so deep pages cost the same as the first one. Equality
+    filters on dataset, mime type and extension hit the composite
+    (dataset, ..., id) indexes. Size ranges use (dataset, id, size_bytes):
+    a range on a leading size column would return rows out of id order and
+    need a filesort, so the index is walked in id order instead and the
+    size is checked from the index entries.
+    """
+    query = (select(Inventory.id, Inventory.file_id, Inventory.path, Directory.path.label("directory"),
+                    Inventory.filename, Inventory.extension, Inventory.size_bytes, Inventory.mime_type,
+                    Inventory.dataset)
+             .outerjoin(Directory, Inventory.directory_id == Directory.id)
+             .where(Inventory.deleted_at.is_(None), Inventory.id > after_id))
+
+    if filters.get("dataset"):
+        query = query.where(Inventory.dataset == filters["dataset"])
+    if filters.get("mime_type"):
+        query = query.where(Inventory.mime_type == filters["mime_type"])
+    if filters.get("extension"):
+        extension = filters["extension"].lower()
+        query = query.where(Inventory.extension == (extension if extension.startswith(".") else f".{extension}"))
+    if filters.get("min_size") is not None:
+        query = query.where(Inventory.size_bytes >= filters["min_size"])
+    if filters.get("max_size") is not None:
+        query = query.where(Inventory.size_bytes <= filters["max_size"])
+    if filters.get("prefix"):
+        query = query.where(Inventory.filename.startswith(filters["prefix"], autoescape=True))
+    if filters.get("contains"):
+        phrases = fulltext_phrases(filters["contains"])
+        if SEARCH_FULLTEXT and phrases and SessionLocal.kw["bind"].dialect.name == "mysql":
+            # The n-gram index narrows the candidates, LIKE rechecks the exact substring.
+            query = query.where(Inventory.filename.match(phrases))
+        query = query.where(Inventory.filename.contains(filters["contains"], autoescape=True))
+
+    query = query.order_by(Inventory.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def search_row_to_dict(row):
+    """
+    Convert a search result row into a dictionary.
+    """
+    return {
+        "id": row.id,
+        "file_id": row.file_id,
+        "path": os.path.join(row.directory, row.filename) if row.directory else row.path,
+        "filename": row.filename,
+        "extension": row.extension,
+        "size_bytes": row.size_bytes,
+        "mime_type": row.mime_type,
+        "dataset": row.dataset,
+    }
+
+
+@traced()
+def search_inventory(filters, after_id=0, limit=100):
+    """
+    Fetch one page of search results.
+
+    Returns:
+        tuple: The result rows and the token of the next page (None on the last page).
+    """
+    with SessionLocal() as session:
+        try:
+            rows = [search_row_to_dict(r) for r in session.execute(build_search_query(filters, after_id, limit))]
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error searching inventory: {e}")
+    next_token = encode_page_token(rows[-1]["id"]) if rows and len(rows) == limit else None
+    return rows, next_token
+
+
+def stream_inventory(filters, after_id=0, limit=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Yield search results one by one from a server-side cursor.
+
+    The rows are fetched from the database in batches of `batch_size`
+    without building ORM objects, so memory use does not grow with the
+    size of the result.
+    """
+    with SessionLocal() as session:
+        try:
+            result = session.execute(
+                build_search_query(filters, after_id, limit)
+                .execution_options(stream_results=True, max_row_buffer=batch_size)
+            )
+            for row in result:
+                yield search_row_to_dict(row)
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error streaming inventory search: {e}")
@@ -1,27 +1,325 @@
 # crud/task_queue.py
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, select, update
 from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
 from ..session import SessionLocal
-from ..models import TaskQueue
+from ..models import TaskQueue, Dataset, Directory, ExporterNode, Inventory
 
-def add_task_to_queue(task_type, file_id=None):
+TASK_PRIORITIES = {
+    'CALC_FILEHASH': 20,
+    'PROBE_MEDIA': 10,
+    'CALC_FINGERPRINT': 0,
+}
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+TASK_BACKOFF_SECONDS = float(os.getenv('TASK_BACKOFF_SECONDS', 60))
+TASK_BACKOFF_MAX_SECONDS = float(os.getenv('TASK_BACKOFF_MAX_SECONDS', 86400))
+LANE_REFRESH_SECONDS = float(os.getenv('LANE_REFRESH_SECONDS', 30))
+EXPORTER_SILENCE_SECONDS = float(os.getenv('EXPORTER_SILENCE_SECONDS', 300))
+STALE_TASK_SECONDS = float(os.getenv('STALE_TASK_SECONDS', 3600))
+
+# Task types an exporter runs itself for the datasets stored on its host.
+LOCAL_TASK_TYPES = ('CALC_FILEHASH',)
+
+
+def _ready(now):
+    return (
+        TaskQueue.status == "PENDING",
+        or_(TaskQueue.not_before.is_(None), TaskQueue.not_before <= now),
+    )
+
+
+def files_below(dataset, paths):
+    """
+    Select the file_ids of the dataset's files below any of the paths.
+
+    Tasks and inventory rows carry the dataset name only; if the name is
+    registered in several clusters, the dataset path tells them apart.
+    """
+    roots = [path.rstrip("/") for path in paths if path]
+    directories = select(Directory.id).where(
+        Directory.dataset == dataset,
+        or_(False, *(or_(Directory.path == root, Directory.path.startswith(f"{root}/", autoescape=True))
+                     for root in roots)))
+    return select(Inventory.file_id).where(Inventory.directory_id.in_(directories))
+
+
+def live_owned_datasets(session, now):
+    """
+    The datasets whose owning exporter has been seen within
+    EXPORTER_SILENCE_SECONDS, as {name: paths}. The paths are None if every
+    registration of the name is owned live, otherwise the paths of the live
+    owned registrations.
+    """
+    cutoff = now - timedelta(seconds=EXPORTER_SILENCE_SECONDS)
+    live = {row.name for row in session.query(ExporterNode.name).filter(ExporterNode.last_seen >= cutoff)}
+    owned = {}
+    shared = set()
+    for name, owner, path in session.query(Dataset.name, Dataset.owner, Dataset.path):
+        if owner in live:
+            owned.setdefault(name, []).append(path)
+        else:
+            shared.add(name)
+    return {name: paths if name in shared else None for name, paths in owned.items()}
+
+
+def backoff_delay(attempts):
+    """
+    Seconds to wait before retry number `attempts`: exponential with jitter, capped.
+    """
+    delay = min(TASK_BACKOFF_SECONDS * (2 ** (attempts - 1)), TASK_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class FairShareScheduler:
     """
-    Add a task to the task queue.
+    Weighted round-robin over the datasets with ready tasks.
+
+    Datasets are picked by smooth weighted round-robin using the dataset
+    weight, so a huge backlog in one dataset cannot starve the others. The
+    task priority only orders the task types within the turn of a dataset:
+    a dataset with hashing left gets its next hash before its next probe,
+    but it does not get more turns for having several task types. The
+    dataset list is cached for LANE_REFRESH_SECONDS.
+
+    Tasks of LOCAL_TASK_TYPES are left to the exporter while the dataset has
+    a live owner; the collector only takes them over once the owner is silent.
+    If the dataset name is registered in several clusters, only the files
+    below the paths of the live owned registrations are left out.
+    """
+
+    def __init__(self, refresh_seconds=LANE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._task_types = {}
+        self._owned_paths = {}
+        self._weights = {}
+        self._credits = {}
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, session, now):
+        rows = (session.query(TaskQueue.dataset, TaskQueue.task_type, func.max(TaskQueue.priority))
+                .filter(*_ready(now))
+                .group_by(TaskQueue.dataset, TaskQueue.task_type)
+                .all())
+        owned = live_owned_datasets(session, now)
+        self._owned_paths = {dataset: paths for dataset, paths in owned.items() if paths is not None}
+        self._task_types = {}
+        for dataset, task_type, _ in sorted(rows, key=lambda row: -row[2]):
+            if not (task_type in LOCAL_TASK_TYPES and dataset in owned and owned[dataset] is None):
+                self._task_types.setdefault(dataset, []).append(task_type)
+        self._weights = {name: max(weight or 1, 1) for name, weight in
+                         session.query(Dataset.name, func.max(Dataset.weight)).group_by(Dataset.name)}
+        self._credits = {dataset: self._credits.get(dataset, 0) for dataset in self._task_types}
+        self._refreshed_at = time.monotonic()
+
+    def _next_dataset(self):
+        total = 0
+        best = None
+        for dataset in self._task_types:
+            weight = self._weights.get(dataset, 1)
+            self._credits[dataset] += weight
+            total += weight
+            if best is None or self._credits[dataset] > self._credits[best]:
+                best = dataset
+        self._credits[best] -= total
+        return best
+
+    def _drop_task_type(self, dataset, task_type):
+        self._task_types[dataset].remove(task_type)
+        if not self._task_types[dataset]:
+            del self._task_types[dataset]
+            self._credits.pop(dataset, None)
+
+    def claim(self, session):
+        """
+        Claim the next task according to fair share and priority.
+        Returns the claimed task (switched to RUNNING), or None.
+        """
+        now = datetime.now()
+        with self._lock:
+            if not self._task_types or time.monotonic() - self._refreshed_at > self.refresh_seconds:
+                self._refresh(session, now)
+            while self._task_types:
+                dataset = self._next_dataset()
+                same_dataset = TaskQueue.dataset.is_(None) if dataset is None else TaskQueue.dataset == dataset
+                # One query per task type: status, dataset and task_type are equalities, so
+                # ix_task_queue_ready_lane returns the lane in (priority DESC, id) order without a sort.
+                for task_type in list(self._task_types[dataset]):
+                    not_owned = ()
+                    if task_type in LOCAL_TASK_TYPES and dataset in self._owned_paths:
+                        not_owned = (TaskQueue.file_id.notin_(files_below(dataset, self._owned_paths[dataset])),)
+                    task = (session.query(TaskQueue)
+                            .filter(*_ready(now), same_dataset, TaskQueue.task_type == task_type, *not_owned)
+                            .order_by(TaskQueue.priority.desc(), TaskQueue.id)
+                            .with_for_update(skip_locked=True)
+                            .first())
+                    if task is not None:
+                        task.status = "RUNNING"
+                        task.started_at = now
+                        task.attempts = (task.attempts or 0) + 1
+                        return task
+                    self._drop_task_type(dataset, task_type)
+        return None
+
+
+scheduler = FairShareScheduler()
+
+
+@traced()
+def add_task_to_queue(task_type, file_id=None, dataset=None, priority=None):
+    """
+    Add a task to the task queue. Without an explicit priority, the default
+    priority of the task type is used.
     """
     with SessionLocal() as session:
         try:
-            task = TaskQueue(task_type=task_type, file_id=file_id)
+            task = TaskQueue(task_type=task_type, file_id=file_id, dataset=dataset,
+                             priority=TASK_PRIORITIES.get(task_type, 0) if priority is None else priority)
             session.add(task)
             session.commit()
         except SQLAlchemyError as e:
             session.rollback()
             raise RuntimeError(f"Error adding task to queue: {e}")
 
+@traced()
 def fetch_pending_task():
     """
-    Fetch the next pending task from the task queue.
+    Claim the next pending task from the task queue.
+
+    The task is switched to RUNNING in the same transaction, so a task that
+    is still being processed is not handed out a second time. Tasks waiting
+    for a retry (`not_before` in the future) are skipped.
     """
-    with SessionLocal() as session:
+    with SessionLocal(expire_on_commit=False) as session:
         try:
-            return session.query(TaskQueue).filter_by(is_completed=False).first()
+            task = scheduler.claim(session)
+            session.commit()
+            return task
         except SQLAlchemyError as e:
+            session.rollback()
             raise RuntimeError(f"Error fetching pending task: {e}")
+
+@traced()
+def mark_task_completed(queue_id, status, error=None, retry=True):
+    """
+    Mark a task as completed with the given status ('OK' or 'FAIL').
+
+    A failed task is rescheduled with exponential backoff until it reached
+    TASK_MAX_ATTEMPTS; then, or if `retry` is False, it is moved to the DEAD
+    (dead-letter) state and no longer handed out.
+    """
+    with SessionLocal() as session:
+        try:
+            task = session.get(TaskQueue, queue_id)
+            if task is None:
+                return
+            now = datetime.now()
+            task.finished_at = now
+            task.lease_owner = None
+            task.lease_expires_at = None
+            if status == 'FAIL':
+                task.last_error = str(error) if error else task.last_error
+                if retry and (task.attempts or 0) < TASK_MAX_ATTEMPTS:
+                    task.status = "PENDING"
+                    task.is_completed = False
+                    task.not_before = now + timedelta(seconds=backoff_delay(task.attempts or 1))
+                else:
+                    task.status = "DEAD"
+                    task.is_completed = True
+            else:
+                task.status = status
+                task.is_completed = True
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error marking task {queue_id} as completed: {e}")
+
+@traced()
+def reap_stale_tasks(stale_seconds=STALE_TASK_SECONDS):
+    """
+    Hand tasks the collector worker has been running for longer than
+    `stale_seconds` back to the queue, e.g. after a worker restart or a lost
+    prober callback. Exporter leases are left to `expire_leases`. Tasks out
+    of attempts are dead-lettered.
+    Returns the number of reaped tasks.
+    """
+    now = datetime.now()
+    stale = (TaskQueue.status == "RUNNING", TaskQueue.lease_owner.is_(None),
+             TaskQueue.started_at < now - timedelta(seconds=stale_seconds))
+    with SessionLocal() as session:
+        try:
+            dead = session.execute(
+                update(TaskQueue)
+                .where(*stale, TaskQueue.attempts >= TASK_MAX_ATTEMPTS)
+                .values(status="DEAD", is_completed=True, finished_at=now, last_error="Task timed out")
+                .execution_options(synchronize_session=False)
+            )
+            requeued = session.execute(
+                update(TaskQueue)
+                .where(*stale)
+                .values(status="PENDING", last_error="Task timed out")
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return dead.rowcount + requeued.rowcount
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error reaping stale tasks: {e}")
+
+@traced()
+def fetch_queue_backlog():
+    """
+    Count the open and dead-lettered tasks per dataset and task type.
+
+    Returns:
+        list: Dictionaries with dataset, task_type, pending, waiting (backoff),
+        running and dead counts.
+    """
+    now = datetime.now()
+    with SessionLocal() as session:
+        try:
+            rows = (session.query(TaskQueue.dataset, TaskQueue.task_type, TaskQueue.status,
+                                  (TaskQueue.not_before > now).label("waiting"), func.count())
+                    .filter(TaskQueue.status.in_(("PENDING", "RUNNING", "DEAD")))
+                    .group_by(TaskQueue.dataset, TaskQueue.task_type, TaskQueue.status, "waiting")
+                    .all())
+        except SQLAlchemyError as e:
+            raise RuntimeError(f"Error fetching queue backlog: {e}")
+
+    backlog = {}
+    for dataset, task_type, status, waiting, count in rows:
+        entry = backlog.setdefault((dataset, task_type), {
+            "dataset": dataset, "task_type": task_type, "pending": 0, "waiting": 0, "running": 0, "dead": 0,
+        })
+        if status == "PENDING":
+            entry["waiting" if waiting else "pending"] += count
+        else:
+            entry[status.lower()] += count
+    return sorted(backlog.values(), key=lambda e: (e["dataset"] or "", e["task_type"]))
+
+@traced()
+def requeue_dead_tasks(dataset=None, task_type=None):
+    """
+    Move dead-lettered tasks back to PENDING with a fresh attempt budget.
+    Returns the number of requeued tasks.
+    """
+    with SessionLocal() as session:
+        try:
+            query = session.query(TaskQueue).filter(TaskQueue.status == "DEAD")
+            if dataset:
+                query = query.filter(TaskQueue.dataset == dataset)
+            if task_type:
+                query = query.filter(TaskQueue.task_type == task_type)
+            count = query.update({TaskQueue.status: "PENDING", TaskQueue.is_completed: False,
+                                  TaskQueue.attempts: 0, TaskQueue.not_before: None},
+                                 synchronize_session=False)
+            session.commit()
+            return count
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error requeueing dead tasks: {e}")
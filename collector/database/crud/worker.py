@@ -42,7 +42,7 @@ def process_queue(volume_mapping):
                 if task.task_type == 'CALC_FILEHASH':
                     file_info = fetch_file_info(task.file_id)
                     if file_info:
-                        file_path = file_info.path
+                        file_path = file_info.full_path
                         logger.info(f"Computing checksum for path {file_path}...")
                         file_checksum = compute_file_checksum(file_path)
                         if file_checksum:
@@ -0,0 +1,43 @@
+# crud/worker_control.py
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from common.tracing import traced
+from ..session import SessionLocal
+from ..models import WorkerControl
+
+WORKER_CONTROL_ID = 1
+
+
+@traced()
+def fetch_worker_status(session=None):
+    """
+    Fetch the desired worker state ('RUNNING' or 'STOPPED').
+    Uses the given session, or opens its own.
+    """
+    if session is None:
+        with SessionLocal() as own_session:
+            return fetch_worker_status(own_session)
+    try:
+        control = session.get(WorkerControl, WORKER_CONTROL_ID)
+        return control.status if control else "STOPPED"
+    except SQLAlchemyError as e:
+        raise RuntimeError(f"Error fetching worker status: {e}")
+
+
+@traced()
+def set_worker_status(status):
+    """
+    Store the desired worker state.
+    """
+    with SessionLocal() as session:
+        try:
+            control = session.get(WorkerControl, WORKER_CONTROL_ID)
+            if control is None:
+                control = WorkerControl(id=WORKER_CONTROL_ID)
+                session.add(control)
+            control.status = status
+            control.updated_at = datetime.now()
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise RuntimeError(f"Error setting worker status: {e}")
@@ -0,0 +1,245 @@
+# migrations.py
+"""
+Schema Migrations
+
+Upgrades the existing collector tables in place. Run from the collector
+directory with `python -m database.migrations`.
+"""
+
+import argparse
+import logging
+import os
+from sqlalchemy import inspect, text, select, update
+from .session import engine, SessionLocal, init_db
+from .models import Inventory, TaskQueue
+from .crud.directories import get_or_create_directory, clear_directory_cache
+from .crud.search import FULLTEXT_INDEX_NAME
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_COLUMNS = {
+    "scan_generation": "INTEGER NULL",
+    "deleted_at": "DATETIME NULL",
+    "deleted_in_generation": "INTEGER NULL",
+    "directory_id": "INTEGER NULL",
+    "extension": "VARCHAR(32) NULL",
+    "checksum": "VARCHAR(64) NULL",
+}
+
+TASK_QUEUE_COLUMNS = {
+    "status": "VARCHAR(16) NOT NULL DEFAULT 'PENDING'",
+    "started_at": "DATETIME NULL",
+    "finished_at": "DATETIME NULL",
+    "dataset": "VARCHAR(255) NULL",
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "not_before": "DATETIME NULL",
+    "last_error": "TEXT NULL",
+    "lease_owner": "VARCHAR(255) NULL",
+    "lease_expires_at": "DATETIME NULL",
+}
+
+DATASET_COLUMNS = {
+    "weight": "INTEGER NOT NULL DEFAULT 1",
+    "owner": "VARCHAR(255) NULL",
+}
+
+OBSOLETE_INDEXES = {
+    "inventory": ("ix_inventory_dataset_size",),
+    "task_queue": ("ix_task_queue_lane",),
+}
+
+SCAN_GENERATION_COLUMNS = {
+    "cluster": "VARCHAR(255) NULL",
+}
+
+
+def _add_missing_columns(conn, inspector, table_name, columns):
+    existing_columns = {c["name"] for c in inspector.get_columns(table_name)}
+    for name, ddl in columns.items():
+        if name not in existing_columns:
+            logger.info(f"Adding column {table_name}.{name}")
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+
+
+def _create_missing_indexes(inspector, model):
+    existing_indexes = {i["name"] for i in inspector.get_indexes(model.__tablename__)}
+    for index in model.__table__.indexes:
+        if index.name not in existing_indexes:
+            logger.info(f"Creating index {index.name}")
+            index.create(bind=engine)
+
+
+def _upgrade_dataset_key(conn, inspector):
+    """
+    Make dataset names unique per cluster instead of globally (MySQL only;
+    SQLite cannot drop a column constraint in place).
+    """
+    if engine.dialect.name != "mysql":
+        return
+    indexes = inspector.get_indexes("datasets")
+    for index in indexes:
+        if index.get("unique") and index["column_names"] == ["name"]:
+            logger.info(f"Dropping unique index datasets.{index['name']}")
+            conn.execute(text(f"ALTER TABLE datasets DROP INDEX `{index['name']}`"))
+    if not any(index["name"] == "uq_datasets_cluster_name" for index in indexes):
+        logger.info("Creating unique index uq_datasets_cluster_name")
+        conn.execute(text("ALTER TABLE datasets ADD CONSTRAINT uq_datasets_cluster_name UNIQUE (cluster, name)"))
+
+
+def upgrade_schema():
+    """
+    Create missing tables, add missing columns and indexes, and make the
+    legacy inventory path column nullable.
+    """
+    init_db()
+    inspector = inspect(engine)
+
+    with engine.begin() as conn:
+        _add_missing_columns(conn, inspector, "inventory", INVENTORY_COLUMNS)
+        _add_missing_columns(conn, inspector, "task_queue", TASK_QUEUE_COLUMNS)
+        _add_missing_columns(conn, inspector, "datasets", DATASET_COLUMNS)
+        _add_missing_columns(conn, inspector, "scan_generations", SCAN_GENERATION_COLUMNS)
+        _upgrade_dataset_key(conn, inspector)
+        if engine.dialect.name == "mysql":
+            conn.execute(text("ALTER TABLE task_queue MODIFY task_type VARCHAR(64) NOT NULL"))
+            conn.execute(text("ALTER TABLE inventory MODIFY path TEXT NULL"))
+            conn.execute(text("ALTER TABLE inventory MODIFY filename VARCHAR(255) NOT NULL"))
+            conn.execute(text("ALTER TABLE inventory MODIFY mime_type VARCHAR(255) NULL"))
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, names in OBSOLETE_INDEXES.items():
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table_name)}
+            for name in names:
+                if name in existing_indexes:
+                    logger.info(f"Dropping index {name}")
+                    conn.execute(text(f"DROP INDEX {name} ON {table_name}" if engine.dialect.name == "mysql"
+                                      else f"DROP INDEX {name}"))
+    _create_missing_indexes(inspector, Inventory)
+    _create_missing_indexes(inspector, TaskQueue)
+
+
+def create_filename_fulltext_index():
+    """
+    Create the n-gram full-text index used for filename substring search (MySQL only).
+    """
+    if engine.dialect.name != "mysql":
+        logger.info("Full-text filename index is only supported on MySQL.")
+        return
+    existing_indexes = {i["name"] for i in inspect(engine).get_indexes("inventory")}
+    if FULLTEXT_INDEX_NAME in existing_indexes:
+        return
+    logger.info(f"Creating index {FULLTEXT_INDEX_NAME}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE inventory ADD FULLTEXT INDEX {FULLTEXT_INDEX_NAME} (filename) WITH PARSER ngram"
+        ))
+
+
+def backfill_task_datasets(chunk_size=1000):
+    """
+    Fill the dataset of queued tasks created before tasks carried it, so the
+    fair-share scheduler can assign them to their dataset lane.
+    Returns the number of updated tasks.
+    """
+    dataset = (select(Inventory.dataset)
+               .where(Inventory.file_id == TaskQueue.file_id)
+               .limit(1)
+               .scalar_subquery())
+    updated = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as session:
+            ids = [row.id for row in session.query(TaskQueue.id)
+                   .filter(TaskQueue.dataset.is_(None), TaskQueue.is_completed.is_(False), TaskQueue.id > last_id)
+                   .order_by(TaskQueue.id)
+                   .limit(chunk_size)]
+            if not ids:
+                break
+            session.execute(update(TaskQueue).where(TaskQueue.id.in_(ids)).values(dataset=dataset)
+                            .execution_options(synchronize_session=False))
+            session.commit()
+        updated += len(ids)
+        last_id = ids[-1]
+    return updated
+
+
+def migrate_inventory_paths(chunk_size=1000):
+    """
+    Move the full paths of existing inventory rows into the directory table.
+
+    Rows are processed in primary key order, one transaction per chunk.
+    Returns the number of migrated rows.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as session:
+            try:
+                rows = (session.query(Inventory)
+                        .filter(Inventory.directory_id.is_(None), Inventory.path.isnot(None),
+                                Inventory.id > last_id)
+                        .order_by(Inventory.id)
+                        .limit(chunk_size)
+                        .all())
+                if not rows:
+                    break
+                for row in rows:
+                    row.directory_id = get_or_create_directory(session, row.dataset, os.path.dirname(row.path))
+                    row.path = None
+                    if row.extension is None:
+                        row.extension = os.path.splitext(row.filename)[1].lower() or None
+                session.commit()
+            except Exception:
+                session.rollback()
+                clear_directory_cache()
+                raise
+        migrated += len(rows)
+        last_id = rows[-1].id
+        logger.info(f"Migrated {migrated} inventory rows to the directory table.")
+    return migrated
+
+
+def backfill_inventory_extensions(chunk_size=1000):
+    """
+    Fill the extension of inventory rows created before rows carried it, so
+    extension searches find them. Rows without an extension stay NULL.
+    Returns the number of updated rows.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as session:
+            rows = (session.query(Inventory.id, Inventory.filename)
+                    .filter(Inventory.extension.is_(None), Inventory.id > last_id)
+                    .order_by(Inventory.id)
+                    .limit(chunk_size)
+                    .all())
+            if not rows:
+                break
+            values = [{"id": row.id, "extension": os.path.splitext(row.filename)[1].lower()}
+                      for row in rows if os.path.splitext(row.filename)[1]]
+            if values:
+                session.execute(update(Inventory), values)
+                session.commit()
+        updated += len(values)
+        last_id = rows[-1].id
+    return updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Upgrade the collector schema.")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--schema-only", action="store_true", help="Do not migrate paths.")
+    parser.add_argument("--fulltext", action="store_true", help="Create the n-gram filename index.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade_schema()
+    if args.fulltext:
+        create_filename_fulltext_index()
+    if not args.schema_only:
+        migrate_inventory_paths(args.chunk_size)
+        backfill_inventory_extensions(args.chunk_size)
+        backfill_task_datasets(args.chunk_size)
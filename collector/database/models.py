@@ -1,20 +1,67 @@
-from sqlalchemy import Column, Integer, String, Float, Text, Boolean
+import os
+from sqlalchemy import Column, Integer, String, Float, Text, Boolean, DateTime, Index, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, synonym
 
 Base = declarative_base()
 
+class Directory(Base):
+    """
+    Represents an interned directory. Files reference their parent directory
+    by id instead of repeating the full path.
+    """
+    __tablename__ = "directories"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    dataset = Column(String(255), nullable=True)
+    path_hash = Column(String(40), nullable=False)
+    path = Column(Text, nullable=False)
+    parent_id = Column(Integer, ForeignKey("directories.id"), nullable=True, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("dataset", "path_hash", name="uq_directories_dataset_path"),
+    )
+
 class Inventory(Base):
     """
     Represents the inventory table for storing file metadata.
+
+    `path` is only set on rows that have not been migrated to the directory
+    table yet; use `full_path` to get the absolute path of a file.
     """
     __tablename__ = "inventory"
     id = Column(Integer, primary_key=True, autoincrement=True)
     file_id = Column(String, nullable=False, unique=True)
-    path = Column(Text, nullable=False)
-    filename = Column(String, nullable=False)
+    path = Column(Text, nullable=True)
+    directory_id = Column(Integer, ForeignKey("directories.id"), nullable=True, index=True)
+    filename = Column(String(255), nullable=False)
+    extension = Column(String(32), nullable=True)
     size_bytes = Column(Float, nullable=False)
-    mime_type = Column(String, nullable=True)
-    dataset = Column(String, nullable=True)
+    mime_type = Column(String(255), nullable=True)
+    dataset = Column(String(255), nullable=True)
+    checksum = Column(String(64), nullable=True, index=True)
+    scan_generation = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)
+    deleted_in_generation = Column(Integer, nullable=True, index=True)
+
+    directory = relationship(Directory, lazy="joined")
+
+    __table_args__ = (
+        Index("ix_inventory_dataset_generation", "dataset", "scan_generation"),
+        Index("ix_inventory_deleted_at", "deleted_at"),
+        Index("ix_inventory_dataset_mime_type", "dataset", "mime_type", "id"),
+        Index("ix_inventory_dataset_extension", "dataset", "extension", "id"),
+        Index("ix_inventory_dataset_id_size", "dataset", "id", "size_bytes"),
+        Index("ix_inventory_filename", "filename"),
+    )
+
+    @property
+    def full_path(self):
+        """
+        The absolute path of the file.
+        """
+        if self.directory is not None:
+            return os.path.join(self.directory.path, self.filename)
+        return self.path
 
 class TaskQueue(Base):
     """
@@ -23,7 +70,121 @@ class TaskQueue(Base):
     __tablename__ = "task_queue"
     id = Column(Integer, primary_key=True, autoincrement=True)
     file_id = Column(String, nullable=False)
-    task_type = Column(String, nullable=False)
+    task_type = Column(String(64), nullable=False)
     is_completed = Column(Boolean, default=False)
+    status = Column(String(16), nullable=False, default="PENDING", index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    dataset = Column(String(255), nullable=True)
+    priority = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    not_before = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    lease_owner = Column(String(255), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    queue_id = synonym("id")
+
+    __table_args__ = (
+        Index("ix_task_queue_not_before", "status", "not_before"),
+        Index("ix_task_queue_lease", "status", "lease_owner", "lease_expires_at"),
+    )
+
+# Matches the claim order (priority DESC, id) column by column, so claiming
+# the next task of a lane reads the index in order instead of sorting the lane.
+Index("ix_task_queue_ready_lane", TaskQueue.status, TaskQueue.dataset, TaskQueue.task_type,
+      TaskQueue.priority.desc(), TaskQueue.id)
+
+
+class Dataset(Base):
+    """
+    Represents the dataset registry, including scan configuration and scan cursors.
+    A dataset is identified by its cluster and name.
+    """
+    __tablename__ = "datasets"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False)
+    cluster = Column(String(255), nullable=True)
+    path = Column(Text, nullable=True)
+    enabled = Column(Boolean, nullable=False, default=False)
+    weight = Column(Integer, nullable=False, default=1)
+    owner = Column(String(255), nullable=True)
+    file_extensions = Column(Text, nullable=True)
+    status = Column(String(32), nullable=True)
+    scan_type = Column(String(32), nullable=True)
+    last_scan = Column(DateTime, nullable=True)
+    last_snapshot = Column(String(255), nullable=True)
+    scan_duration = Column(Float, nullable=True)
+    files_seen = Column(Integer, nullable=True)
+    files_sent = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("cluster", "name", name="uq_datasets_cluster_name"),
+    )
+
+class ScanGeneration(Base):
+    """
+    Represents one scan run of a dataset. Full scans stamp every file they see
+    with their generation id; files of the dataset not stamped are swept.
+    """
+    __tablename__ = "scan_generations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    dataset = Column(String(255), nullable=False, index=True)
+    cluster = Column(String(255), nullable=True)
+    scan_type = Column(String(32), nullable=False)
+    status = Column(String(32), nullable=False, default="RUNNING")
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    files_seen = Column(Integer, nullable=True)
+    files_removed = Column(Integer, nullable=True)
+
+class MediaMetadata(Base):
+    """
+    Represents the probed media metadata of a file content, keyed by checksum
+    so that duplicate files are probed only once.
+    """
+    __tablename__ = "media_metadata"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    checksum = Column(String(64), nullable=False, unique=True)
+    format_name = Column(String(255), nullable=True)
+    duration = Column(Float, nullable=True)
+    bitrate = Column(Integer, nullable=True)
+    video_codec = Column(String(64), nullable=True)
+    audio_codec = Column(String(64), nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    frame_rate = Column(Float, nullable=True)
+    probed_at = Column(DateTime, nullable=False)
+
+class VideoFingerprint(Base):
+    """
+    Represents the 64-bit perceptual fingerprint of a video content, keyed by
+    checksum. The signature is stored as 16 hex digits.
+    """
+    __tablename__ = "video_fingerprints"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    checksum = Column(String(64), nullable=False, unique=True)
+    signature = Column(String(16), nullable=False)
+    frames = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+
+class ExporterNode(Base):
+    """
+    Represents an exporter running on a storage host. Exporters own the
+    datasets stored locally and hash their files on behalf of the collector.
+    """
+    __tablename__ = "exporters"
+    name = Column(String(255), primary_key=True)
+    last_seen = Column(DateTime, nullable=False)
+
+class WorkerControl(Base):
+    """
+    Represents the desired state of the queue worker ('RUNNING' or 'STOPPED').
+    """
+    __tablename__ = "worker_control"
+    id = Column(Integer, primary_key=True)
+    status = Column(String(16), nullable=False, default="STOPPED")
+    updated_at = Column(DateTime, nullable=True)
 
 # Weitere Tabellen kannst du hier hinzufügen.
@@ -1,7 +1,9 @@
 # session.py
 import os
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from common.tracing import instrument_engine
 from .models import Base
 
 DB_HOST = os.getenv('DB_HOST')
@@ -9,16 +11,61 @@ DB_USER = os.getenv('MYSQL_USER')
 DB_PASSWORD = os.getenv('MYSQL_PASSWORD')
 DB_NAME = os.getenv('MYSQL_DATABASE')
 
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
-    raise EnvironmentError("Missing required environment variables for database configuration.")
+# DATABASE_URL overrides the MySQL settings, e.g. "sqlite:///collector.db" for local runs.
+DATABASE_URL = os.getenv('DATABASE_URL')
 
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+# DB_ECHO=1 logs every SQL statement.
+DB_ECHO = os.getenv('DB_ECHO', '').lower() in ('1', 'true', 'yes')
 
-engine = create_engine(DATABASE_URL, echo=True)
+if not DATABASE_URL:
+    if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
+        raise EnvironmentError("Missing required environment variables for database configuration.")
+    DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+
+def create_collector_engine(url):
+    """
+    Create an engine for a database URL and instrument it for tracing.
+    """
+    if url.startswith("sqlite"):
+        # Flask serves requests from several threads; WAL lets readers run next to the writer.
+        new_engine = create_engine(url, echo=DB_ECHO, connect_args={"check_same_thread": False, "timeout": 30})
+
+        @event.listens_for(new_engine, "connect")
+        def _enable_sqlite_wal(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+    else:
+        new_engine = create_engine(url, echo=DB_ECHO)
+    instrument_engine(new_engine)
+    return new_engine
+
+engine = create_collector_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine)
 
 def init_db():
     """
     Initialize the database by creating all tables.
     """
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=SessionLocal.kw["bind"])
+
+def get_session():
+    """
+    Open a new database session. The caller is responsible for closing it.
+    """
+    return SessionLocal()
+
+@contextmanager
+def scoped_engine(url):
+    """
+    Bind SessionLocal to another database for the duration of the block,
+    e.g. a temporary SQLite file in tests. The engine is disposed afterwards.
+    """
+    previous = SessionLocal.kw["bind"]
+    scoped = create_collector_engine(url)
+    SessionLocal.configure(bind=scoped)
+    try:
+        yield scoped
+    finally:
+        SessionLocal.configure(bind=previous)
+        scoped.dispose()
@@ -0,0 +1,116 @@
+# fingerprint.py
+"""
+Fingerprint Module
+
+Computes 64-bit perceptual fingerprints (difference hashes) of videos.
+Frames are sampled at evenly spaced positions, scaled to 9x8 grayscale
+thumbnails and hashed one by one; each bit of the signature is the
+majority of that bit over the frames. Re-encodes and re-muxes of the same
+video end up within a small Hamming distance of each other.
+"""
+
+import os
+import shlex
+import subprocess
+
+FRAME_COMMAND = os.getenv(
+    'FRAME_COMMAND',
+    'ffmpeg -v error -ss {position} -i {path} -frames:v 1 -vf scale=9:8,format=gray -f rawvideo -'
+)
+FRAME_TIMEOUT = float(os.getenv('FRAME_TIMEOUT', 30))
+FINGERPRINT_FRAMES = int(os.getenv('FINGERPRINT_FRAMES', 8))
+
+THUMBNAIL_WIDTH = 9
+THUMBNAIL_HEIGHT = 8
+THUMBNAIL_SIZE = THUMBNAIL_WIDTH * THUMBNAIL_HEIGHT
+
+
+def dhash(thumbnail):
+    """
+    Compute the difference hash of a 9x8 grayscale thumbnail.
+
+    Args:
+        thumbnail (bytes or list): 72 gray values in row-major order.
+
+    Returns:
+        int: The 64-bit hash; bit set where a pixel is brighter than its right neighbour.
+    """
+    if len(thumbnail) != THUMBNAIL_SIZE:
+        raise ValueError(f"Thumbnail must have {THUMBNAIL_SIZE} pixels, got {len(thumbnail)}")
+    signature = 0
+    for row in range(THUMBNAIL_HEIGHT):
+        offset = row * THUMBNAIL_WIDTH
+        for col in range(THUMBNAIL_WIDTH - 1):
+            signature = (signature << 1) | (thumbnail[offset + col] > thumbnail[offset + col + 1])
+    return signature
+
+
+def fingerprint_from_thumbnails(thumbnails):
+    """
+    Compute a video fingerprint from pre-extracted 9x8 grayscale thumbnails.
+
+    Args:
+        thumbnails (list): Thumbnails of 72 gray values each.
+
+    Returns:
+        int: The 64-bit signature; a bit is set if it is set in the hashes
+        of more than half of the thumbnails.
+    """
+    if not thumbnails:
+        raise ValueError("At least one thumbnail is required")
+    hashes = [dhash(thumbnail) for thumbnail in thumbnails]
+    signature = 0
+    for bit in range(63, -1, -1):
+        votes = sum((h >> bit) & 1 for h in hashes)
+        signature = (signature << 1) | (votes * 2 > len(hashes))
+    return signature
+
+
+def extract_thumbnail(file_path, position, command=FRAME_COMMAND, timeout=FRAME_TIMEOUT):
+    """
+    Extract one frame as 9x8 grayscale thumbnail.
+
+    Args:
+        file_path (str): Path to the video.
+        position (float): Position of the frame in seconds.
+        command (str): The frame extraction command with {path} and {position} placeholders.
+        timeout (float): Seconds after which the command is killed.
+
+    Returns:
+        bytes: 72 gray values.
+
+    Raises:
+        RuntimeError: If the command fails or returns a wrong number of bytes.
+    """
+    args = [arg.format(path=file_path, position=f"{position:.3f}") for arg in shlex.split(command)]
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Frame extraction of {file_path} at {position:.3f}s timed out")
+    except OSError as e:
+        raise RuntimeError(f"Error running frame extraction for {file_path}: {e}")
+    if result.returncode != 0 or len(result.stdout) < THUMBNAIL_SIZE:
+        raise RuntimeError(
+            f"Frame extraction of {file_path} at {position:.3f}s failed: "
+            f"{result.stderr.decode(errors='replace').strip()}"
+        )
+    return result.stdout[:THUMBNAIL_SIZE]
+
+
+def fingerprint_video(file_path, duration, frames=FINGERPRINT_FRAMES, command=FRAME_COMMAND, timeout=FRAME_TIMEOUT):
+    """
+    Compute the fingerprint of a video from evenly spaced frames.
+
+    Args:
+        file_path (str): Path to the video.
+        duration (float): Duration of the video in seconds.
+        frames (int): Number of frames to sample.
+
+    Returns:
+        dict: `signature` (int) and `frames` (number of sampled frames).
+    """
+    if not duration or duration <= 0:
+        raise RuntimeError(f"Cannot fingerprint {file_path} without a duration")
+    positions = [duration * (i + 0.5) / frames for i in range(frames)]
+    thumbnails = [extract_thumbnail(file_path, position, command, timeout) for position in positions]
+    return {"signature": fingerprint_from_thumbnails(thumbnails), "frames": len(thumbnails)}
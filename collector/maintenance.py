@@ -0,0 +1,107 @@
+# maintenance.py
+"""
+Maintenance Module
+
+Runs inventory reconciliation in background threads: the sweep after a full
+scan and the periodic purge of old tombstones and of the directories they
+leave empty. Also hands the task leases
+of silent exporters and tasks stuck in the local worker back to the queue.
+"""
+
+import logging
+import os
+import threading
+from database.crud.scans import sweep_generation, purge_tombstones
+from database.crud.directories import purge_orphan_directories
+from database.crud.leases import expire_leases
+from database.crud.task_queue import reap_stale_tasks
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = int(os.getenv('PURGE_INTERVAL_SECONDS', 3600))
+LEASE_CHECK_SECONDS = int(os.getenv('LEASE_CHECK_SECONDS', 30))
+
+stop_maintenance = threading.Event()
+_purge_thread = None
+_lease_thread = None
+
+
+def _run_sweep(generation_id):
+    try:
+        removed = sweep_generation(generation_id)
+        logger.info(f"Sweep of scan generation {generation_id} tombstoned {removed} files.")
+    except Exception as e:
+        logger.error(f"Sweep of scan generation {generation_id} failed: {e}")
+
+
+def start_sweep(generation_id):
+    """
+    Sweep a finished scan generation in a background thread.
+
+    Args:
+        generation_id (int): The scan generation to sweep.
+
+    Returns:
+        threading.Thread: The started sweep thread.
+    """
+    thread = threading.Thread(target=_run_sweep, args=(generation_id,), daemon=True,
+                              name=f"sweep-{generation_id}")
+    thread.start()
+    return thread
+
+
+def _purge_loop():
+    while not stop_maintenance.is_set():
+        try:
+            purged = purge_tombstones()
+            if purged:
+                logger.info(f"Purged {purged} tombstoned files.")
+            directories = purge_orphan_directories()
+            if directories:
+                logger.info(f"Purged {directories} orphaned directories.")
+        except Exception as e:
+            logger.error(f"Tombstone purge failed: {e}")
+        stop_maintenance.wait(PURGE_INTERVAL_SECONDS)
+
+
+def start_purge_loop():
+    """
+    Start the periodic tombstone purge unless it is already running.
+    """
+    global _purge_thread
+    if _purge_thread is None or not _purge_thread.is_alive():
+        stop_maintenance.clear()
+        _purge_thread = threading.Thread(target=_purge_loop, daemon=True, name="tombstone-purge")
+        _purge_thread.start()
+
+
+def stop_purge_loop():
+    """
+    Stop the periodic tombstone purge and the lease monitor.
+    """
+    stop_maintenance.set()
+
+
+def _lease_loop():
+    while not stop_maintenance.is_set():
+        try:
+            expired = expire_leases()
+            if expired:
+                logger.info(f"Returned {expired} expired task leases to the queue.")
+            stale = reap_stale_tasks()
+            if stale:
+                logger.info(f"Returned {stale} stale running tasks to the queue.")
+        except Exception as e:
+            logger.error(f"Lease expiry failed: {e}")
+        stop_maintenance.wait(LEASE_CHECK_SECONDS)
+
+
+def start_lease_monitor():
+    """
+    Start the periodic expiry of exporter task leases and stale local tasks
+    unless it is already running.
+    """
+    global _lease_thread
+    if _lease_thread is None or not _lease_thread.is_alive():
+        _lease_thread = threading.Thread(target=_lease_loop, daemon=True, name="lease-monitor")
+        _lease_thread.start()
@@ -0,0 +1,185 @@
+# media_probe.py
+"""
+Media Probe Module
+
+Runs an external media prober (ffprobe by default) in a bounded pool of
+subprocesses and parses its JSON output into media metadata.
+"""
+
+import json
+import logging
+import os
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PROBE_COMMAND = os.getenv(
+    'PROBE_COMMAND', 'ffprobe -v error -print_format json -show_format -show_streams'
+)
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 60))
+PROBE_WORKERS = int(os.getenv('PROBE_WORKERS', 4))
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_frame_rate(value):
+    if not value or value == "0/0":
+        return None
+    numerator, _, denominator = value.partition("/")
+    try:
+        return round(float(numerator) / float(denominator or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_probe_output(output):
+    """
+    Parse ffprobe-style JSON output (`-show_format -show_streams`).
+
+    Args:
+        output (str): The JSON output of the prober.
+
+    Returns:
+        dict: duration, bitrate, format_name, video_codec, audio_codec, width,
+        height and frame_rate. Missing values are None.
+    """
+    data = json.loads(output)
+    media_format = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    return {
+        "format_name": media_format.get("format_name"),
+        "duration": _to_float(media_format.get("duration") or video.get("duration")),
+        "bitrate": _to_int(media_format.get("bit_rate") or video.get("bit_rate")),
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "width": _to_int(video.get("width")),
+        "height": _to_int(video.get("height")),
+        "frame_rate": _parse_frame_rate(video.get("avg_frame_rate") or video.get("r_frame_rate")),
+    }
+
+
+def probe_file(file_path, command=PROBE_COMMAND, timeout=PROBE_TIMEOUT):
+    """
+    Run the prober on a file.
+
+    Args:
+        file_path (str): Path to the media file.
+        command (str): The prober command line; the file path is appended.
+        timeout (float): Seconds after which the prober is killed.
+
+    Returns:
+        dict: The parsed media metadata.
+
+    Raises:
+        RuntimeError: If the prober fails, times out or returns invalid output.
+    """
+    args = shlex.split(command) + [file_path]
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Probing {file_path} timed out after {timeout}s")
+    except OSError as e:
+        raise RuntimeError(f"Error running prober for {file_path}: {e}")
+    if result.returncode != 0:
+        raise RuntimeError(f"Prober failed for {file_path}: {result.stderr.decode(errors='replace').strip()}")
+    try:
+        return parse_probe_output(result.stdout.decode(errors='replace'))
+    except (ValueError, AttributeError) as e:
+        raise RuntimeError(f"Invalid prober output for {file_path}: {e}")
+
+
+class MediaProber:
+    """
+    Bounded pool of prober subprocesses.
+
+    At most `max_workers` jobs run at the same time and at most twice as
+    many are queued; `submit` blocks beyond that. Jobs for the same content
+    checksum that are in flight at the same time share one run.
+    """
+
+    def __init__(self, max_workers=PROBE_WORKERS, command=PROBE_COMMAND, timeout=PROBE_TIMEOUT):
+        """
+        Initialize the prober pool.
+
+        Args:
+            max_workers (int): Number of parallel prober subprocesses.
+            command (str): The prober command line.
+            timeout (float): Timeout of a single probe in seconds.
+        """
+        self.command = command
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="probe")
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, callback):
+        """
+        Run a job in the pool. Jobs with the same key that are in flight at
+        the same time run only once and share the result.
+
+        Args:
+            key (hashable): Identifies the job, e.g. ("probe", checksum).
+            fn (callable): The job; called without arguments.
+            callback (callable): Called with (result, error) when the job
+                finished; exactly one of both is None.
+        """
+        self._slots.acquire()
+        with self._lock:
+            future = self._in_flight.get(key)
+            started = future is None
+            if started:
+                future = self._executor.submit(fn)
+                self._in_flight[key] = future
+        if started:
+            future.add_done_callback(lambda f: self._release(key))
+        else:
+            self._slots.release()
+
+        def _done(f):
+            error = f.exception()
+            try:
+                callback(None if error else f.result(), error)
+            except Exception as e:
+                logger.error(f"Callback of job {key} failed: {e}")
+
+        future.add_done_callback(_done)
+
+    def probe(self, checksum, file_path, callback):
+        """
+        Probe a file in the pool.
+
+        Args:
+            checksum (str): Content checksum of the file.
+            file_path (str): Path to the file.
+            callback (callable): Called with (metadata, error) when the probe finished.
+        """
+        self.submit(("probe", checksum), lambda: probe_file(file_path, self.command, self.timeout), callback)
+
+    def _release(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        self._slots.release()
+
+    def shutdown(self, wait=True):
+        """
+        Stop the pool, optionally waiting for running probes.
+        """
+        self._executor.shutdown(wait=wait)
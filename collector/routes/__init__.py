@@ -1,3 +1,4 @@
 # Routes-Paketinitialisierung.
 from .api_routes import api_blueprint
 from .worker_routes import worker_blueprint
+from .admin_routes import admin_blueprint
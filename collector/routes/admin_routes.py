@@ -0,0 +1,212 @@
+"""
+Admin Routes
+
+Provides API endpoints for changing the collector configuration at runtime.
+"""
+
+import logging
+import os
+import threading
+from flask import Blueprint, Response, request, jsonify
+from common.tracing import TRACING_ENABLED, SLOW_OP_MS, span_stats, reset_span_stats
+from common.profiling import profile_process, format_folded
+from database.crud.datasets import (
+    fetch_datasets, fetch_dataset, update_dataset_config, reset_dataset_cursor, AmbiguousDatasetError
+)
+from database.crud.scans import fetch_scan_generations, fetch_scan_generation, fetch_removed_files
+from database.crud.task_queue import fetch_queue_backlog, requeue_dead_tasks
+from database.crud.leases import fetch_exporters
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+
+admin_blueprint = Blueprint('admin', __name__)
+_profile_lock = threading.Lock()
+
+
+@admin_blueprint.route('/datasets', methods=['GET'])
+def list_datasets():
+    """
+    List all registered datasets with their configuration and scan cursors.
+    """
+    enabled_only = request.args.get('enabled', '').lower() in ('1', 'true', 'yes')
+    try:
+        return jsonify({"datasets": fetch_datasets(enabled_only=enabled_only)}), 200
+    except Exception as e:
+        logger.exception(f"Error listing datasets: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+@admin_blueprint.route('/datasets/<name>', methods=['GET'])
+def get_dataset(name):
+    """
+    Show a single dataset. Pass `cluster` if the name exists in several clusters.
+    """
+    try:
+        dataset = fetch_dataset(name, cluster=request.args.get('cluster'))
+    except AmbiguousDatasetError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    if dataset is None:
+        return jsonify({"status": "error", "message": f"Unknown dataset {name}"}), 404
+    return jsonify(dataset), 200
+
+
+@admin_blueprint.route('/datasets/<name>', methods=['PATCH'])
+def update_dataset(name):
+    """
+    Enable/disable a dataset, change its file extensions or its task queue weight.
+    Pass `cluster` if the name exists in several clusters.
+    """
+    data = request.json or {}
+    enabled = data.get('enabled')
+    file_extensions = data.get('file_extensions')
+    weight = data.get('weight')
+
+    if enabled is None and file_extensions is None and weight is None:
+        return jsonify({"status": "error", "message": "Nothing to update"}), 400
+    if file_extensions is not None and not isinstance(file_extensions, list):
+        return jsonify({"status": "error", "message": "file_extensions must be a list"}), 400
+    if weight is not None and (not isinstance(weight, int) or weight < 1):
+        return jsonify({"status": "error", "message": "weight must be a positive integer"}), 400
+
+    try:
+        dataset = update_dataset_config(name, enabled=enabled, file_extensions=file_extensions, weight=weight,
+                                        cluster=request.args.get('cluster'))
+    except AmbiguousDatasetError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except Exception as e:
+        logger.exception(f"Error updating dataset {name}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    if dataset is None:
+        return jsonify({"status": "error", "message": f"Unknown dataset {name}"}), 404
+    logger.info(f"Updated configuration of dataset {name}.")
+    return jsonify(dataset), 200
+
+
+@admin_blueprint.route('/datasets/<name>/reset', methods=['POST'])
+def reset_dataset(name):
+    """
+    Clear the scan cursor of a dataset to force a full scan on the next run.
+    Pass `cluster` if the name exists in several clusters.
+    """
+    try:
+        dataset = reset_dataset_cursor(name, cluster=request.args.get('cluster'))
+    except AmbiguousDatasetError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except Exception as e:
+        logger.exception(f"Error resetting dataset {name}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    if dataset is None:
+        return jsonify({"status": "error", "message": f"Unknown dataset {name}"}), 404
+    logger.info(f"Reset scan cursor of dataset {name}.")
+    return jsonify(dataset), 200
+
+
+@admin_blueprint.route('/scans', methods=['GET'])
+def list_scans():
+    """
+    List recent scan generations with the number of files each sweep removed.
+    """
+    dataset = request.args.get('dataset')
+    limit = request.args.get('limit', 50, type=int)
+    try:
+        return jsonify({"scans": fetch_scan_generations(dataset=dataset, limit=limit)}), 200
+    except Exception as e:
+        logger.exception(f"Error listing scans: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+@admin_blueprint.route('/scans/<int:generation_id>/removed', methods=['GET'])
+def list_removed_files(generation_id):
+    """
+    List the files removed from the inventory by the sweep of a scan generation.
+    """
+    generation = fetch_scan_generation(generation_id)
+    if generation is None:
+        return jsonify({"status": "error", "message": f"Unknown scan generation {generation_id}"}), 404
+    limit = request.args.get('limit', 1000, type=int)
+    return jsonify({"generation": generation, "files": fetch_removed_files(generation_id, limit=limit)}), 200
+
+
+@admin_blueprint.route('/queue', methods=['GET'])
+def queue_backlog():
+    """
+    Show the task queue backlog per dataset and task type.
+    """
+    try:
+        return jsonify({"backlog": fetch_queue_backlog()}), 200
+    except Exception as e:
+        logger.exception(f"Error fetching queue backlog: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+@admin_blueprint.route('/queue/requeue', methods=['POST'])
+def requeue_dead():
+    """
+    Move dead-lettered tasks back into the queue, optionally only of one
+    dataset and/or task type.
+    """
+    data = request.json or {}
+    try:
+        count = requeue_dead_tasks(dataset=data.get('dataset'), task_type=data.get('task_type'))
+    except Exception as e:
+        logger.exception(f"Error requeueing dead tasks: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+    logger.info(f"Requeued {count} dead tasks.")
+    return jsonify({"status": "success", "requeued": count}), 200
+
+
+@admin_blueprint.route('/exporters', methods=['GET'])
+def list_exporters():
+    """
+    List the exporters with their last heartbeat and the datasets they own.
+    """
+    try:
+        return jsonify({"exporters": fetch_exporters()}), 200
+    except Exception as e:
+        logger.exception(f"Error listing exporters: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+@admin_blueprint.route('/traces', methods=['GET'])
+def list_traces():
+    """
+    Show the aggregated span statistics, slowest total first.
+    """
+    return jsonify({"enabled": TRACING_ENABLED, "slow_op_ms": SLOW_OP_MS, "spans": span_stats()}), 200
+
+
+@admin_blueprint.route('/traces', methods=['DELETE'])
+def reset_traces():
+    """
+    Discard the aggregated span statistics.
+    """
+    reset_span_stats()
+    return jsonify({"status": "success"}), 200
+
+
+@admin_blueprint.route('/profile', methods=['POST'])
+def profile_collector():
+    """
+    Sample the stacks of all collector threads for a number of seconds and
+    return them in the folded stack format for flame graph tools.
+    """
+    seconds = request.args.get('seconds', 10, type=float)
+    interval_ms = request.args.get('interval_ms', 10, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"status": "error",
+                        "message": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}), 400
+    if interval_ms < 1:
+        return jsonify({"status": "error", "message": "interval_ms must be at least 1"}), 400
+    if not _profile_lock.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+    try:
+        logger.info(f"Profiling the collector for {seconds:g} seconds.")
+        samples = profile_process(seconds, interval_ms / 1000)
+    finally:
+        _profile_lock.release()
+    return Response(format_folded(samples), mimetype='text/plain',
+                    headers={"Content-Disposition": "attachment; filename=collector-profile.folded"})
@@ -1,17 +1,33 @@
-from flask import Blueprint, request, jsonify
-from common.logging_config import OriginFilter
-from database.crud.inventory import insert_inventory
+import json
+import logging
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from common.logging_config import RequestOriginFilter
+from database.crud.inventory import upsert_inventory
 from database.crud.task_queue import add_task_to_queue
+from database.crud.datasets import register_datasets, record_scan_status, AmbiguousDatasetError
+from database.crud.scans import (
+    start_scan_generation, fetch_scan_generation, stamp_generation, finish_scan_generation
+)
+from database.crud.directories import fetch_directory, list_child_directories, list_directory_files
+from database.crud.media import fetch_file_media_metadata
+from database.crud.inventory import fetch_file_info
+from database.crud.fingerprints import fetch_fingerprint, store_fingerprint, fetch_files_by_checksums
+from fingerprint import fingerprint_from_thumbnails
+from similarity import similarity_index
+from database.crud.leases import lease_tasks, renew_leases, fetch_leased_task, record_exporter_activity
+from database.crud.task_queue import mark_task_completed
+from worker import handle_file_checksum
+from database.crud.search import (
+    search_inventory, stream_inventory, decode_page_token, encode_page_token, MAX_PAGE_SIZE
+)
+from database.crud.duplicates import fetch_duplicates
+from maintenance import start_sweep
+from shards import SHARD_NAME, shard_map, fan_out, encode_shard_token, decode_shard_token
 
-api_blueprint = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+logger.addFilter(RequestOriginFilter("API"))
 
-@api_blueprint.before_request
-def before_request():
-    """
-    Add dynamic 'origin' for each API request to logs.
-    """
-    endpoint = request.endpoint if request.endpoint else "UNKNOWN"
-    logger.addFilter(OriginFilter(f"API:{endpoint}"))
+api_blueprint = Blueprint('api', __name__)
 
 
 @api_blueprint.route('/log', methods=['POST'])
@@ -37,7 +53,8 @@ def log_message():
 @api_blueprint.route('/datasets', methods=['POST'])
 def process_datasets():
     """
-    Process dataset information.
+    Register the datasets discovered by an exporter and return the enabled ones
+    together with their scan cursors and file extensions.
     """
     data = request.json
     datasets = data.get('datasets', [])
@@ -47,17 +64,44 @@ def process_datasets():
         return jsonify({"status": "error", "message": "No datasets provided"}), 400
 
     try:
-        response_data = {"datasets": [{"name": d['dataset']} for d in datasets]}
+        registered = register_datasets(datasets, exporter=data.get('exporter'))
+        enabled_datasets = [d for d in registered if d['enabled']]
+        file_extensions = sorted({ext for d in enabled_datasets for ext in d['file_extensions']})
+        response_data = {
+            "datasets": [{"name": d['dataset']} for d in registered],
+            "enabled_datasets": enabled_datasets,
+            "file_extensions": file_extensions,
+        }
         return jsonify(response_data), 200
     except Exception as e:
         logger.exception(f"Error processing datasets: {e}")
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
 
+def touch_sending_exporter(data):
+    """
+    Count scan data from an exporter as its heartbeat, so the datasets it
+    owns are not taken over while it is busy scanning.
+    """
+    if data.get('exporter'):
+        try:
+            record_exporter_activity(data['exporter'])
+        except Exception as e:
+            logger.exception(f"Error recording heartbeat of exporter {data['exporter']}: {e}")
+
+
+def is_checksum(value):
+    """
+    Whether a value looks like a hex SHA256 checksum.
+    """
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value.lower())
+
+
 @api_blueprint.route('/files', methods=['POST'])
 def receive_file_info():
     """
-    Receive and process file information.
+    Receive and process file information. A new file that comes with the
+    checksum of its content is not queued for hashing.
     """
     data = request.json
     required_fields = ["path", "file_id", "filename", "size_bytes", "mime_type", "dataset"]
@@ -67,18 +111,28 @@ def receive_file_info():
         logger.error(f"Missing fields: {', '.join(missing_fields)}")
         return jsonify({"status": "error", "message": f"Missing fields: {', '.join(missing_fields)}"}), 400
 
+    touch_sending_exporter(data)
     try:
-        insert_inventory(
+        created = upsert_inventory(
             file_id=data['file_id'],
             path=data['path'],
             filename=data['filename'],
             size_bytes=data['size_bytes'],
             mime_type=data['mime_type'],
-            dataset=data['dataset']
+            dataset=data['dataset'],
+            scan_generation=data.get('scan_generation'),
+            extension=data.get('extension')
         )
-        logger.info(f"Inserted file {data['file_id']} into inventory.")
+        if not created:
+            logger.info(f"Refreshed file {data['file_id']} in inventory.")
+            return jsonify({"status": "success"}), 200
 
-        add_task_to_queue(data['file_id'], 'CALC_FILEHASH')
+        logger.info(f"Inserted file {data['file_id']} into inventory.")
+        if is_checksum(data.get('checksum')):
+            handle_file_checksum(fetch_file_info(data['file_id']), data['checksum'].lower())
+            logger.info(f"Stored checksum sent with file {data['file_id']}.")
+            return jsonify({"status": "success"}), 200
+        add_task_to_queue('CALC_FILEHASH', data['file_id'], dataset=data['dataset'])
         logger.info(f"Queued hash computation task for file {data['file_id']}.")
         return jsonify({"status": "success"}), 200
     except Exception as e:
@@ -89,15 +143,469 @@ def receive_file_info():
 @api_blueprint.route('/update_status', methods=['POST'])
 def update_scan_status():
     """
-    Update the status of a dataset.
+    Update the status and scan cursor of a dataset.
     """
     data = request.json
     dataset = data.get('dataset', {}).get('dataset')
-    status = data.get('status', {}).get('status')
+    cluster = data.get('dataset', {}).get('cluster')
+    status_info = data.get('status', {})
+    status = status_info.get('status')
 
     if not dataset or not status:
         logger.error("Invalid input: Dataset or status missing.")
         return jsonify({"status": "error", "message": "Invalid input: Dataset or status missing."}), 400
 
+    try:
+        updated = record_scan_status(
+            dataset,
+            status,
+            scan_type=status_info.get('scan_type'),
+            last_scan=status_info.get('last_scan'),
+            last_snapshot=status_info.get('last_snapshot'),
+            scan_duration=status_info.get('scan_duration'),
+            files_seen=status_info.get('files_seen'),
+            files_sent=status_info.get('files_sent'),
+            cluster=cluster,
+        )
+    except AmbiguousDatasetError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except Exception as e:
+        logger.exception(f"Error updating status of dataset {dataset}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    if updated is None:
+        logger.error(f"Unknown dataset {dataset}.")
+        return jsonify({"status": "error", "message": f"Unknown dataset {dataset}"}), 404
+
     logger.info(f"Updated dataset {dataset} to status {status}.")
-    return jsonify({"status": "success", "message": "Status updated successfully"}), 200
+    return jsonify({"status": "success", "message": "Status updated successfully", "dataset": updated}), 200
+
+
+@api_blueprint.route('/scans', methods=['POST'])
+def start_scan():
+    """
+    Open a scan generation for a dataset.
+    """
+    data = request.json
+    dataset = data.get('dataset')
+    scan_type = data.get('scan_type', 'full')
+
+    if not dataset:
+        logger.error("Invalid input: Dataset missing.")
+        return jsonify({"status": "error", "message": "Invalid input: Dataset missing."}), 400
+
+    try:
+        generation = start_scan_generation(dataset, scan_type, cluster=data.get('cluster'))
+    except Exception as e:
+        logger.exception(f"Error starting scan of dataset {dataset}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    logger.info(f"Started {scan_type} scan generation {generation['generation_id']} for dataset {dataset}.")
+    return jsonify(generation), 200
+
+
+@api_blueprint.route('/scans/<int:generation_id>/seen', methods=['POST'])
+def mark_files_seen(generation_id):
+    """
+    Stamp a batch of already known files as seen by a scan generation.
+    Returns the ids of the files the inventory does not know yet; the
+    exporter sends their full records.
+    """
+    data = request.json
+    file_ids = data.get('file_ids', [])
+    touch_sending_exporter(data)
+
+    generation = fetch_scan_generation(generation_id)
+    if generation is None:
+        return jsonify({"status": "error", "message": f"Unknown scan generation {generation_id}"}), 404
+
+    try:
+        unknown = stamp_generation(generation_id, generation['dataset'], file_ids)
+    except Exception as e:
+        logger.exception(f"Error stamping scan generation {generation_id}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    return jsonify({"status": "success", "stamped": len(file_ids) - len(unknown), "unknown": unknown}), 200
+
+
+@api_blueprint.route('/scans/<int:generation_id>/finish', methods=['POST'])
+def finish_scan(generation_id):
+    """
+    Close a scan generation. A successful full scan triggers the sweep of
+    files it did not see.
+    """
+    data = request.json
+    status = data.get('status')
+
+    if not status:
+        logger.error("Invalid input: Status missing.")
+        return jsonify({"status": "error", "message": "Invalid input: Status missing."}), 400
+
+    try:
+        generation = finish_scan_generation(generation_id, status, files_seen=data.get('files_seen'))
+    except Exception as e:
+        logger.exception(f"Error finishing scan generation {generation_id}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    if generation is None:
+        return jsonify({"status": "error", "message": f"Unknown scan generation {generation_id}"}), 404
+
+    if status == 'SUCCESS' and generation['status'] != 'SUCCESS':
+        logger.warning(f"Scan generation {generation_id} saw no files of a dataset with live files; "
+                       f"closed as {generation['status']} without a sweep.")
+    sweep_started = generation['status'] == 'SUCCESS' and generation['scan_type'] == 'full'
+    if sweep_started:
+        start_sweep(generation_id)
+        logger.info(f"Started sweep of scan generation {generation_id}.")
+    return jsonify({"status": "success", "generation": generation, "sweep_started": sweep_started}), 200
+
+
+@api_blueprint.route('/directories', methods=['GET'])
+def list_directory():
+    """
+    List the subdirectories and files of a directory. With `recursive=1`
+    the files of the whole subtree are listed. Files are paged with `after`.
+    """
+    dataset = request.args.get('dataset')
+    path = request.args.get('path')
+    recursive = request.args.get('recursive', '').lower() in ('1', 'true', 'yes')
+    after_id = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+
+    if not path:
+        return jsonify({"status": "error", "message": "Invalid input: Path missing."}), 400
+
+    try:
+        directory = fetch_directory(dataset, path)
+        if directory is None:
+            return jsonify({"status": "error", "message": f"Unknown directory {path}"}), 404
+        files = list_directory_files(directory.id, recursive=recursive, after_id=after_id, limit=limit)
+        response_data = {
+            "directory_id": directory.id,
+            "path": directory.path,
+            "directories": list_child_directories(directory.id),
+            "files": files,
+            "next": files[-1]["id"] if len(files) == limit else None,
+        }
+        return jsonify(response_data), 200
+    except Exception as e:
+        logger.exception(f"Error listing directory {path}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+@api_blueprint.route('/search', methods=['GET'])
+def search_files():
+    """
+    Search the inventory. Filters: dataset, mime_type, extension, min_size,
+    max_size, prefix (filename prefix) and contains (filename substring).
+
+    Returns a JSON page with a `next` token by default. With `format=ndjson`
+    all matches after `page` are streamed as newline-delimited JSON.
+    """
+    filters = {
+        "dataset": request.args.get('dataset'),
+        "mime_type": request.args.get('mime_type'),
+        "extension": request.args.get('extension'),
+        "min_size": request.args.get('min_size', type=float),
+        "max_size": request.args.get('max_size', type=float),
+        "prefix": request.args.get('prefix'),
+        "contains": request.args.get('contains'),
+    }
+    streaming = request.args.get('format') == 'ndjson'
+    limit = request.args.get('limit', None if streaming else 100, type=int)
+    if streaming and limit is not None and limit < 1:
+        return jsonify({"status": "error", "message": "limit must be positive"}), 400
+    if not streaming and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"status": "error", "message": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    if is_fanout() and shard_map["shards"]:
+        if streaming:
+            return jsonify({"status": "error", "message": "format=ndjson is not supported with fanout"}), 400
+        return search_all_shards(filters, limit)
+
+    try:
+        after_id = decode_page_token(request.args.get('page'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if streaming:
+        rows = stream_inventory(filters, after_id=after_id, limit=limit)
+        return Response(stream_with_context(json.dumps(row) + "\n" for row in rows),
+                        mimetype='application/x-ndjson')
+
+    try:
+        rows, next_token = search_inventory(filters, after_id=after_id, limit=limit)
+    except Exception as e:
+        logger.exception(f"Error searching inventory: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+    return jsonify({"files": rows, "next": next_token}), 200
+
+
+def is_fanout():
+    """
+    Whether the request asks for the results of all shards.
+    """
+    return request.args.get('fanout', '').lower() in ('1', 'true', 'yes')
+
+
+def search_all_shards(filters, limit):
+    """
+    Search all shards in parallel and return one page of the results in
+    shard map order. The page token holds the keyset position on every
+    shard; rows fetched but not returned are fetched again for the next page.
+    """
+    try:
+        positions = decode_shard_token(request.args.get('page'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    names = [shard["name"] for shard in shard_map["shards"]]
+    open_shards = [shard for shard in shard_map["shards"]
+                   if shard["name"] != SHARD_NAME and positions.get(shard["name"], 0) is not None]
+    params = {k: v for k, v in request.args.items() if k not in ('fanout', 'page', 'limit', 'format')}
+
+    pages, failed = fan_out('/api/search', shards=open_shards, params=lambda shard: {
+        **params, "limit": limit, "page": encode_page_token(positions.get(shard["name"], 0))})
+    if SHARD_NAME in names and positions.get(SHARD_NAME, 0) is not None:
+        try:
+            rows, next_token = search_inventory(filters, after_id=positions.get(SHARD_NAME, 0), limit=limit)
+            pages[SHARD_NAME] = {"files": rows, "next": next_token}
+        except Exception as e:
+            logger.exception(f"Error searching inventory: {e}")
+            failed.append(SHARD_NAME)
+
+    files = []
+    for name in names:
+        page = pages.get(name)
+        if page is None:
+            continue
+        taken = page["files"][:limit - len(files)]
+        files.extend({**row, "shard": name} for row in taken)
+        if len(taken) < len(page["files"]):
+            positions[name] = taken[-1]["id"] if taken else positions.get(name, 0)
+        else:
+            positions[name] = taken[-1]["id"] if page["next"] else None
+
+    for name in names:
+        positions.setdefault(name, 0)
+    next_token = encode_shard_token(positions) if any(p is not None for p in positions.values()) else None
+    return jsonify({"files": files, "next": next_token, "failed_shards": failed}), 200
+
+
+@api_blueprint.route('/ping', methods=['GET'])
+def ping():
+    """
+    Answer without touching the database, so exporters can cheaply check
+    that a collector is up.
+    """
+    return jsonify({"status": "ok", "shard": SHARD_NAME}), 200
+
+
+@api_blueprint.route('/shards', methods=['GET'])
+def get_shard_map():
+    """
+    Return the shard map. Exporters route their datasets by it; without
+    shards the collector runs unsharded.
+    """
+    return jsonify({"shard": SHARD_NAME, **shard_map}), 200
+
+
+def find_duplicates(checksum):
+    """
+    Collect the live files with a checksum, on all shards if `fanout` is set.
+    """
+    try:
+        files = [{**f, "shard": SHARD_NAME} for f in fetch_duplicates(checksum)]
+    except Exception as e:
+        logger.exception(f"Error fetching duplicates of {checksum}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    failed = []
+    if is_fanout():
+        results, failed = fan_out(f'/api/duplicates/{checksum}')
+        for name, result in sorted(results.items()):
+            files.extend({**f, "shard": name} for f in result["files"])
+    return jsonify({"checksum": checksum, "files": files, "failed_shards": failed}), 200
+
+
+@api_blueprint.route('/duplicates/<checksum>', methods=['GET'])
+def get_duplicates(checksum):
+    """
+    List the live files with the given content checksum. With `fanout=1`
+    the files on all shards are listed.
+    """
+    return find_duplicates(checksum)
+
+
+@api_blueprint.route('/files/<file_id>/duplicates', methods=['GET'])
+def get_file_duplicates(file_id):
+    """
+    List the files with the same content as a file of this shard. With
+    `fanout=1` the files on all shards are listed.
+    """
+    file_info = fetch_file_info(file_id)
+    if file_info is None or not file_info.checksum:
+        return jsonify({"status": "error", "message": f"File {file_id} not found or not hashed yet"}), 404
+    return find_duplicates(file_info.checksum)
+
+
+@api_blueprint.route('/files/<file_id>/media', methods=['GET'])
+def get_file_media(file_id):
+    """
+    Return the probed media metadata of a file.
+    """
+    try:
+        media = fetch_file_media_metadata(file_id)
+    except Exception as e:
+        logger.exception(f"Error fetching media metadata of file {file_id}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    if media is None:
+        return jsonify({"status": "error", "message": f"No media metadata for file {file_id}"}), 404
+    return jsonify(media), 200
+
+
+@api_blueprint.route('/files/<file_id>/similar', methods=['GET'])
+def get_similar_files(file_id):
+    """
+    Find near-duplicates of a video by the Hamming distance of their fingerprints.
+    Files with the same content (distance 0, same checksum) are included.
+    """
+    max_distance = request.args.get('max_distance', 10, type=int)
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+
+    file_info = fetch_file_info(file_id)
+    signature = fetch_fingerprint(file_info.checksum) if file_info and file_info.checksum else None
+    if signature is None:
+        return jsonify({"status": "error", "message": f"No fingerprint for file {file_id}"}), 404
+
+    try:
+        similarity_index.refresh()
+        matches = similarity_index.query(signature, max_distance=max_distance, limit=limit)
+        files = fetch_files_by_checksums([checksum for checksum, _ in matches])
+    except Exception as e:
+        logger.exception(f"Error searching files similar to {file_id}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    results = [{"checksum": checksum, "distance": distance, "files": files.get(checksum, [])}
+               for checksum, distance in matches]
+    return jsonify({"file_id": file_id, "signature": f"{signature:016x}", "matches": results}), 200
+
+
+@api_blueprint.route('/fingerprints', methods=['POST'])
+def receive_fingerprint():
+    """
+    Store a fingerprint computed outside the collector. Accepts either a
+    `signature` (16 hex digits) or `thumbnails`, a list of 9x8 grayscale
+    thumbnails with 72 values each.
+    """
+    data = request.json
+    checksum = data.get('checksum')
+
+    if not checksum:
+        return jsonify({"status": "error", "message": "Invalid input: Checksum missing."}), 400
+
+    try:
+        if data.get('signature'):
+            signature = int(data['signature'], 16)
+        elif data.get('thumbnails'):
+            signature = fingerprint_from_thumbnails(data['thumbnails'])
+        else:
+            return jsonify({"status": "error", "message": "Invalid input: Signature or thumbnails missing."}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid input: {e}"}), 400
+
+    try:
+        store_fingerprint(checksum, signature, frames=len(data.get('thumbnails') or []) or None)
+        similarity_index.add(checksum, signature)
+    except Exception as e:
+        logger.exception(f"Error storing fingerprint for {checksum}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+    return jsonify({"status": "success", "signature": f"{signature:016x}"}), 200
+
+
+@api_blueprint.route('/leases', methods=['POST'])
+def lease_local_tasks():
+    """
+    Lease tasks of the datasets an exporter owns, so it can hash the files
+    on its own host instead of the collector reading them over the network.
+    """
+    data = request.json
+    exporter = data.get('exporter')
+    limit = data.get('limit', 100)
+
+    if not exporter:
+        return jsonify({"status": "error", "message": "Invalid input: Exporter missing."}), 400
+
+    try:
+        tasks = lease_tasks(exporter, task_types=data.get('task_types', ['CALC_FILEHASH']), limit=limit)
+    except Exception as e:
+        logger.exception(f"Error leasing tasks to {exporter}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+    logger.info(f"Leased {len(tasks)} tasks to exporter {exporter}.")
+    return jsonify({"tasks": tasks}), 200
+
+
+@api_blueprint.route('/leases/heartbeat', methods=['POST'])
+def renew_exporter_leases():
+    """
+    Renew the running leases of an exporter.
+    """
+    data = request.json
+    exporter = data.get('exporter')
+
+    if not exporter:
+        return jsonify({"status": "error", "message": "Invalid input: Exporter missing."}), 400
+
+    try:
+        renewed = renew_leases(exporter)
+    except Exception as e:
+        logger.exception(f"Error renewing leases of {exporter}: {e}")
+        return jsonify({"status": "error", "message": "Internal server error"}), 500
+    return jsonify({"status": "success", "renewed": renewed}), 200
+
+
+@api_blueprint.route('/leases/results', methods=['POST'])
+def receive_lease_results():
+    """
+    Receive a batch of checksums computed by an exporter. Each result holds
+    the queue_id and either a checksum or an error. Results for tasks that
+    are no longer leased by the exporter (e.g. expired) are ignored; a
+    result with a malformed checksum fails its task and is rejected.
+    """
+    data = request.json
+    exporter = data.get('exporter')
+    results = data.get('results', [])
+
+    if not exporter:
+        return jsonify({"status": "error", "message": "Invalid input: Exporter missing."}), 400
+
+    accepted = 0
+    ignored = 0
+    rejected = 0
+    for result in results:
+        try:
+            task = fetch_leased_task(exporter, result.get('queue_id'))
+            if task is None:
+                ignored += 1
+                continue
+            if result.get('checksum') and not is_checksum(result['checksum']):
+                logger.warning(f"Rejected checksum {result['checksum']!r} of task {task.queue_id} from {exporter}.")
+                mark_task_completed(task.queue_id, 'FAIL', error="Invalid checksum")
+                rejected += 1
+                continue
+            file_info = fetch_file_info(task.file_id)
+            if result.get('checksum') and file_info:
+                handle_file_checksum(file_info, result['checksum'].lower())
+                mark_task_completed(task.queue_id, 'OK')
+            elif file_info is None:
+                mark_task_completed(task.queue_id, 'FAIL', error="File not found", retry=False)
+            else:
+                mark_task_completed(task.queue_id, 'FAIL', error=result.get('error') or "No checksum")
+            accepted += 1
+        except Exception as e:
+            logger.exception(f"Error processing result {result} from {exporter}: {e}")
+            return jsonify({"status": "error", "message": "Internal server error",
+                            "accepted": accepted, "ignored": ignored, "rejected": rejected}), 500
+
+    logger.info(f"Accepted {accepted} results from exporter {exporter}, ignored {ignored}, rejected {rejected}.")
+    return jsonify({"status": "success", "accepted": accepted, "ignored": ignored, "rejected": rejected}), 200
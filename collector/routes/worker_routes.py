@@ -7,6 +7,7 @@ Provides a web interface and API endpoints for managing the worker.
 from flask import Blueprint, render_template, redirect, url_for
 from worker_manager import start_worker, stop_worker
 from database.crud.worker_control import fetch_worker_status
+from database.crud.task_queue import fetch_queue_backlog
 from database.session import get_session
 
 worker_blueprint = Blueprint('worker', __name__, template_folder='../templates')
@@ -15,13 +16,14 @@ worker_blueprint = Blueprint('worker', __name__, template_folder='../templates')
 @worker_blueprint.route('/')
 def worker_dashboard():
     """
-    Display the worker dashboard with its current status and controls.
+    Display the worker dashboard with its current status, controls and the
+    task queue backlog per dataset.
     """
     session = get_session()
     worker_status = fetch_worker_status(session)
     session.close()
 
-    return render_template('worker.html', worker_status=worker_status)
+    return render_template('worker.html', worker_status=worker_status, backlog=fetch_queue_backlog())
 
 
 @worker_blueprint.route('/start', methods=['POST'])
@@ -0,0 +1,166 @@
+# shards.py
+"""
+Shards Module
+
+Multi-collector mode. The shard map lists the collector shards; each shard
+has its own database and one or more collector endpoints (replicas sharing
+that database). Exporters fetch the map from any collector and route every
+dataset to a shard with a consistent hash ring. The fan-out helpers run
+reads on the other shards, so search and duplicate detection cover the
+whole inventory.
+
+SHARD_MAP is the path of a JSON file or the JSON itself:
+
+    {"vnodes": 64, "shards": [
+        {"name": "a", "endpoints": ["http://10.0.0.1:5001", "http://10.0.0.2:5001"]},
+        {"name": "b", "endpoints": ["http://10.0.0.3:5001"]}]}
+
+SHARD_NAME is the shard of this collector. Without a shard map the
+collector runs unsharded.
+"""
+
+import base64
+import http.client
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+logger = logging.getLogger(__name__)
+
+SHARD_NAME = os.getenv('SHARD_NAME')
+FANOUT_TIMEOUT = float(os.getenv('FANOUT_TIMEOUT', 10))
+DEFAULT_VNODES = 64
+
+
+def load_shard_map(value=None):
+    """
+    Load the shard map from a JSON file or a JSON string.
+
+    Args:
+        value (str, optional): File path or JSON. Defaults to the SHARD_MAP environment variable.
+
+    Returns:
+        dict: The shard map with `vnodes` and `shards`; no shards if unsharded.
+    """
+    value = value if value is not None else os.getenv('SHARD_MAP')
+    if not value:
+        return {"vnodes": DEFAULT_VNODES, "shards": []}
+    if os.path.isfile(value):
+        with open(value) as f:
+            value = f.read()
+    data = json.loads(value)
+    shards = data.get("shards", [])
+    names = [shard["name"] for shard in shards]
+    if len(set(names)) != len(names):
+        raise ValueError("Shard names in the shard map must be unique.")
+    for shard in shards:
+        if not shard.get("endpoints"):
+            raise ValueError(f"Shard {shard['name']} has no endpoints.")
+    if SHARD_NAME and shards and SHARD_NAME not in names:
+        raise ValueError(f"SHARD_NAME {SHARD_NAME} is not in the shard map.")
+    return {"vnodes": int(data.get("vnodes", DEFAULT_VNODES)), "shards": shards}
+
+
+shard_map = load_shard_map()
+
+
+def remote_shards():
+    """
+    The shards other than the one of this collector.
+    """
+    return [shard for shard in shard_map["shards"] if shard["name"] != SHARD_NAME]
+
+
+def _get_json(endpoint_url, path, params):
+    url = urlsplit(endpoint_url)
+    conn = http.client.HTTPConnection(url.netloc, timeout=FANOUT_TIMEOUT)
+    try:
+        conn.request("GET", f"{url.path.rstrip('/')}{path}?{urlencode(params or {})}")
+        response = conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{endpoint_url}{path} returned HTTP {response.status}")
+        return json.loads(data)
+    finally:
+        conn.close()
+
+
+def shard_get(shard, path, params=None):
+    """
+    Run a GET request on a shard, trying its endpoints in order.
+
+    Args:
+        shard (dict): The shard from the shard map.
+        path (str): The collector path, e.g. "/api/search".
+        params (dict, optional): The query parameters.
+
+    Returns:
+        dict: The decoded JSON response.
+
+    Raises:
+        RuntimeError: If no endpoint of the shard answered.
+    """
+    errors = []
+    for endpoint_url in shard["endpoints"]:
+        try:
+            return _get_json(endpoint_url, path, params)
+        except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+            logger.warning(f"Shard {shard['name']} endpoint {endpoint_url} failed: {e}")
+            errors.append(str(e))
+    raise RuntimeError(f"No endpoint of shard {shard['name']} answered: {'; '.join(errors)}")
+
+
+def fan_out(path, params=None, shards=None):
+    """
+    Run a GET request on several shards in parallel.
+
+    Args:
+        path (str): The collector path.
+        params (dict or callable, optional): The query parameters, or a
+            function returning them for a shard.
+        shards (list, optional): The shards to ask. Defaults to the remote shards.
+
+    Returns:
+        tuple: The responses by shard name and the names of the shards that failed.
+    """
+    shards = remote_shards() if shards is None else shards
+    if not shards:
+        return {}, []
+
+    def ask(shard):
+        shard_params = params(shard) if callable(params) else params
+        return shard_get(shard, path, shard_params)
+
+    results, failed = {}, []
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = {shard["name"]: executor.submit(ask, shard) for shard in shards}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except RuntimeError as e:
+                logger.error(f"Fan-out to shard {name} failed: {e}")
+                failed.append(name)
+    return results, failed
+
+
+def encode_shard_token(positions):
+    """
+    Encode the keyset position on every shard into an opaque page token.
+    A position of None marks a shard without further results.
+    """
+    return base64.urlsafe_b64encode(json.dumps({"shards": positions}).encode("utf-8")).decode("ascii")
+
+
+def decode_shard_token(token):
+    """
+    Decode a page token of a fan-out search. Raises ValueError on invalid tokens.
+    """
+    if not token:
+        return {}
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))["shards"]
+        return {str(name): (int(after) if after is not None else None) for name, after in positions.items()}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid page token: {e}")
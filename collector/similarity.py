@@ -0,0 +1,145 @@
+# similarity.py
+"""
+Similarity Module
+
+In-memory Hamming-distance index over 64-bit video fingerprints. The
+signatures are kept in a packed uint64 array and scanned with vectorized
+XOR and popcount, which takes a few milliseconds per million entries.
+Without NumPy, a pure Python scan is used instead.
+"""
+
+import logging
+import threading
+from database.crud.fingerprints import fetch_fingerprints_after
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+INITIAL_CAPACITY = 1024
+
+if np is not None:
+    _POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HammingIndex:
+    """
+    Append-only index of (key, 64-bit signature) pairs.
+    Adding an existing key replaces its signature.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._positions = {}
+        self._size = 0
+        self._signatures = np.zeros(INITIAL_CAPACITY, dtype=np.uint64) if np is not None else []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.last_loaded_id = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, signature):
+        """
+        Add or replace the signature of a key.
+
+        Args:
+            key (str): The key, usually the content checksum.
+            signature (int): The 64-bit signature.
+        """
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._size
+                self._positions[key] = position
+                self._keys.append(key)
+                self._size += 1
+                if np is not None:
+                    if position >= len(self._signatures):
+                        grown = np.zeros(len(self._signatures) * 2, dtype=np.uint64)
+                        grown[:position] = self._signatures[:position]
+                        self._signatures = grown
+                else:
+                    self._signatures.append(0)
+            self._signatures[position] = signature
+
+    def query(self, signature, max_distance=10, limit=50):
+        """
+        Find the keys within a Hamming distance of a signature.
+
+        Args:
+            signature (int): The 64-bit signature to search for.
+            max_distance (int): Maximum number of differing bits.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Tuples of (key, distance), closest first.
+        """
+        with self._lock:
+            size = self._size
+            signatures = self._signatures[:size]
+            keys = self._keys[:size]
+
+        if np is not None:
+            distances = _popcount(np.bitwise_xor(signatures, np.uint64(signature)))
+            matches = np.nonzero(distances <= max_distance)[0]
+            matches = matches[np.argsort(distances[matches], kind="stable")][:limit]
+            return [(keys[i], int(distances[i])) for i in matches]
+
+        results = [(keys[i], (s ^ signature).bit_count()) for i, s in enumerate(signatures)]
+        results = [r for r in results if r[1] <= max_distance]
+        results.sort(key=lambda r: r[1])
+        return results[:limit]
+
+    def refresh(self, batch_size=10000):
+        """
+        Load fingerprints that were stored since the last refresh. Refreshes
+        run one at a time, so a query during the warm-up waits for it.
+
+        Returns:
+            int: The number of loaded fingerprints.
+        """
+        loaded = 0
+        with self._refresh_lock:
+            while True:
+                rows = fetch_fingerprints_after(self.last_loaded_id, limit=batch_size)
+                for row_id, checksum, signature in rows:
+                    self.add(checksum, signature)
+                if rows:
+                    self.last_loaded_id = rows[-1][0]
+                    loaded += len(rows)
+                if len(rows) < batch_size:
+                    break
+        if loaded:
+            logger.info(f"Loaded {loaded} fingerprints into the similarity index ({len(self)} total).")
+        return loaded
+
+
+similarity_index = HammingIndex()
+
+
+def _warm_up():
+    try:
+        similarity_index.refresh()
+    except Exception as e:
+        logger.error(f"Warming up the similarity index failed: {e}")
+
+
+def start_warmup():
+    """
+    Load the stored fingerprints into the index in a background thread, so
+    the first similarity query does not have to.
+    """
+    thread = threading.Thread(target=_warm_up, daemon=True, name="similarity-warmup")
+    thread.start()
+    return thread
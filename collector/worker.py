@@ -7,16 +7,135 @@ Processes tasks from the queue and interacts with the database to manage task st
 
 import logging
 import threading
-from database.crud.task_queue import fetch_pending_task, mark_task_completed
+from database.crud.task_queue import fetch_pending_task, mark_task_completed, add_task_to_queue
 from database.crud.inventory import fetch_file_info
 from database.crud.duplicates import update_duplicates_table
+from database.crud.media import fetch_media_metadata, store_media_metadata
 from database.crud.worker_control import fetch_worker_status
+from database.crud.fingerprints import fetch_fingerprint, store_fingerprint
+from media_probe import MediaProber
+from fingerprint import fingerprint_video
+from similarity import similarity_index
 from utils import compute_file_checksum
+from common.tracing import span
 
 logger = logging.getLogger(__name__)
 
 stop_threads = threading.Event()
 
+
+def is_video(file_info):
+    """
+    Check whether an inventory record is a video file.
+    """
+    return (file_info.mime_type or "").startswith("video/")
+
+
+def handle_file_checksum(file_info, checksum):
+    """
+    Store the checksum of a hashed file and queue its follow-up tasks.
+    Used for files hashed by the worker and by exporters alike.
+
+    Args:
+        file_info (Inventory): The hashed file.
+        checksum (str): Its SHA256 checksum.
+    """
+    update_duplicates_table(checksum, file_info.file_id, file_info.size_bytes)
+    if is_video(file_info):
+        add_task_to_queue('PROBE_MEDIA', file_info.file_id, dataset=file_info.dataset)
+
+
+def completing(task, handler):
+    """
+    Wrap a prober callback so its task is always finished: if the handler
+    raises, the task is failed instead of staying RUNNING.
+
+    Args:
+        task (TaskQueue): The task the callback belongs to.
+        handler (callable): Called with (result, error).
+    """
+    def callback(result, error):
+        try:
+            handler(result, error)
+        except Exception as e:
+            logger.error(f"Task {task.queue_id} failed: {e}")
+            mark_task_completed(task.queue_id, 'FAIL', error=e)
+    return callback
+
+
+def process_probe_task(task, prober):
+    """
+    Probe the media metadata of a file. The probe runs in the prober pool;
+    the task is completed from its callback. Contents that were already
+    probed (e.g. duplicates) complete immediately.
+
+    Args:
+        task (TaskQueue): The PROBE_MEDIA task.
+        prober (MediaProber): The prober pool.
+    """
+    file_info = fetch_file_info(task.file_id)
+    if not file_info or not file_info.checksum:
+        logger.error(f"File ID {task.file_id} not found in inventory or not hashed yet.")
+        mark_task_completed(task.queue_id, 'FAIL', error="File not found or not hashed", retry=False)
+        return
+
+    if fetch_media_metadata(file_info.checksum):
+        logger.info(f"Media metadata for checksum {file_info.checksum} already known.")
+        mark_task_completed(task.queue_id, 'OK')
+        return
+
+    def on_probed(metadata, error):
+        if error:
+            logger.error(f"Probing file {task.file_id} failed: {error}")
+            mark_task_completed(task.queue_id, 'FAIL', error=error)
+            return
+        store_media_metadata(file_info.checksum, metadata)
+        logger.info(f"Stored media metadata for file {task.file_id}: {metadata}")
+        add_task_to_queue('CALC_FINGERPRINT', task.file_id, dataset=file_info.dataset)
+        mark_task_completed(task.queue_id, 'OK')
+
+    prober.probe(file_info.checksum, file_info.full_path, completing(task, on_probed))
+
+
+def process_fingerprint_task(task, prober):
+    """
+    Compute the perceptual fingerprint of a video in the prober pool and add
+    it to the similarity index. Contents that already have a fingerprint
+    complete immediately.
+
+    Args:
+        task (TaskQueue): The CALC_FINGERPRINT task.
+        prober (MediaProber): The prober pool.
+    """
+    file_info = fetch_file_info(task.file_id)
+    if not file_info or not file_info.checksum:
+        logger.error(f"File ID {task.file_id} not found in inventory or not hashed yet.")
+        mark_task_completed(task.queue_id, 'FAIL', error="File not found or not hashed", retry=False)
+        return
+
+    if fetch_fingerprint(file_info.checksum) is not None:
+        logger.info(f"Fingerprint for checksum {file_info.checksum} already known.")
+        mark_task_completed(task.queue_id, 'OK')
+        return
+
+    media = fetch_media_metadata(file_info.checksum)
+    duration = media["duration"] if media else None
+    file_path = file_info.full_path
+
+    def on_fingerprinted(result, error):
+        if error:
+            logger.error(f"Fingerprinting file {task.file_id} failed: {error}")
+            mark_task_completed(task.queue_id, 'FAIL', error=error)
+            return
+        store_fingerprint(file_info.checksum, result["signature"], result["frames"])
+        similarity_index.add(file_info.checksum, result["signature"])
+        logger.info(f"Stored fingerprint {result['signature']:016x} for file {task.file_id}.")
+        mark_task_completed(task.queue_id, 'OK')
+
+    prober.submit(("fingerprint", file_info.checksum), lambda: fingerprint_video(file_path, duration),
+                  completing(task, on_fingerprinted))
+
+
 def process_queue(volume_mapping):
     """
     Processes tasks in the queue until stopped.
@@ -24,6 +143,7 @@ def process_queue(volume_mapping):
     Args:
         volume_mapping (dict): Mapping of datasets to volume paths.
     """
+    prober = MediaProber()
     while not stop_threads.is_set():
         worker_status = fetch_worker_status()
         if worker_status != 'RUNNING':
@@ -33,6 +153,7 @@ def process_queue(volume_mapping):
 
         task = fetch_pending_task()
         if task:
+            task_span = span(f"task:{task.task_type}", detail=f"queue_id={task.queue_id}")
             try:
                 logger.info(
                     f"Processing task {task.queue_id} for file {task.file_id} with job {task.task_type}"
@@ -41,26 +162,36 @@ def process_queue(volume_mapping):
                 if task.task_type == 'CALC_FILEHASH':
                     file_info = fetch_file_info(task.file_id)
                     if file_info:
-                        file_path = file_info.path
+                        file_path = file_info.full_path
                         logger.info(f"Computing checksum for path {file_path}...")
                         file_checksum = compute_file_checksum(file_path)
                         if file_checksum:
                             logger.info(f"Checksum is {file_checksum}")
-                            update_duplicates_table(file_checksum, task.file_id, file_info.size_bytes)
+                            handle_file_checksum(file_info, file_checksum)
                             mark_task_completed(task.queue_id, 'OK')
                         else:
                             logger.error(f"Failed to compute checksum for file at {file_path}.")
-                            mark_task_completed(task.queue_id, 'FAIL')
+                            mark_task_completed(task.queue_id, 'FAIL', error="Failed to compute checksum")
                     else:
                         logger.error(f"File ID {task.file_id} not found in inventory.")
-                        mark_task_completed(task.queue_id, 'FAIL')
+                        mark_task_completed(task.queue_id, 'FAIL', error="File not found", retry=False)
+
+                elif task.task_type == 'PROBE_MEDIA':
+                    process_probe_task(task, prober)
 
-                elif task.task_type == 'CONV_VIDEO':
-                    logger.info("Video conversion tasks not yet implemented.")
-                    mark_task_completed(task.queue_id, 'OK')
+                elif task.task_type == 'CALC_FINGERPRINT':
+                    process_fingerprint_task(task, prober)
+
+                else:
+                    logger.error(f"Unknown task type {task.task_type}.")
+                    mark_task_completed(task.queue_id, 'FAIL', error="Unknown task type", retry=False)
 
             except Exception as e:
                 logger.error(f"Task {task.queue_id} failed: {e}")
-                mark_task_completed(task.queue_id, 'FAIL')
+                mark_task_completed(task.queue_id, 'FAIL', error=e)
+            finally:
+                task_span.finish()
         else:
             stop_threads.wait(1)
+
+    prober.shutdown()
@@ -0,0 +1,66 @@
+# worker_manager.py
+"""
+Worker Manager Module
+
+Starts and stops the queue worker thread according to the worker control table.
+"""
+
+import logging
+import threading
+from database.crud.worker_control import fetch_worker_status, set_worker_status
+from worker import process_queue, stop_threads
+
+logger = logging.getLogger(__name__)
+
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+
+def _start_thread(volume_mapping):
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            stop_threads.clear()
+            _worker_thread = threading.Thread(target=process_queue, args=(volume_mapping,), daemon=True,
+                                              name="queue-worker")
+            _worker_thread.start()
+            logger.info("Worker thread started.")
+
+
+def start_worker(volume_mapping=None):
+    """
+    Mark the worker as RUNNING and start the worker thread.
+
+    Args:
+        volume_mapping (dict, optional): Mapping of datasets to volume paths.
+    """
+    set_worker_status('RUNNING')
+    _start_thread(volume_mapping or {})
+
+
+def stop_worker(timeout=30):
+    """
+    Mark the worker as STOPPED and wait for the worker thread to finish.
+
+    Args:
+        timeout (float): Seconds to wait for the running task to finish.
+    """
+    global _worker_thread
+    set_worker_status('STOPPED')
+    stop_threads.set()
+    with _worker_lock:
+        if _worker_thread is not None:
+            _worker_thread.join(timeout)
+            _worker_thread = None
+            logger.info("Worker thread stopped.")
+
+
+def check_and_update_worker_state(volume_mapping=None):
+    """
+    Start the worker thread if the control table says it should be running.
+
+    Args:
+        volume_mapping (dict, optional): Mapping of datasets to volume paths.
+    """
+    if fetch_worker_status() == 'RUNNING':
+        _start_thread(volume_mapping or {})
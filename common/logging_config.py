@@ -5,7 +5,7 @@ Provides centralized logging configuration with support for 'origin' fields.
 """
 
 import logging
-from flask import request
+from flask import has_request_context, request
 
 class OriginFilter(logging.Filter):
     """
@@ -36,6 +36,39 @@ class OriginFilter(logging.Filter):
         return True
 
 
+class RequestOriginFilter(logging.Filter):
+    """
+    Filter that sets the 'origin' field from the endpoint of the current request.
+
+    A single instance serves all requests, so nothing has to be added to the
+    logger per request.
+    """
+
+    def __init__(self, prefix):
+        """
+        Initialize the RequestOriginFilter with an origin prefix.
+
+        Args:
+            prefix (str): The prefix of the origin, e.g. "API".
+        """
+        super().__init__()
+        self.prefix = prefix
+
+    def filter(self, record):
+        """
+        Add the 'origin' field to the log record.
+
+        Args:
+            record (logging.LogRecord): The log record being processed.
+
+        Returns:
+            bool: Always True.
+        """
+        endpoint = request.endpoint if has_request_context() and request.endpoint else "UNKNOWN"
+        record.origin = f"{self.prefix}:{endpoint}"
+        return True
+
+
 class CustomFormatter(logging.Formatter):
     """
     Custom formatter to include the 'origin' field in log messages.
@@ -0,0 +1,108 @@
+# profiling.py
+"""
+Profiling Module
+
+A sampling profiler for the running process. A background thread samples
+the stacks of all other threads at a fixed interval; the samples are written
+in the folded stack format ("frame;frame;frame count") read by flamegraph.pl,
+speedscope and inferno.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads except its own until stopped.
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        Args:
+            interval (float): Seconds between two samples.
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.is_set():
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id)).replace(";", ":").replace(" ", "_")
+                self.samples[f"{thread_name};{_fold(frame)}"] += 1
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop sampling.
+
+        Returns:
+            collections.Counter: The folded stacks with their sample counts.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def format_folded(samples):
+    """
+    Render samples in the folded stack format, one stack per line.
+
+    Args:
+        samples (collections.Counter): Folded stacks with their sample counts.
+
+    Returns:
+        str: The folded stacks.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+def profile_process(seconds, interval=0.01):
+    """
+    Sample all threads of the process for a fixed time.
+
+    Args:
+        seconds (float): How long to sample.
+        interval (float): Seconds between two samples.
+
+    Returns:
+        collections.Counter: The folded stacks with their sample counts.
+    """
+    with StackSampler(interval) as sampler:
+        time.sleep(seconds)
+    return sampler.samples
@@ -0,0 +1,217 @@
+# tracing.py
+"""
+Tracing Module
+
+Lightweight, opt-in span tracing for route handlers, CRUD functions and
+worker tasks. Spans are timed with a per-thread stack, aggregated into
+per-name statistics and, above a configurable threshold, written to the
+slow-operation log together with the time spent in their child spans.
+
+Tracing is off unless TRACING_ENABLED is set or SLOW_OP_MS is above 0.
+While it is off, `traced` returns the undecorated function and `span`
+returns a no-op context manager.
+"""
+
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Operations running longer than SLOW_OP_MS are logged; 0 disables the slow-operation log.
+SLOW_OP_MS = float(os.getenv('SLOW_OP_MS', 0))
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '').lower() in ('1', 'true', 'yes') or SLOW_OP_MS > 0
+
+_local = threading.local()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _record(name, duration, parent):
+    with _stats_lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        entry["count"] += 1
+        entry["total"] += duration
+        entry["max"] = max(entry["max"], duration)
+    if parent is not None:
+        child = parent.children.setdefault(name, [0, 0.0])
+        child[0] += 1
+        child[1] += duration
+
+
+class Span:
+    """
+    A timed operation. Opened spans become the parent of spans opened later
+    in the same thread until they are finished.
+    """
+
+    __slots__ = ("name", "detail", "parent", "started", "children")
+
+    def __init__(self, name, detail=None):
+        """
+        Open the span.
+
+        Args:
+            name (str): The operation name used for the statistics.
+            detail (str, optional): Extra context for the slow-operation log.
+        """
+        stack = _stack()
+        self.name = name
+        self.detail = detail
+        self.parent = stack[-1] if stack else None
+        self.children = {}
+        self.started = time.perf_counter()
+        stack.append(self)
+
+    def finish(self):
+        """
+        Close the span, record it and log it if it was slow.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        duration = time.perf_counter() - self.started
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        elif self in stack:
+            stack.remove(self)
+        _record(self.name, duration, self.parent)
+        if SLOW_OP_MS and duration * 1000 >= SLOW_OP_MS:
+            self._log_slow(duration)
+        return duration
+
+    def _log_slow(self, duration):
+        parts = [f"{name} {total * 1000:.1f} ms" + (f" x{count}" if count > 1 else "")
+                 for name, (count, total) in sorted(self.children.items(), key=lambda c: -c[1][1])]
+        breakdown = f" ({', '.join(parts)})" if parts else ""
+        detail = f" [{self.detail}]" if self.detail else ""
+        logger.warning(f"Slow operation {self.name}{detail} took {duration * 1000:.1f} ms{breakdown}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+        return False
+
+
+class _NoopSpan:
+    def finish(self):
+        return 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, detail=None):
+    """
+    Open a span for use as a context manager, or a no-op if tracing is off.
+
+    Args:
+        name (str): The operation name.
+        detail (str, optional): Extra context for the slow-operation log.
+
+    Returns:
+        Span: The opened span.
+    """
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, detail)
+
+
+def traced(name=None):
+    """
+    Decorator that runs a function inside a span.
+
+    Args:
+        name (str, optional): The span name. Defaults to "<module>.<function>".
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(fn):
+        if not TRACING_ENABLED:
+            return fn
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine):
+    """
+    Time every SQL statement of a SQLAlchemy engine as a "db" child of the
+    current span. Does nothing if tracing is off.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine to instrument.
+    """
+    if not TRACING_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("trace_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["trace_started"].pop()
+        stack = _stack()
+        _record("db", duration, stack[-1] if stack else None)
+        if SLOW_OP_MS and duration * 1000 >= SLOW_OP_MS:
+            logger.warning(f"Slow statement took {duration * 1000:.1f} ms: {' '.join(statement.split())[:500]}")
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        started = context.connection.info.get("trace_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def span_stats():
+    """
+    Aggregated statistics of all finished spans, slowest total first.
+
+    Returns:
+        list: Dictionaries with name, count, total_ms, avg_ms and max_ms.
+    """
+    with _stats_lock:
+        items = [(name, dict(entry)) for name, entry in _stats.items()]
+    return [{
+        "name": name,
+        "count": entry["count"],
+        "total_ms": round(entry["total"] * 1000, 3),
+        "avg_ms": round(entry["total"] * 1000 / entry["count"], 3),
+        "max_ms": round(entry["max"] * 1000, 3),
+    } for name, entry in sorted(items, key=lambda item: -item[1]["total"])]
+
+
+def reset_span_stats():
+    """
+    Discard the aggregated span statistics.
+    """
+    with _stats_lock:
+        _stats.clear()
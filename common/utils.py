@@ -9,9 +9,11 @@ and file path building.
 
 import hashlib
 import logging
+from common.tracing import traced
 
 logger = logging.getLogger(__name__)
 
+@traced("hash")
 def compute_file_checksum(file_path):
     """
     Computes the SHA256 checksum of a file.
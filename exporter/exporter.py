@@ -1,10 +1,17 @@
-#import os
+import argparse
+import bisect
+import os
 import http.client
 import json
 import hashlib
 import mimetypes
+import socket
 import subprocess  # added import for subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
 
 # Constants
@@ -12,9 +19,45 @@ CHUNK_SIZE = 8192
 LOG_LEVEL_INFO = "INFO"
 LOG_LEVEL_ERROR = "ERROR"
 MAX_WORKERS = 16
+HASH_BATCH_SIZE = 100
+LEASE_HEARTBEAT_SECONDS = float(os.getenv("EXPORTER_LEASE_HEARTBEAT_SECONDS", 120))
+SEEN_BATCH_SIZE = 500
+EXPORTER_ID = socket.gethostname()
+COLLECTOR_TIMEOUT = float(os.getenv("COLLECTOR_TIMEOUT", 30))
+SPOOL_DIR = os.getenv("EXPORTER_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_MAX_BYTES = int(os.getenv("EXPORTER_SPOOL_MAX_BYTES", 1024 ** 3))
+SPOOL_SEGMENT_BYTES = int(os.getenv("EXPORTER_SPOOL_SEGMENT_BYTES", 16 * 1024 ** 2))
+SPOOL_DRAIN_SECONDS = float(os.getenv("EXPORTER_SPOOL_DRAIN_SECONDS", 300))
+SPOOL_FSYNC_SECONDS = float(os.getenv("EXPORTER_SPOOL_FSYNC_SECONDS", 1))
+SPOOL_RETRY_SECONDS = 1
+SPOOL_MAX_RETRY_SECONDS = 60
 
 # Initialize log at the top level to ensure it's available globally
 log = None
+# Spools for records the collectors could not take, by shard; set up in main()
+spools = {}
+
+
+class CollectorBusy(Exception):
+    """
+    The collector answered with 429 or a 5xx status.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CollectorRejected(Exception):
+    """
+    The collector rejected a record with a 4xx status. Resending it does not help.
+    """
+
+
+class SpoolFull(Exception):
+    """
+    The spool reached its disk cap.
+    """
 
 
 class Log:
@@ -36,13 +79,18 @@ class Log:
             str: The response from the log server.
         """
         protocol = "http://" if "http://" in self.endpoint_url else "https://"
-        conn = http.client.HTTPConnection(self.endpoint_url)
         payload = json.dumps({"level": level, "message": message})
         headers = {'Content-Type': 'application/json'}
-        conn.request("POST", "/log", payload, headers)
-        response = conn.getresponse()
-        data = response.read()
-        conn.close()
+        try:
+            conn = http.client.HTTPConnection(self.endpoint_url, timeout=COLLECTOR_TIMEOUT)
+            conn.request("POST", "/log", payload, headers)
+            response = conn.getresponse()
+            data = response.read()
+            conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            # A collector that is down must not stop the scan of the other shards.
+            print(f"{level}: {message} (log endpoint unreachable: {e})", file=sys.stderr)
+            return None
         return data
 
     def info(self, message):
@@ -62,6 +110,465 @@ class Log:
         self.send_log_message(LOG_LEVEL_ERROR, message)
 
 
+class ShardRouter:
+    """
+    Routes datasets to collector shards with a consistent hash ring, so that
+    adding or removing a shard only moves the datasets on its part of the ring.
+    A shard lists one or more collector endpoints sharing the shard's database;
+    calls fail over to the next endpoint when one is down. The router is
+    shared by the scan threads; the endpoint order is guarded by a lock.
+    """
+
+    def __init__(self, shards, vnodes=64):
+        """
+        Initialize the ShardRouter.
+        Args:
+            shards (list): Shards with `name` and `endpoints`.
+            vnodes (int): Number of ring points per shard.
+        """
+        self.endpoints = {shard["name"]: list(shard["endpoints"]) for shard in shards}
+        self._lock = threading.Lock()
+        self._ring = sorted((self._hash(f"{name}#{i}"), name) for name in self.endpoints for i in range(vnodes))
+        self._points = [point for point, _ in self._ring]
+
+    @classmethod
+    def from_collector(cls, seeds, shard_map=None, cache_file=None):
+        """
+        Build the router from a shard map, by default the one of the first
+        seed collector that answers. The fetched map is saved to cache_file;
+        if no seed answers, the map saved by an earlier run is used instead.
+        Without shards everything is sent to the seeds.
+        Args:
+            seeds (str or list): The collectors to ask for the shard map.
+            shard_map (dict, optional): A shard map to use instead.
+            cache_file (str, optional): Where to keep the last fetched shard map.
+        Returns:
+            ShardRouter: The router.
+        Raises:
+            ConnectionError: If no seed is reachable and no shard map is cached.
+        """
+        if isinstance(seeds, str):
+            seeds = [seeds]
+        if shard_map is None:
+            shard_map = fetch_cached_shard_map(seeds, cache_file)
+        shards = shard_map.get("shards") or [{"name": "default", "endpoints": seeds}]
+        return cls(shards, shard_map.get("vnodes", 64))
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def shard_for(self, key):
+        """
+        Returns the name of the shard a key (the dataset name) belongs to.
+        """
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._ring[index][1]
+
+    def call(self, shard, func, *args, **kwargs):
+        """
+        Calls an endpoint function with the endpoint_url of the shard, failing
+        over to the next endpoint of the shard if a collector is unreachable.
+        The endpoint that answered is tried first next time.
+        Args:
+            shard (str): The shard name.
+            func (callable): A function taking an `endpoint_url` keyword argument.
+        Returns:
+            The result of the function.
+        Raises:
+            ConnectionError: If no endpoint of the shard is reachable.
+        """
+        endpoints = self.endpoints[shard]
+        with self._lock:
+            candidates = list(endpoints)
+        for endpoint_url in candidates:
+            try:
+                result = func(*args, endpoint_url=endpoint_url, **kwargs)
+            except (OSError, http.client.HTTPException) as e:
+                log.error(f"Collector {endpoint_url} of shard {shard} failed: {e}")
+                continue
+            with self._lock:
+                if endpoints[0] != endpoint_url:
+                    endpoints.remove(endpoint_url)
+                    endpoints.insert(0, endpoint_url)
+            return result
+        raise ConnectionError(f"No collector of shard {shard} is reachable.")
+
+    def endpoint(self, shard):
+        """
+        Returns a reachable endpoint of the shard.
+        """
+        self.call(shard, ping_collector)
+        with self._lock:
+            return self.endpoints[shard][0]
+
+
+class Spool:
+    """
+    Durable spool for records the collector could not take. Records are
+    appended as JSON lines to numbered segment files; a segment is deleted
+    once all its records have been delivered. The depth counts every record
+    that is not delivered yet, including the one being replayed.
+
+    Every append is flushed to the operating system, so a crash of the
+    exporter loses no records. The fsync is batched: it runs at most every
+    `fsync_seconds` on append, when a segment is rotated or the spool is
+    closed, and from the replay loop through `sync_if_due` once appends have
+    waited `fsync_seconds`. A power loss can lose the records of about the
+    last `fsync_seconds`.
+    Records the collector will never take are moved to `quarantine.jsonl`.
+    """
+
+    def __init__(self, directory, max_bytes=SPOOL_MAX_BYTES, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 fsync_seconds=SPOOL_FSYNC_SECONDS):
+        """
+        Initialize the Spool and pick up the segments of earlier runs.
+        Args:
+            directory (str): Directory holding the segment files.
+            max_bytes (int): Disk cap of all segments together.
+            segment_bytes (int): Size at which a new segment is started.
+            fsync_seconds (float): Maximum time between two fsyncs of the newest segment;
+                0 syncs every append.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_seconds = fsync_seconds
+        self.quarantined = 0
+        self._synced_at = time.monotonic()
+        self._unsynced = False
+        self.spooled = Counter()
+        self._cond = threading.Condition()
+        self._writer = None
+        self._reader = None
+        self._pending = None
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(name[len("segment-"):-len(".jsonl")]) for name in os.listdir(directory)
+                                if name.startswith("segment-") and name.endswith(".jsonl"))
+        self.size_bytes = sum(os.path.getsize(self._path(n)) for n in self._segments)
+        self.depth = 0
+        for number in self._segments:
+            with open(self._path(number), "rb") as f:
+                self.depth += sum(1 for line in f if line.endswith(b"\n"))
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"segment-{number:010d}.jsonl")
+
+    def append(self, record):
+        """
+        Appends a record to the newest segment.
+        Args:
+            record (dict): The record with `path`, `payload` and `dataset`.
+        Raises:
+            SpoolFull: If the record would exceed the disk cap.
+        """
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._cond:
+            if self.size_bytes + len(line) > self.max_bytes:
+                raise SpoolFull(f"Spool {self.directory} is full ({self.size_bytes} bytes).")
+            if self._writer is None or self._writer.tell() + len(line) > self.segment_bytes:
+                self._rotate()
+            self._writer.write(line)
+            self._writer.flush()
+            self._unsynced = True
+            self._sync_if_due()
+            self.size_bytes += len(line)
+            self.depth += 1
+            self.spooled[record.get("dataset")] += 1
+            self._cond.notify_all()
+
+    def sync_if_due(self):
+        """
+        Fsyncs the newest segment if appends have waited `fsync_seconds` for it.
+        """
+        with self._cond:
+            self._sync_if_due()
+
+    def _sync_if_due(self):
+        if self._unsynced and time.monotonic() - self._synced_at >= self.fsync_seconds:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._writer.fileno())
+        self._synced_at = time.monotonic()
+        self._unsynced = False
+
+    def _rotate(self):
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+        number = self._segments[-1] + 1 if self._segments else 1
+        self._segments.append(number)
+        self._writer = open(self._path(number), "ab")
+
+    def _read_next(self):
+        while self._segments:
+            head = self._segments[0]
+            if self._reader is None:
+                self._reader = open(self._path(head), "rb")
+            position = self._reader.tell()
+            line = self._reader.readline()
+            if line.endswith(b"\n"):
+                try:
+                    return json.loads(line)
+                except ValueError:
+                    log.error(f"Dropping a corrupt record in spool segment {head}.")
+                    self.depth -= 1
+                    continue
+            if self._writer is not None and head == self._segments[-1]:
+                if line:
+                    # A record is still being written.
+                    self._reader.seek(position)
+                    return None
+                # Replay caught up with the writer; the next append starts a new segment.
+                self._writer.close()
+                self._writer = None
+            # A delivered segment; a partial last line is a write torn by a crash.
+            self._reader.close()
+            self._reader = None
+            self.size_bytes -= os.path.getsize(self._path(head))
+            os.remove(self._path(head))
+            self._segments.pop(0)
+        return None
+
+    def peek(self, timeout=None):
+        """
+        Returns the oldest undelivered record, waiting up to `timeout` seconds for one.
+        Returns None if the spool stays empty.
+        """
+        with self._cond:
+            if self._pending is None:
+                self._pending = self._read_next()
+                if self._pending is None:
+                    self._cond.wait(timeout)
+                    self._pending = self._read_next()
+            return self._pending
+
+    def ack(self):
+        """
+        Marks the record returned by `peek` as delivered.
+        """
+        with self._cond:
+            self._pending = None
+            self.depth -= 1
+            self._cond.notify_all()
+
+    def quarantine(self, record, error):
+        """
+        Moves the record returned by `peek` to the quarantine file, for
+        records the collector will never take.
+        Args:
+            record: The record.
+            error (str): Why the record was not delivered.
+        """
+        with self._cond:
+            with open(os.path.join(self.directory, "quarantine.jsonl"), "ab") as f:
+                f.write((json.dumps({"record": record, "error": error}) + "\n").encode("utf-8"))
+                os.fsync(f.fileno())
+            self.quarantined += 1
+        self.ack()
+
+    def wait_empty(self, timeout):
+        """
+        Waits until all records are delivered.
+        Returns:
+            bool: True if the spool is empty.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.depth and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return self.depth == 0
+
+    def close(self):
+        with self._cond:
+            if self._writer is not None:
+                self._sync()
+                self._writer.close()
+                self._writer = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+def post_record(path, payload, endpoint_url):
+    """
+    Posts a record to the collector.
+    Args:
+        path (str): The collector path, e.g. "/files".
+        payload (dict): The record.
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        dict: The response from the server.
+    Raises:
+        CollectorBusy: If the collector answers with 429 or a 5xx status.
+        CollectorRejected: If the collector rejects the record with another 4xx status.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    headers = {'Content-Type': 'application/json'}
+    try:
+        conn.request("POST", path, json.dumps(payload), headers)
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    if response.status == 429 or response.status >= 500:
+        retry_after = response.getheader("Retry-After")
+        raise CollectorBusy(f"Collector {endpoint_url} answered {path} with HTTP {response.status}",
+                            float(retry_after) if retry_after and retry_after.isdigit() else None)
+    if response.status >= 400:
+        raise CollectorRejected(f"Collector {endpoint_url} rejected {path} with HTTP {response.status}: "
+                                f"{data[:200]}")
+    return json.loads(data) if data else None
+
+
+def submit_record(path, payload, dataset_name, router, shard):
+    """
+    Sends a record to a collector of the shard, or spools it in the spool of
+    the shard if no collector of the shard is reachable or the collector is
+    busy. While older records of the shard are spooled, new records are
+    spooled behind them, so a scan's status always arrives after its files.
+    Args:
+        path (str): The collector path.
+        payload (dict): The record.
+        dataset_name (str): The dataset of the record.
+        router (ShardRouter): Fails over between the endpoints of the shard.
+        shard (str): The shard name.
+    Returns:
+        dict: The response from the server, or None if the record was spooled.
+    """
+    shard_spool = spools.get(shard)
+    if shard_spool is None:
+        return router.call(shard, post_record, path, payload)
+    if not shard_spool.depth:
+        try:
+            return router.call(shard, post_record, path, payload)
+        except (ConnectionError, CollectorBusy) as e:
+            if not shard_spool.depth:
+                log.error(f"Collector unavailable, spooling records: {e}")
+    shard_spool.append({"path": path, "payload": payload, "dataset": dataset_name})
+    return None
+
+
+def failed_status(path, payload):
+    """
+    Returns the payload of a scan close or status update with the status
+    switched to FAILURE; other payloads are returned unchanged.
+    """
+    if path.startswith("/scans/") and path.endswith("/finish"):
+        return {**payload, "status": "FAILURE"}
+    if path == "/update_status":
+        return {**payload, "status": {**payload["status"], "status": "FAILURE"}}
+    return payload
+
+
+def replay_spool(spool, router, shard, stop_event):
+    """
+    Replays the spooled records of a shard in order until stopped. Records
+    are resubmitted until the collector takes them; the upserts on the
+    collector are idempotent, so a record replayed twice after a crash does
+    no harm. While the shard is down or busy the replay backs off exponentially.
+
+    The loop wakes at least every second, also while it backs off, to fsync
+    the records appended since the last fsync of the spool.
+
+    A record the collector rejects or that cannot be sent at all is moved to
+    the quarantine file and the replay goes on. The later scan close and
+    status update of its dataset are then replayed as a FAILURE, so the
+    collector neither sweeps nor advances the scan cursor past the record.
+    Args:
+        spool (Spool): The spool of the shard.
+        router (ShardRouter): Fails over between the endpoints of the shard.
+        shard (str): The shard name.
+        stop_event (threading.Event): Stops the replay.
+    """
+    delay = SPOOL_RETRY_SECONDS
+    failed_datasets = set()
+
+    def pause(seconds):
+        deadline = time.monotonic() + seconds
+        while not stop_event.wait(min(1, max(deadline - time.monotonic(), 0))) and time.monotonic() < deadline:
+            spool.sync_if_due()
+
+    while not stop_event.is_set():
+        record = spool.peek(timeout=1)
+        spool.sync_if_due()
+        if record is None:
+            continue
+        try:
+            payload = record["payload"]
+            if record.get("dataset") in failed_datasets:
+                payload = failed_status(record["path"], payload)
+            router.call(shard, post_record, record["path"], payload)
+        except (ConnectionError, CollectorBusy) as e:
+            wait = e.retry_after if isinstance(e, CollectorBusy) and e.retry_after else delay
+            log.error(f"Spool replay of shard {shard} paused for {wait:.0f}s with {spool.depth} records left: {e}")
+            pause(wait)
+            delay = min(delay * 2, SPOOL_MAX_RETRY_SECONDS)
+            continue
+        except (CollectorRejected, KeyError, TypeError, ValueError, AttributeError) as e:
+            log.error(f"Quarantining a spooled record of shard {shard}: {e}")
+            if isinstance(record, dict):
+                failed_datasets.add(record.get("dataset"))
+            spool.quarantine(record, str(e))
+            continue
+        except Exception as e:
+            log.error(f"Spool replay of shard {shard} failed, retrying in {delay:.0f}s: {e}")
+            pause(delay)
+            delay = min(delay * 2, SPOOL_MAX_RETRY_SECONDS)
+            continue
+        spool.ack()
+        delay = SPOOL_RETRY_SECONDS
+
+
+class ScanProfiler:
+    """
+    Samples the stacks of all exporter threads while a scan runs and writes
+    them in the folded stack format ("frame;frame;frame count") read by
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, output_path, interval=0.01):
+        """
+        Initialize the ScanProfiler.
+        Args:
+            output_path (str): File the folded stacks are written to.
+            interval (float): Seconds between two samples.
+        """
+        self.output_path = output_path
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="scan-profiler")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(names))] += 1
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        with open(self.output_path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        log.info(f"Wrote {sum(self.samples.values())} profile samples to {self.output_path}.")
+        return False
+
+
 def list_datasets(clusters):
     datasets = []
     for cluster in clusters:
@@ -76,6 +583,75 @@ def list_datasets(clusters):
     return datasets
 
 
+def ping_collector(endpoint_url):
+    """
+    Checks that a collector answers, without asking it for any data.
+    Args:
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        int: The HTTP status of the answer.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    try:
+        conn.request("GET", "/ping")
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    return response.status
+
+
+def fetch_shard_map(endpoint_url):
+    """
+    Fetches the shard map from a collector.
+    Args:
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        dict: The shard map; empty if the collector does not know about shards.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    conn.request("GET", "/shards")
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    if response.status == 404:
+        return {}
+    return json.loads(data)
+
+
+def fetch_cached_shard_map(seeds, cache_file=None):
+    """
+    Fetches the shard map from the first seed collector that answers and
+    saves it to cache_file. Falls back to the saved map if no seed answers.
+    Args:
+        seeds (list): The endpoint URLs of the seed collectors.
+        cache_file (str, optional): Where to keep the last fetched shard map.
+    Returns:
+        dict: The shard map.
+    Raises:
+        ConnectionError: If no seed is reachable and no shard map is cached.
+    """
+    for seed in seeds:
+        try:
+            shard_map = fetch_shard_map(seed)
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            log.error(f"Seed collector {seed} failed: {e}")
+            continue
+        if cache_file:
+            os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+            with open(cache_file + ".tmp", "w") as f:
+                json.dump(shard_map, f)
+            os.replace(cache_file + ".tmp", cache_file)
+        return shard_map
+    if cache_file and os.path.exists(cache_file):
+        log.error(f"No seed collector is reachable; using the shard map saved in {cache_file}.")
+        with open(cache_file) as f:
+            return json.load(f)
+    raise ConnectionError(f"No seed collector is reachable: {', '.join(seeds)}.")
+
+
 def send_dataset_info(datasets, endpoint_url):
     """
     Sends dataset information to the specified endpoint and receives the enabled datasets and file extensions.
@@ -86,8 +662,9 @@ def send_dataset_info(datasets, endpoint_url):
         dict: The response from the server containing enabled datasets and file extensions.
     """
     protocol = "http://" if "http://" in endpoint_url else "https://"
-    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""))
-    payload = json.dumps({"datasets": datasets})
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    payload = json.dumps({"datasets": datasets, "exporter": EXPORTER_ID})
     headers = {'Content-Type': 'application/json'}
     conn.request("POST", "/datasets", payload, headers)
     response = conn.getresponse()
@@ -96,70 +673,249 @@ def send_dataset_info(datasets, endpoint_url):
     return json.loads(data)
 
 
-def update_scan_status(dataset, status, endpoint_url):
+def update_scan_status(dataset, status, router, shard):
     """
     Updates the scan status of a dataset on the remote endpoint.
     Args:
         dataset (dict): The dataset information.
         status (dict): The status information containing the last scan timestamp and success flag.
-        endpoint_url (str): The endpoint URL to update the status information.
+        router (ShardRouter): Routes the update to a collector of the shard.
+        shard (str): The shard of the dataset.
     Returns:
-        dict: The response from the server.
+        dict: The response from the server, or None if the update was spooled.
     """
-    protocol = "http://" if "http://" in endpoint_url else "https://"
-    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""))
-    payload = json.dumps({"dataset": dataset, "status": status})
+    return submit_record("/update_status", {"dataset": dataset, "status": status}, dataset["dataset"], router, shard)
+
+
+def start_scan_generation(dataset_name, scan_type, endpoint_url, cluster=None):
+    """
+    Opens a scan generation for a dataset on the remote endpoint.
+    Args:
+        dataset_name (str): The name of the dataset.
+        scan_type (str): The type of the scan ("full" or "incremental").
+        endpoint_url (str): The endpoint URL of the collector.
+        cluster (str, optional): The cluster of the dataset.
+    Returns:
+        int: The id of the scan generation.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    payload = json.dumps({"dataset": dataset_name, "cluster": cluster, "scan_type": scan_type})
     headers = {'Content-Type': 'application/json'}
-    conn.request("POST", "/update_status", payload, headers)
+    conn.request("POST", "/scans", payload, headers)
     response = conn.getresponse()
     data = response.read()
     conn.close()
-    return json.loads(data)
+    return json.loads(data)["generation_id"]
 
 
-def generate_file_id(file_path):
+def finish_scan_generation(generation_id, status, files_seen, router, shard, dataset_name=None):
     """
-    Generate a unique identifier for a file based on its path and content.
+    Closes a scan generation on the remote endpoint. Closing a successful full
+    scan makes the collector remove files the scan did not see, so a spooled
+    close is only replayed after the files of the scan.
     Args:
-        file_path (str): The path to the file.
+        generation_id (int): The id of the scan generation.
+        status (str): The scan status ("SUCCESS" or "FAILURE").
+        files_seen (int): The number of files the scan visited.
+        router (ShardRouter): Routes the request to a collector of the shard.
+        shard (str): The shard of the dataset.
+        dataset_name (str, optional): The dataset of the scan.
     Returns:
-        str: The SHA-256 hash-based file identifier, or None if the file is missing.
+        dict: The response from the server, or None if the request was spooled.
     """
-    sha256 = hashlib.sha256()
-    sha256.update(file_path.encode('utf-8'))
+    return submit_record(f"/scans/{generation_id}/finish", {"status": status, "files_seen": files_seen},
+                         dataset_name, router, shard)
+
+
+def mark_files_seen(generation_id, file_ids, endpoint_url):
+    """
+    Stamps files the collector already knows with a scan generation.
+    Args:
+        generation_id (int): The id of the scan generation.
+        file_ids (list): The ids of the files the scan saw.
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        list: The ids of the files the collector does not know yet.
+    """
+    return post_record(f"/scans/{generation_id}/seen", {"file_ids": file_ids, "exporter": EXPORTER_ID},
+                       endpoint_url)["unknown"]
+
+
+class ScanSender:
+    """
+    Sends the files of one scan to the collector. With a scan generation the
+    file ids are stamped in batches first, and only the files the collector
+    does not know yet are sent in full. Counts the files sent, stamped and
+    failed; a scan with failed files must not close its generation as a
+    success, since the sweep would remove the files that were not stamped.
+    """
+
+    def __init__(self, router, shard, dataset_name, scan_generation=None, batch_size=SEEN_BATCH_SIZE):
+        """
+        Initialize the ScanSender. Every request fails over on its own, so a
+        collector that dies during the scan is replaced by its replica.
+        Args:
+            router (ShardRouter): Routes the requests to a collector of the shard.
+            shard (str): The shard of the dataset.
+            dataset_name (str): The name of the dataset.
+            scan_generation (int, optional): The scan generation the files are stamped with.
+            batch_size (int): Number of file ids stamped per request.
+        """
+        self.router = router
+        self.shard = shard
+        self.dataset_name = dataset_name
+        self.scan_generation = scan_generation
+        self.batch_size = batch_size
+        self.sent = 0
+        self.stamped = 0
+        self.failed = 0
+        self._batch = []
+        self._lock = threading.Lock()
+
+    def _count(self, sent=0, stamped=0, failed=0):
+        with self._lock:
+            self.sent += sent
+            self.stamped += stamped
+            self.failed += failed
+
+    def fail(self):
+        """
+        Counts a file that could not be read.
+        """
+        self._count(failed=1)
+
+    def walk_error(self, error):
+        """
+        `onerror` callback of os.walk: counts a directory that could not be
+        listed as a failure, since its files are missing from the scan.
+        """
+        log.error(f"Could not list {error.filename} in {self.dataset_name}: {error}")
+        self._count(failed=1)
+
+    def add(self, file_info):
+        """
+        Sends a file, or queues it for the next stamp batch.
+        """
+        if self.scan_generation is None:
+            self._send([file_info])
+            return
+        with self._lock:
+            self._batch.append(file_info)
+            if len(self._batch) < self.batch_size:
+                return
+            batch, self._batch = self._batch, []
+        self._stamp(batch)
+
+    def flush(self):
+        """
+        Stamps the files still queued.
+        """
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._stamp(batch)
+
+    def _stamp(self, batch):
+        try:
+            unknown = set(self.router.call(self.shard, mark_files_seen, self.scan_generation,
+                                           [f["file_id"] for f in batch]))
+        except (OSError, http.client.HTTPException, CollectorBusy, CollectorRejected, KeyError, TypeError,
+                ValueError) as e:
+            log.error(f"Could not stamp {len(batch)} files of {self.dataset_name}, sending them in full: {e}")
+            unknown = {f["file_id"] for f in batch}
+        self._count(stamped=len(batch) - len(unknown))
+        self._send([f for f in batch if f["file_id"] in unknown])
+
+    def _send(self, file_infos):
+        for file_info in file_infos:
+            if self.scan_generation is not None:
+                file_info["scan_generation"] = self.scan_generation
+            try:
+                send_file_info_message(file_info, self.router, self.shard)
+            except (OSError, http.client.HTTPException, CollectorBusy, CollectorRejected, SpoolFull,
+                    ValueError) as e:
+                log.error(f"Could not send {file_info['path']}: {e}")
+                self._count(failed=1)
+            else:
+                self._count(sent=1)
+
+    def update_stats(self, stats):
+        """
+        Adds the counts to the scan statistics.
+        """
+        stats['files_sent'] = self.sent + self.stamped
+        stats['files_stamped'] = self.stamped
+        stats['files_failed'] = self.failed
+
+
+def hash_file(file_path, id_path=None):
+    """
+    Read a file once and compute both its identifier and the SHA256 checksum of its content.
+    Args:
+        file_path (str): The path the content is read from.
+        id_path (str, optional): The path mixed into the identifier, e.g. the live path
+            of a file read from a snapshot. Defaults to `file_path`.
+    Returns:
+        tuple: The file identifier and the content checksum, or None if the file is missing.
+    """
+    file_id = hashlib.sha256()
+    file_id.update((id_path or file_path).encode('utf-8'))
+    checksum = hashlib.sha256()
     try:
         with open(file_path, 'rb') as f:
             while chunk := f.read(CHUNK_SIZE):
-                sha256.update(chunk)
+                file_id.update(chunk)
+                checksum.update(chunk)
     except FileNotFoundError:
         log.error(f"File {file_path} not found for hashing.")
         return None
-    return sha256.hexdigest()
+    return file_id.hexdigest(), checksum.hexdigest()
 
 
-def get_file_properties(file_path, dataset):
+def generate_file_id(file_path, id_path=None):
+    """
+    Generate a unique identifier for a file based on its path and content.
+    Args:
+        file_path (str): The path the content is read from.
+        id_path (str, optional): The path mixed into the identifier, e.g. the live path
+            of a file read from a snapshot. Defaults to `file_path`.
+    Returns:
+        str: The SHA-256 hash-based file identifier, or None if the file is missing.
+    """
+    hashes = hash_file(file_path, id_path)
+    return hashes[0] if hashes else None
+
+
+def get_file_properties(file_path, dataset, live_path=None):
     """
     Gather metadata for a given file, including its size, MIME type, and extension.
     Args:
         file_path (str): The path to the file.
         dataset (str): The dataset name.
+        live_path (str, optional): The canonical live path of a file read from a snapshot.
+            It is reported as `path` and used for the file id. Defaults to `file_path`.
     Returns:
-        dict: File metadata including `path`, `file_id`, `filename`, `extension`, `size_bytes`,
-              `size_human`, and `mime_type`. Returns None if metadata cannot be collected.
+        dict: File metadata including `path`, `file_id`, `checksum`, `filename`, `extension`,
+              `size_bytes`, `size_human`, and `mime_type`. Returns None if metadata cannot be collected.
     """
+    live_path = live_path or file_path
     try:
-        file_id = generate_file_id(file_path)
-        if file_id is None:
+        hashes = hash_file(file_path, live_path)
+        if hashes is None:
             return None
+        file_id, checksum = hashes
         file_info = {
-            "path": file_path,
+            "path": live_path,
             "file_id": file_id,
-            "filename": os.path.basename(file_path),
-            "extension": os.path.splitext(file_path)[1],
+            "checksum": checksum,
+            "filename": os.path.basename(live_path),
+            "extension": os.path.splitext(live_path)[1],
             "size_bytes": os.path.getsize(file_path),
             "size_human": human_readable_size(os.path.getsize(file_path)),
             "mime_type": mimetypes.guess_type(file_path)[0] or "unknown",
-            "dataset": str(dataset)
+            "dataset": str(dataset),
+            "exporter": EXPORTER_ID
         }
         log.info(f"File properties collected: {file_info}")
         return file_info
@@ -168,35 +924,140 @@ def get_file_properties(file_path, dataset):
         return None
 
 
-def send_file_info_message(file_info, endpoint_url):
+def send_file_info_message(file_info, router, shard):
     """
-    Sends file information to the specified endpoint.
+    Sends file information to a collector of the shard, or spools it if the
+    shard is unreachable or busy.
     Args:
         file_info (dict): The file information to send.
-        endpoint_url (str): The endpoint URL for sending data.
+        router (ShardRouter): Routes the record to a collector of the shard.
+        shard (str): The shard of the dataset.
     Returns:
-        str: The response from the server.
+        dict: The response from the server, or None if the record was spooled.
     """
-    protocol = "http://" if "http://" in endpoint_url else "https://"
-    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""))
-    payload = json.dumps(file_info)
+    return submit_record("/files", file_info, file_info["dataset"], router, shard)
+
+
+def lease_hash_tasks(endpoint_url, limit=HASH_BATCH_SIZE):
+    """
+    Leases hash tasks for the datasets stored on this host.
+    Args:
+        endpoint_url (str): The endpoint URL of the collector.
+        limit (int): Maximum number of tasks to lease.
+    Returns:
+        list: The leased tasks with `queue_id`, `file_id` and `path`.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    payload = json.dumps({"exporter": EXPORTER_ID, "task_types": ["CALC_FILEHASH"], "limit": limit})
     headers = {'Content-Type': 'application/json'}
-    conn.request("POST", "/files", payload, headers)
+    conn.request("POST", "/leases", payload, headers)
     response = conn.getresponse()
     data = response.read()
     conn.close()
-    return data
+    return json.loads(data).get("tasks", [])
+
+
+def renew_hash_leases(endpoint_url):
+    """
+    Extends the leases of the tasks this exporter is hashing.
+    Args:
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        dict: The response from the server.
+    """
+    return post_record("/leases/heartbeat", {"exporter": EXPORTER_ID}, endpoint_url)
+
+
+def send_hash_results(results, endpoint_url):
+    """
+    Sends a batch of computed checksums to the collector.
+    Args:
+        results (list): Dictionaries with `queue_id` and either `checksum` or `error`.
+        endpoint_url (str): The endpoint URL of the collector.
+    Returns:
+        dict: The response from the server.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", "").replace("https://", ""),
+                                      timeout=COLLECTOR_TIMEOUT)
+    payload = json.dumps({"exporter": EXPORTER_ID, "results": results})
+    headers = {'Content-Type': 'application/json'}
+    conn.request("POST", "/leases/results", payload, headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return json.loads(data)
+
+
+def compute_checksum(file_path):
+    """
+    Computes the SHA256 checksum of a file's content.
+    Args:
+        file_path (str): The path to the file.
+    Returns:
+        dict: `checksum` on success, `error` otherwise.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(CHUNK_SIZE):
+                sha256.update(chunk)
+    except (OSError, IOError) as e:
+        return {"error": f"Error reading file {file_path}: {e}"}
+    return {"checksum": sha256.hexdigest()}
+
+
+def process_hash_tasks(endpoint_url, max_workers):
+    """
+    Hashes the files of local datasets on behalf of the collector until no
+    leased tasks are left, so the file contents never cross the network.
+    The leases are renewed every LEASE_HEARTBEAT_SECONDS while a batch is
+    being hashed, so a batch of large files does not outlive its leases.
+    Args:
+        endpoint_url (str): The endpoint URL of the collector.
+        max_workers (int): Number of maximum worker threads for hashing.
+    Returns:
+        int: The number of processed tasks.
+    """
+    processed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            tasks = lease_hash_tasks(endpoint_url)
+            if not tasks:
+                break
+            futures = {}
+            for task in tasks:
+                if task.get("path"):
+                    futures[executor.submit(compute_checksum, task["path"])] = task
+            results = [{"queue_id": t["queue_id"], "error": "File not in inventory"} for t in tasks if not t.get("path")]
+            pending = set(futures)
+            renewed_at = time.monotonic()
+            while pending:
+                done, pending = wait(pending, timeout=LEASE_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append({"queue_id": futures[future]["queue_id"], **future.result()})
+                if pending and time.monotonic() - renewed_at >= LEASE_HEARTBEAT_SECONDS:
+                    try:
+                        renew_hash_leases(endpoint_url)
+                    except (OSError, http.client.HTTPException, CollectorBusy, CollectorRejected, ValueError) as e:
+                        log.error(f"Could not renew the hash leases: {e}")
+                    renewed_at = time.monotonic()
+            send_hash_results(results, endpoint_url)
+            processed += len(results)
+    return processed
 
 
 def get_snapshots(dataset_path):
     """
-    Retrieves ZFS snapshots for a given dataset.
+    Retrieves the ZFS snapshots of a given dataset, oldest first. Snapshots of
+    child datasets are not included; their files are not below the dataset's
+    snapshot directory.
     Args:
         dataset_path (str): The ZFS dataset path.
     Returns:
         list: A list of snapshot names.
     """
-    command = f"zfs list -t snapshot -o name -s creation -r {dataset_path}"
+    command = f"zfs list -t snapshot -o name -s creation -d 1 {dataset_path}"
     result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if result.returncode != 0:
         raise Exception(f"Error running command {command}: {result.stderr.decode()}")
@@ -217,6 +1078,37 @@ def parse_snapshot_timestamp(snapshot_name):
     return datetime.strptime(snapshot_timestamp, "%Y-%m-%d_%H-%M")
 
 
+def snapshot_directory(dataset_path, snapshot_name):
+    """
+    Returns the directory holding the files of a snapshot of the dataset.
+    Args:
+        dataset_path (str): The mount path of the dataset.
+        snapshot_name (str): The snapshot name as listed by `zfs list` ("pool/dataset@snap").
+    Returns:
+        str: The snapshot directory below `<dataset_path>/.zfs/snapshot`.
+    """
+    return os.path.join(dataset_path, ".zfs", "snapshot", snapshot_name.split('@', 1)[1])
+
+
+def canonical_path(file_path, dataset_path):
+    """
+    Maps a path inside a snapshot back to the live path of the file, so the
+    same file gets the same id and inventory row in every snapshot.
+    Snapshots are read below `<dataset>/.zfs/snapshot/<snap>/`.
+    Args:
+        file_path (str): The path of the file.
+        dataset_path (str): The mount path of the dataset.
+    Returns:
+        str: The live path; paths outside a snapshot are returned unchanged.
+    """
+    dataset_path = dataset_path.rstrip(os.sep)
+    snapshot_root = os.path.join(dataset_path, ".zfs", "snapshot") + os.sep
+    if file_path.startswith(snapshot_root):
+        relative = file_path[len(snapshot_root):].partition(os.sep)[2]
+        return os.path.join(dataset_path, relative) if relative else dataset_path
+    return file_path
+
+
 def filter_snapshots_after(snapshots, timestamp):
     """
     Filters snapshots after a given timestamp.
@@ -229,26 +1121,34 @@ def filter_snapshots_after(snapshots, timestamp):
     return [s for s in snapshots if parse_snapshot_timestamp(s) > timestamp]
 
 
-def process_file(file_path, dataset, endpoint_url):
-    file_info = get_file_properties(file_path, dataset)
-    if file_info:
-        send_file_info_message(file_info, endpoint_url)
-        return file_info
-    return None
+def process_file(file_path, dataset, sender, live_path=None):
+    file_info = get_file_properties(file_path, dataset, live_path)
+    if file_info is None:
+        sender.fail()
+        return None
+    sender.add(file_info)
+    return file_info
 
 
-def scan_incremental(dataset_path, last_scan_timestamp, endpoint_url, file_extensions, max_workers, dataset_name):
+def scan_incremental(dataset_path, last_scan_timestamp, router, shard, file_extensions, max_workers, dataset_name,
+                     stats=None):
     """
     Perform an incremental scan of the dataset from the nearest snapshot since the last scan.
     Args:
         dataset_path (str): The path to the dataset to be scanned.
         last_scan_timestamp (datetime): The timestamp of the last scan.
-        endpoint_url (str): The endpoint URL to send file information messages.
+        router (ShardRouter): Routes the file information to a collector of the shard.
+        shard (str): The shard of the dataset.
         file_extensions (list): List of allowed file extensions.
         max_workers (int): Number of maximum worker threads for concurrent processing.
         dataset_name (str): The name of the dataset.
+        stats (dict, optional): Receives `files_seen`, `files_sent`, `files_failed` and
+            `last_snapshot` of the scan.
     Returns:
         list: A list of file information dictionaries for new or changed files.
+
+    A file that appears in several snapshots is sent once, under its live
+    path, with the content of the newest snapshot that contains it.
     """
     snapshots = get_snapshots(dataset_path)
     if not snapshots:
@@ -259,20 +1159,32 @@ def scan_incremental(dataset_path, last_scan_timestamp, endpoint_url, file_exten
         nearest_snapshot = min(snapshots, key=lambda s: abs(parse_snapshot_timestamp(s) - last_scan_timestamp))
         newer_snapshots.append(nearest_snapshot)
 
-    file_info_list = []
-    futures = []
+    # Snapshots are listed oldest first, so later copies of a file replace earlier ones.
+    sender = ScanSender(router, shard, dataset_name)
+    latest = {}
+    copies = 0
+    for snapshot in newer_snapshots:
+        for root, _, files in os.walk(snapshot_directory(dataset_path, snapshot), onerror=sender.walk_error):
+            for filename in files:
+                if any(filename.endswith(ext) for ext in file_extensions):
+                    file_path = os.path.join(root, filename)
+                    latest[canonical_path(file_path, dataset_path)] = file_path
+                    copies += 1
+    if copies > len(latest):
+        log.info(f"Skipped {copies - len(latest)} snapshot copies of {len(latest)} files in {dataset_name}.")
 
+    file_info_list = []
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for snapshot in newer_snapshots:
-            for root, _, files in os.walk(snapshot):
-                for filename in files:
-                    if any(filename.endswith(ext) for ext in file_extensions):
-                        file_path = os.path.join(root, filename)
-                        futures.append(executor.submit(process_file, file_path, dataset_name, endpoint_url))
+        futures = [executor.submit(process_file, file_path, dataset_name, sender, live_path)
+                   for live_path, file_path in latest.items()]
         for future in as_completed(futures):
             result = future.result()
             if result:
                 file_info_list.append(result)
+    if stats is not None:
+        stats['files_seen'] = len(latest)
+        stats['last_snapshot'] = newer_snapshots[-1]
+        sender.update_stats(stats)
     return file_info_list
 
 
@@ -290,40 +1202,87 @@ def human_readable_size(size_in_bytes):
         size_in_bytes /= 1024
 
 
-def scan_full(dataset_path, endpoint_url, file_extensions, max_workers, dataset_name):
+def scan_full(dataset_path, router, shard, file_extensions, max_workers, dataset_name, stats=None,
+              scan_generation=None):
     """
     Perform a full scan of the dataset.
     Args:
         dataset_path (str): The path to the dataset to be scanned.
-        endpoint_url (str): The endpoint URL to send file information messages.
+        router (ShardRouter): Routes the file information to a collector of the shard.
+        shard (str): The shard of the dataset.
         file_extensions (list): List of allowed file extensions.
         max_workers (int): Number of maximum worker threads for concurrent processing.
         dataset_name (str): The name of the dataset.
+        stats (dict, optional): Receives `files_seen`, `files_sent`, `files_stamped` and
+            `files_failed` of the scan.
+        scan_generation (int, optional): The scan generation every file is stamped with. Known
+            files are stamped in batches instead of being sent in full.
     Returns:
         list: A list of file information dictionaries for all files in the dataset.
     """
     file_info_list = []
     futures = []
+    sender = ScanSender(router, shard, dataset_name, scan_generation)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for root, _, files in os.walk(dataset_path):
+        for root, dirs, files in os.walk(dataset_path, onerror=sender.walk_error):
+            # A visible snapdir would add every snapshot copy of every file to the scan.
+            dirs[:] = [d for d in dirs if d != ".zfs"]
             for filename in files:
                 if any(filename.endswith(ext) for ext in file_extensions):
                     file_path = os.path.join(root, filename)
-                    futures.append(executor.submit(process_file, file_path, dataset_name, endpoint_url))
+                    futures.append(executor.submit(process_file, file_path, dataset_name, sender))
         for future in as_completed(futures):
             result = future.result()
             if result:
                 file_info_list.append(result)
+    sender.flush()
+    if stats is not None:
+        stats['files_seen'] = len(futures)
+        sender.update_stats(stats)
     return file_info_list
 
 
-def scan_datasets(datasets, endpoint_url, file_extensions):
+def register_datasets(datasets, router):
+    """
+    Registers the datasets with the collector shards they are routed to and
+    collects the enabled datasets and file extensions from all shards.
+    Args:
+        datasets (list): The list of datasets with their paths.
+        router (ShardRouter): Routes each dataset to its collector shard.
+    Returns:
+        tuple: The enabled datasets and the sorted list of file extensions.
+    """
+    enabled_datasets = []
+    file_extensions = set()
+    for shard in router.endpoints:
+        shard_datasets = [d for d in datasets if router.shard_for(d["dataset"]) == shard]
+        if not shard_datasets:
+            continue
+        try:
+            response = router.call(shard, send_dataset_info, shard_datasets)
+        except ConnectionError as e:
+            log.error(f"Skipping the datasets of shard {shard}: {e}")
+            continue
+        if not response or "enabled_datasets" not in response or "file_extensions" not in response:
+            log.error(f"Failed to retrieve enabled datasets or file extensions from shard {shard}.")
+            continue
+        enabled_datasets.extend(response["enabled_datasets"])
+        file_extensions.update(response["file_extensions"])
+    return enabled_datasets, sorted(file_extensions)
+
+
+def scan_datasets(datasets, router, file_extensions):
     """
     Scan datasets based on the provided configuration, scan type, and optional dataset name.
+
+    A dataset with a scan cursor (`last_scan`) from the collector is scanned
+    incrementally; the cursor only advances on successful scans, so it is
+    safe to continue from it even after a failed run.
     Args:
         datasets (list): List of datasets to scan.
-        endpoint_url (str): The endpoint URL to send file information messages.
-        file_extensions (list): List of allowed file extensions.
+        router (ShardRouter): Routes each dataset to the collector shard holding it.
+        file_extensions (list): Default list of allowed file extensions, used when a
+            dataset has no extensions of its own.
     Returns:
         None
     """
@@ -333,19 +1292,45 @@ def scan_datasets(datasets, endpoint_url, file_extensions):
             log.error(f"Dataset {dataset['dataset']} is not enabled.")
             continue
         dataset_path = dataset['path']
+        extensions = dataset.get('file_extensions') or file_extensions
+        stats = {}
+        scan_generation = None
+        started = time.monotonic()
+        shard = router.shard_for(dataset['dataset'])
+        shard_spool = spools.get(shard)
+        spooled_before = shard_spool.spooled[dataset['dataset']] if shard_spool is not None else 0
         log.info(f"Processing dataset: {dataset_path}")
         try:
+            try:
+                router.endpoint(shard)
+            except ConnectionError:
+                if shard_spool is None:
+                    raise
+                # Scan anyway; the records are spooled until the shard is back.
             # Determine the type of scan
-            if not dataset.get("last_scan") or dataset.get("status") != 'SUCCESS':
-                log.info(f"Performing a full scan on dataset: {dataset['dataset']}")
-                scan_full(dataset_path, endpoint_url, file_extensions, MAX_WORKERS, dataset['dataset'])
+            if not dataset.get("last_scan"):
                 dataset['scan_type'] = 'full'
+                log.info(f"Performing a full scan on dataset: {dataset['dataset']}")
+                try:
+                    scan_generation = router.call(shard, start_scan_generation, dataset['dataset'], 'full',
+                                                  cluster=dataset.get('cluster'))
+                except (OSError, http.client.HTTPException, ValueError) as e:
+                    if shard_spool is None:
+                        raise
+                    # Without a generation the collector does not sweep files removed since the last scan.
+                    log.error(f"Could not start a scan generation for {dataset['dataset']}, "
+                              f"scanning without removal detection: {e}")
+                scan_full(dataset_path, router, shard, extensions, MAX_WORKERS, dataset['dataset'], stats,
+                          scan_generation)
             else:
+                dataset['scan_type'] = 'incremental'
                 last_scan_timestamp = datetime.strptime(dataset['last_scan'], "%Y-%m-%d_%H-%M")
                 log.info(f"Performing an incremental scan on dataset: {dataset['dataset']}")
-                scan_incremental(dataset_path, last_scan_timestamp, endpoint_url, file_extensions, MAX_WORKERS,
-                                 dataset['dataset'])
-                dataset['scan_type'] = 'incremental'
+                scan_incremental(dataset_path, last_scan_timestamp, router, shard, extensions, MAX_WORKERS,
+                                 dataset['dataset'], stats)
+            if stats.get('files_failed'):
+                # A success would advance the cursor past these files and sweep them.
+                raise RuntimeError(f"{stats['files_failed']} files were not accepted by the collector")
 
             dataset['last_scan'] = current_time.strftime("%Y-%m-%d_%H-%M")
             dataset['status'] = 'SUCCESS'
@@ -353,17 +1338,60 @@ def scan_datasets(datasets, endpoint_url, file_extensions):
             log.error(f"Error processing dataset {dataset['dataset']}: {e}")
             dataset['status'] = 'FAILURE'
 
-        # Update the status on the remote endpoint
-        update_scan_status(dataset, {'last_scan': dataset['last_scan'], 'status': dataset['status'],
-                                     'scan_type': dataset['scan_type']}, endpoint_url)
+        try:
+            if scan_generation is not None:
+                finish_scan_generation(scan_generation, dataset['status'], stats.get('files_seen', 0), router, shard,
+                                       dataset_name=dataset['dataset'])
+
+            # Update the status on the remote endpoint
+            update_scan_status(dataset, {
+                'last_scan': dataset['last_scan'], 'status': dataset['status'],
+                'scan_type': dataset['scan_type'],
+                'last_snapshot': stats.get('last_snapshot'),
+                'scan_duration': round(time.monotonic() - started, 3),
+                'files_seen': stats.get('files_seen', 0),
+                'files_sent': stats.get('files_sent', 0)}, router, shard)
+        except (ConnectionError, SpoolFull, CollectorBusy, CollectorRejected) as e:
+            log.error(f"Could not report the scan of dataset {dataset['dataset']}: {e}")
+
+        summary = (f"Scan of {dataset['dataset']} finished with {dataset['status']}: "
+                   f"{stats.get('files_seen', 0)} files seen, {stats.get('files_stamped', 0)} stamped, "
+                   f"{stats.get('files_sent', 0) - stats.get('files_stamped', 0)} sent, "
+                   f"{stats.get('files_failed', 0)} failed")
+        if shard_spool is not None:
+            summary += (f", {shard_spool.spooled[dataset['dataset']] - spooled_before} spooled; "
+                        f"spool depth of shard {shard} {shard_spool.depth} records ({shard_spool.size_bytes} bytes)")
+        log.info(summary + ".")
 
 
 def main():
-    global log  # Declare log as global to modify it within main
-    endpoint_url = "http://housecat02.pvnkn3t.local:5001"
-    log = Log(endpoint_url)
+    global log, spools  # Declare log and spools as global to modify them within main
+    parser = argparse.ArgumentParser(description="Scan the local datasets and report them to the collector.")
+    parser.add_argument("--collector", default=os.getenv("COLLECTOR_URL", "http://housecat02.pvnkn3t.local:5001"),
+                        help="Comma-separated seed collectors to fetch the shard map from; "
+                             "logs go to the first one.")
+    parser.add_argument("--shard-map", metavar="FILE",
+                        help="Route datasets by this shard map instead of the one of the collector.")
+    parser.add_argument("--spool-dir", default=SPOOL_DIR,
+                        help="Directory for records the collector could not take (default: %(default)s).")
+    parser.add_argument("--spool-max-mb", type=int, default=SPOOL_MAX_BYTES // 1024 ** 2,
+                        help="Disk cap of the spool of each shard in MB (default: %(default)s).")
+    parser.add_argument("--profile-scan", metavar="FILE",
+                        help="Profile the scan and write the folded stacks for a flame graph to FILE.")
+    parser.add_argument("--profile-interval", type=float, default=10, metavar="MS",
+                        help="Milliseconds between two profile samples (default: 10).")
+    args = parser.parse_args()
+
+    seeds = [seed.strip() for seed in args.collector.split(",") if seed.strip()]
+    log = Log(seeds[0])
     log.info("Logging initialized successfully.")
 
+    shard_map = None
+    if args.shard_map:
+        with open(args.shard_map) as f:
+            shard_map = json.load(f)
+    router = ShardRouter.from_collector(seeds, shard_map, os.path.join(args.spool_dir, "shard-map.json"))
+
     clusters = ["cluster-01", "cluster-02"]
     datasets = list_datasets(clusters)
 
@@ -371,20 +1399,56 @@ def main():
         log.error("No datasets found.")
         return
 
-    response = send_dataset_info(datasets, endpoint_url)
-    if not response or "enabled_datasets" not in response or "file_extensions" not in response:
-        log.error("Failed to retrieve enabled datasets or file extensions.")
-        return
+    # One spool per shard, so a shard that is down does not hold up the others.
+    # Records that earlier runs could not deliver are replayed while this run scans.
+    shard_spools = {shard: Spool(os.path.join(args.spool_dir, shard), args.spool_max_mb * 1024 ** 2)
+                    for shard in router.endpoints}
+    spools = shard_spools
+    stop_replay = threading.Event()
+    replayers = []
+    for shard, shard_spool in shard_spools.items():
+        if shard_spool.depth:
+            log.info(f"Replaying {shard_spool.depth} spooled records of shard {shard}.")
+        replayer = threading.Thread(target=replay_spool, args=(shard_spool, router, shard, stop_replay),
+                                    daemon=True, name=f"spool-replay-{shard}")
+        replayer.start()
+        replayers.append(replayer)
 
-    enabled_datasets = response["enabled_datasets"]
-    file_extensions = response["file_extensions"]
+    enabled_datasets, file_extensions = register_datasets(datasets, router)
 
     log.info("Fetched enabled datasets and file extensions from the remote endpoint.")
 
     log.info("Starting the scan.")
-    scan_datasets(enabled_datasets, endpoint_url, file_extensions)
+    if args.profile_scan:
+        with ScanProfiler(args.profile_scan, args.profile_interval / 1000):
+            scan_datasets(enabled_datasets, router, file_extensions)
+    else:
+        scan_datasets(enabled_datasets, router, file_extensions)
     log.info("Scan completed.")
 
+    log.info("Hashing files of local datasets.")
+    hashed = 0
+    for shard in router.endpoints:
+        try:
+            hashed += router.call(shard, process_hash_tasks, max_workers=MAX_WORKERS)
+        except ConnectionError as e:
+            log.error(f"Skipping the hash tasks of shard {shard}: {e}")
+    log.info(f"Hashed {hashed} files.")
+
+    deadline = time.monotonic() + SPOOL_DRAIN_SECONDS
+    for shard, shard_spool in shard_spools.items():
+        if not shard_spool.wait_empty(max(deadline - time.monotonic(), 0)):
+            log.error(f"{shard_spool.depth} records of shard {shard} stay spooled in {shard_spool.directory} "
+                      f"for the next run.")
+        if shard_spool.quarantined:
+            log.error(f"{shard_spool.quarantined} records of shard {shard} were rejected and moved to "
+                      f"{os.path.join(shard_spool.directory, 'quarantine.jsonl')}.")
+    stop_replay.set()
+    for replayer in replayers:
+        replayer.join()
+    for shard_spool in shard_spools.values():
+        shard_spool.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,25 @@
+# Gemeinsame Fixtures für die Tests.
+import pytest
+
+
+@pytest.fixture
+def collector_db(tmp_path):
+    """
+    A fresh SQLite database for the collector, bound for the duration of the test.
+    """
+    pytest.importorskip("flask")
+    pytest.importorskip("sqlalchemy")
+    from tests.loadtest import collector_database
+    with collector_database(f"sqlite:///{tmp_path / 'collector.db'}") as engine:
+        from database.session import init_db
+        init_db()
+        yield engine
+
+
+@pytest.fixture
+def client(collector_db):
+    """
+    A test client of the collector app on the fresh database.
+    """
+    from app import app
+    return app.test_client()
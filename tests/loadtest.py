@@ -0,0 +1,359 @@
+# loadtest.py
+"""
+Collector Load Test
+
+Starts the collector against a local SQLite database and replays synthetic
+exporter traffic (/api/files, /api/log, /api/update_status) at a configurable
+concurrency. Afterwards the queue worker hashes the inserted files and the
+drain rate of the task queue is measured.
+
+Reports requests/sec, p50/p99 latency, database commits per request and the
+queue drain rate as JSON, so ingest and queue changes can be compared across
+commits.
+
+Usage:
+    python tests/loadtest.py --requests 2000 --concurrency 8 --output result.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, "collector"), os.path.join(ROOT_DIR, "common")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+DATASET = "loadtest"
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values.
+
+    Args:
+        values (list): The measured values.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The percentile, or None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class CommitCounter:
+    """
+    Counts the transactions committed on a SQLAlchemy engine.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_commit(self, connection):
+        with self._lock:
+            self.count += 1
+
+
+class Collector:
+    """
+    The collector app served by a werkzeug server in a background thread.
+    """
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="loadtest-server")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def post_json(port, path, payload, connections):
+    """
+    Post a JSON payload over a per-thread keep-alive connection.
+
+    Returns:
+        tuple: HTTP status and latency in seconds.
+    """
+    conn = getattr(connections, "conn", None)
+    if conn is None:
+        conn = connections.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    body = json.dumps(payload)
+    started = time.perf_counter()
+    try:
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except (http.client.HTTPException, OSError):
+        conn.close()
+        connections.conn = None
+        status = None
+    return status, time.perf_counter() - started
+
+
+def build_traffic(count, files_dir, file_size, log_ratio, status_ratio):
+    """
+    Build the synthetic request mix. Every /api/files request points at a
+    real file in files_dir, so the worker can hash it afterwards.
+
+    Returns:
+        list: (path, payload) tuples.
+    """
+    log_every = int(1 / log_ratio) if log_ratio > 0 else 0
+    status_every = int(1 / status_ratio) if status_ratio > 0 else 0
+    traffic = []
+    for i in range(count):
+        if status_every and i % status_every == status_every - 1:
+            traffic.append(("/api/update_status", {
+                "dataset": {"dataset": DATASET},
+                "status": {"status": "RUNNING", "scan_type": "full", "files_seen": i, "files_sent": i},
+            }))
+        elif log_every and i % log_every == log_every - 1:
+            traffic.append(("/api/log", {"level": "INFO", "message": f"loadtest message {i}"}))
+        else:
+            directory = os.path.join(files_dir, f"dir{i % 50:02d}")
+            os.makedirs(directory, exist_ok=True)
+            filename = f"file{i:07d}.bin"
+            path = os.path.join(directory, filename)
+            with open(path, "wb") as f:
+                f.write(os.urandom(file_size))
+            traffic.append(("/api/files", {
+                "path": path,
+                "file_id": uuid.uuid4().hex,
+                "filename": filename,
+                "extension": ".bin",
+                "size_bytes": file_size,
+                "mime_type": "application/octet-stream",
+                "dataset": DATASET,
+            }))
+    return traffic
+
+
+def run_ingest(port, traffic, concurrency):
+    """
+    Replay the traffic with the given number of client threads.
+
+    Returns:
+        dict: Per-endpoint and total latencies, errors and the wall time.
+    """
+    connections = threading.local()
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def send(item):
+        path, payload = item
+        status, latency = post_json(port, path, payload, connections)
+        with lock:
+            latencies.setdefault(path, []).append(latency)
+            if status != 200:
+                errors[path] = errors.get(path, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, traffic))
+    return {"latencies": latencies, "errors": errors, "elapsed": time.perf_counter() - started}
+
+
+def open_tasks():
+    """
+    Number of hash tasks that are still pending or running.
+    """
+    from database.crud.task_queue import fetch_queue_backlog
+    return sum(e["pending"] + e["waiting"] + e["running"] for e in fetch_queue_backlog())
+
+
+def run_drain(timeout):
+    """
+    Run the queue worker until the queue is empty or the timeout expires.
+
+    Returns:
+        dict: Number of drained tasks, remaining tasks and the wall time.
+    """
+    from worker_manager import start_worker, stop_worker
+    before = open_tasks()
+    started = time.perf_counter()
+    start_worker()
+    try:
+        remaining = before
+        while remaining and time.perf_counter() - started < timeout:
+            time.sleep(0.2)
+            remaining = open_tasks()
+    finally:
+        elapsed = time.perf_counter() - started
+        stop_worker()
+    return {"tasks": before - remaining, "remaining": remaining, "elapsed": elapsed}
+
+
+def summarize(latencies):
+    """
+    Latency summary in milliseconds.
+    """
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+@contextmanager
+def collector_database(database_url):
+    """
+    Point the collector at a database for the duration of the block.
+
+    session.py builds its engine from DATABASE_URL on first import, so the
+    variable is only set while the collector modules are imported. The
+    sessions are then bound to a scoped engine, which is disposed at the end.
+    The directory cache is cleared on both ends, since its ids belong to
+    one database.
+
+    Yields:
+        sqlalchemy.engine.Engine: The engine of the database.
+    """
+    previous_url = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = database_url
+    try:
+        from database.session import scoped_engine
+        from database.crud.directories import clear_directory_cache
+    finally:
+        if previous_url is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = previous_url
+
+    clear_directory_cache()
+    try:
+        with scoped_engine(database_url) as engine:
+            yield engine
+    finally:
+        clear_directory_cache()
+
+
+def run_loadtest(requests=1000, concurrency=4, file_size=4096, log_ratio=0.1, status_ratio=0.02,
+                 drain=True, drain_timeout=300.0, work_dir=None):
+    """
+    Run a complete load test against a fresh SQLite database.
+
+    The collector runs against a scoped engine for the temporary database,
+    so several runs in one process do not share a database.
+
+    Args:
+        requests (int): Number of requests to replay.
+        concurrency (int): Number of client threads.
+        file_size (int): Size of the synthetic files in bytes.
+        log_ratio (float): Share of /api/log requests.
+        status_ratio (float): Share of /api/update_status requests.
+        drain (bool): Whether to run the worker on the queued hash tasks.
+        drain_timeout (float): Seconds to wait for the queue to drain.
+        work_dir (str, optional): Directory for the database and the files.
+
+    Returns:
+        dict: The load test report.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="collector-loadtest-")
+    files_dir = os.path.join(work_dir, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    database_url = f"sqlite:///{os.path.join(work_dir, 'collector.db')}"
+
+    with collector_database(database_url) as engine:
+        from database.session import init_db
+        from database.crud.datasets import register_datasets, update_dataset_config
+        from app import app
+
+        engine.echo = False
+        init_db()
+        register_datasets([{"dataset": DATASET, "cluster": "loadtest", "path": files_dir}])
+        update_dataset_config(DATASET, enabled=True)
+
+        traffic = build_traffic(requests, files_dir, file_size, log_ratio, status_ratio)
+        commits = CommitCounter(engine)
+
+        with Collector(app) as collector:
+            ingest = run_ingest(collector.port, traffic, concurrency)
+        ingest_commits = commits.count
+
+        all_latencies = [l for values in ingest["latencies"].values() for l in values]
+        report = {
+            "database": engine.url.render_as_string(hide_password=True),
+            "requests": len(traffic),
+            "concurrency": concurrency,
+            "elapsed_s": round(ingest["elapsed"], 3),
+            "requests_per_sec": round(len(traffic) / ingest["elapsed"], 1) if ingest["elapsed"] else None,
+            "latency": summarize(all_latencies),
+            "endpoints": {path: summarize(values) for path, values in sorted(ingest["latencies"].items())},
+            "errors": ingest["errors"],
+            "commits": ingest_commits,
+            "commits_per_request": round(ingest_commits / len(traffic), 3) if traffic else None,
+        }
+
+        if drain:
+            result = run_drain(drain_timeout)
+            drain_commits = commits.count - ingest_commits
+            report["queue_drain"] = {
+                "tasks": result["tasks"],
+                "remaining": result["remaining"],
+                "elapsed_s": round(result["elapsed"], 3),
+                "tasks_per_sec": round(result["tasks"] / result["elapsed"], 1) if result["elapsed"] else None,
+                "commits_per_task": round(drain_commits / result["tasks"], 3) if result["tasks"] else None,
+            }
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the collector ingest path against SQLite.")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of requests to replay.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of client threads.")
+    parser.add_argument("--file-size", type=int, default=4096, help="Size of the synthetic files in bytes.")
+    parser.add_argument("--log-ratio", type=float, default=0.1, help="Share of /api/log requests.")
+    parser.add_argument("--status-ratio", type=float, default=0.02, help="Share of /api/update_status requests.")
+    parser.add_argument("--no-drain", action="store_true", help="Skip the queue drain measurement.")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="Seconds to wait for the queue.")
+    parser.add_argument("--work-dir", help="Directory for the database and files (default: a temp dir).")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    report = run_loadtest(
+        requests=args.requests,
+        concurrency=args.concurrency,
+        file_size=args.file_size,
+        log_ratio=args.log_ratio,
+        status_ratio=args.status_ratio,
+        drain=not args.no_drain,
+        drain_timeout=args.drain_timeout,
+        work_dir=args.work_dir,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
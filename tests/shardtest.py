@@ -0,0 +1,221 @@
+# shardtest.py
+"""
+Collector Shard Test
+
+Starts several collector processes on this machine, one per shard plus a
+replica of the first shard that shares its SQLite database, and runs the
+exporter against them:
+
+- the datasets are registered and scanned on the shards the hash ring
+  routes them to; the checksums travel with the scanned files, so no
+  hash tasks are left for the exporter,
+- a fan-out search and a fan-out duplicate lookup must see the files of
+  all shards,
+- after the primary of the first shard is stopped, the exporter and the
+  fan-out reads must fail over to its replica.
+
+Usage:
+    python tests/shardtest.py --shards 3 --datasets 6 --files 4
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "exporter"))
+
+import exporter  # noqa: E402
+
+
+def request_json(endpoint_url, method, path, params=None, body=None):
+    """
+    Send a request to a collector and decode the JSON response.
+    """
+    conn = http.client.HTTPConnection(endpoint_url.replace("http://", ""), timeout=30)
+    query = f"?{urlencode(params)}" if params else ""
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(method, f"{path}{query}", json.dumps(body) if body is not None else None, headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, json.loads(data)
+
+
+def free_port():
+    """
+    Bind port 0 and return the port the system assigned.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CollectorProcess:
+    """
+    A collector running in its own process.
+    """
+
+    def __init__(self, name, port, database, shard_map):
+        self.endpoint_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, "collector"),
+                                               os.path.join(ROOT_DIR, "common")]),
+                   DATABASE_URL=f"sqlite:///{database}", SHARD_MAP=json.dumps(shard_map),
+                   SHARD_NAME=name, COLLECTOR_PORT=str(port))
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "collector", "app.py")], env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Collector {self.endpoint_url} exited with {self.process.returncode}")
+            try:
+                request_json(self.endpoint_url, "GET", "/ping")
+                return self
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"Collector {self.endpoint_url} did not start")
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(10)
+
+
+def make_datasets(base_dir, count, files):
+    """
+    Create dataset directories. The file contents repeat across datasets,
+    so every file has duplicates on other datasets and usually other shards.
+    """
+    datasets = []
+    for d in range(count):
+        path = os.path.join(base_dir, f"ds{d:02d}")
+        os.makedirs(path)
+        for f in range(files):
+            with open(os.path.join(path, f"video{f:02d}.mp4"), "w") as out:
+                out.write(f"content {f}\n")
+        datasets.append({"cluster": "local", "dataset": f"ds{d:02d}", "path": path})
+    return datasets
+
+
+def search_all(endpoint_url, page_size):
+    """
+    Page through a fan-out search and return all files and failed shards.
+    """
+    files, failed, token = [], set(), None
+    while True:
+        params = {"fanout": 1, "limit": page_size, **({"page": token} if token else {})}
+        status, page = request_json(endpoint_url, "GET", "/api/search", params)
+        if status != 200:
+            raise RuntimeError(f"Search failed: {page}")
+        files.extend(page["files"])
+        failed.update(page["failed_shards"])
+        token = page["next"]
+        if not token or not page["files"]:
+            return files, sorted(failed)
+
+
+def run_shardtest(shards=3, datasets=6, files=4, base_port=None, work_dir=None):
+    """
+    Run the shard test.
+
+    Args:
+        shards (int): Number of shards.
+        datasets (int): Number of datasets.
+        files (int): Number of files per dataset.
+        base_port (int, optional): Port of the first collector; the others follow.
+            By default every collector gets a free port assigned by the system.
+        work_dir (str, optional): Directory for the databases and datasets.
+
+    Returns:
+        dict: The test report.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="collector-shardtest-")
+    names = [chr(ord("a") + i) for i in range(shards)]
+    ports = [base_port + i for i in range(shards + 1)] if base_port else [free_port() for _ in range(shards + 1)]
+    shard_map = {"vnodes": 64, "shards": [
+        {"name": name, "endpoints": [f"http://127.0.0.1:{ports[i]}"]} for i, name in enumerate(names)]}
+    replica_port = ports[shards]
+    shard_map["shards"][0]["endpoints"].append(f"http://127.0.0.1:{replica_port}")
+
+    collectors = []
+    try:
+        for i, name in enumerate(names):
+            collectors.append(CollectorProcess(name, ports[i], os.path.join(work_dir, f"{name}.db"),
+                                               shard_map))
+        for collector in collectors:
+            collector.wait_ready()
+        replica = CollectorProcess(names[0], replica_port, os.path.join(work_dir, f"{names[0]}.db"),
+                                   shard_map).wait_ready()
+        collectors.append(replica)
+
+        seed = collectors[-2].endpoint_url
+        exporter.log = exporter.Log(seed)
+        router = exporter.ShardRouter.from_collector(seed)
+        dataset_list = make_datasets(os.path.join(work_dir, "data"), datasets, files)
+
+        exporter.register_datasets(dataset_list, router)
+        for dataset in dataset_list:
+            router.call(router.shard_for(dataset["dataset"]), lambda endpoint_url: request_json(
+                endpoint_url, "PATCH", f"/admin/datasets/{dataset['dataset']}", body={"enabled": True}))
+        enabled, extensions = exporter.register_datasets(dataset_list, router)
+        exporter.scan_datasets(enabled, router, extensions)
+        hash_tasks = sum(router.call(shard, exporter.process_hash_tasks, max_workers=4) for shard in router.endpoints)
+
+        placement = {}
+        for dataset in dataset_list:
+            placement.setdefault(router.shard_for(dataset["dataset"]), []).append(dataset["dataset"])
+
+        found, failed = search_all(seed, page_size=max(files, 3))
+        sample = found[0]
+        owner = next(s for s in shard_map["shards"] if s["name"] == sample["shard"])
+        _, duplicates = request_json(owner["endpoints"][-1], "GET", f"/api/files/{sample['file_id']}/duplicates",
+                                     {"fanout": 1})
+
+        # Stop the primary of the first shard; its replica takes over.
+        collectors[0].stop()
+        failover_endpoint = router.endpoint(names[0])
+        found_after, failed_after = search_all(seed, page_size=max(files, 3))
+
+        return {
+            "shards": shards,
+            "placement": placement,
+            "files_expected": datasets * files,
+            "hash_tasks": hash_tasks,
+            "search_files": len(found),
+            "search_unique": len({f["file_id"] for f in found}),
+            "search_failed_shards": failed,
+            "duplicates": len(duplicates["files"]),
+            "duplicate_shards": sorted({f["shard"] for f in duplicates["files"]}),
+            "failover_endpoint": failover_endpoint,
+            "search_files_after_failover": len(found_after),
+            "search_failed_shards_after_failover": failed_after,
+        }
+    finally:
+        for collector in collectors:
+            if collector.process.poll() is None:
+                collector.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several collector shards on this machine.")
+    parser.add_argument("--shards", type=int, default=3, help="Number of shards.")
+    parser.add_argument("--datasets", type=int, default=6, help="Number of datasets.")
+    parser.add_argument("--files", type=int, default=4, help="Number of files per dataset.")
+    parser.add_argument("--base-port", type=int, help="Port of the first collector (default: free ports).")
+    parser.add_argument("--work-dir", help="Directory for the databases and datasets (default: a temp dir).")
+    args = parser.parse_args()
+    report = run_shardtest(args.shards, args.datasets, args.files, args.base_port, args.work_dir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
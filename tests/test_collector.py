@@ -1 +1,558 @@
 # Tests für die Collector-Komponente.
+import os
+import sqlite3
+import sys
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("sqlalchemy")
+
+from tests.loadtest import percentile, run_loadtest
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+
+def test_loadtest_ingest_and_drain(tmp_path):
+    report = run_loadtest(requests=60, concurrency=2, file_size=256, drain_timeout=60, work_dir=str(tmp_path))
+    assert report["errors"] == {}
+    assert report["requests"] == 60
+    assert report["commits_per_request"] > 0
+    assert report["queue_drain"]["remaining"] == 0
+    assert report["queue_drain"]["tasks"] == report["endpoints"]["/api/files"]["count"]
+
+
+def test_loadtest_runs_use_their_own_database(tmp_path, monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    for name in ("first", "second"):
+        report = run_loadtest(requests=20, concurrency=2, file_size=64, log_ratio=0, status_ratio=0,
+                              drain=False, work_dir=str(tmp_path / name))
+        assert report["errors"] == {}
+        with sqlite3.connect(tmp_path / name / "collector.db") as conn:
+            assert conn.execute("SELECT COUNT(*) FROM inventory").fetchone()[0] == 20
+    assert "DATABASE_URL" not in os.environ
+
+
+def test_shards_fan_out_and_fail_over(tmp_path):
+    from tests.shardtest import run_shardtest
+    report = run_shardtest(shards=2, datasets=4, files=2, work_dir=str(tmp_path))
+    assert report["hash_tasks"] == 0
+    assert report["search_unique"] == report["files_expected"]
+    assert report["duplicates"] == 4
+    assert report["search_files_after_failover"] == report["files_expected"]
+    assert report["search_failed_shards_after_failover"] == []
+
+
+def _register(client, *datasets):
+    response = client.post("/datasets", json={"datasets": [
+        {"cluster": cluster, "dataset": name, "path": f"/mnt/{cluster}/{name}"} for cluster, name in datasets]})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_exporter_routes_are_served_without_api_prefix(client):
+    assert client.post("/log", json={"level": "INFO", "message": "hello"}).status_code == 200
+    assert client.post("/api/log", json={"level": "INFO", "message": "hello"}).status_code == 200
+    assert client.post("/update_status", json={}).status_code == 400
+
+
+def test_dataset_names_are_unique_per_cluster(client):
+    _register(client, ("c1", "media"), ("c2", "media"))
+    assert len(client.get("/admin/datasets").get_json()["datasets"]) == 2
+    assert client.get("/admin/datasets/media").status_code == 409
+
+    response = client.patch("/admin/datasets/media?cluster=c2", json={"enabled": True})
+    assert response.status_code == 200 and response.get_json()["path"] == "/mnt/c2/media"
+    enabled = _register(client, ("c1", "media"), ("c2", "media"))["enabled_datasets"]
+    assert [(d["cluster"], d["dataset"]) for d in enabled] == [("c2", "media")]
+
+
+def test_scan_cursor_only_advances_on_success(client):
+    _register(client, ("c1", "media"))
+    dataset = {"cluster": "c1", "dataset": "media"}
+    client.post("/update_status", json={"dataset": dataset, "status": {
+        "status": "FAILURE", "last_scan": "2026-01-02_03-04", "files_seen": 3}})
+    assert client.get("/admin/datasets/media").get_json()["last_scan"] is None
+
+    client.post("/update_status", json={"dataset": dataset, "status": {
+        "status": "SUCCESS", "last_scan": "2026-01-02_03-04", "scan_type": "full", "files_seen": 3}})
+    stored = client.get("/admin/datasets/media?cluster=c1").get_json()
+    assert stored["last_scan"] == "2026-01-02_03-04" and stored["files_seen"] == 3
+
+
+def test_sweep_keeps_files_of_the_same_dataset_name_in_another_cluster(client):
+    from database.crud.scans import sweep_generation
+    _register(client, ("c1", "media"), ("c2", "media"))
+    for cluster in ("c1", "c2"):
+        client.post("/files", json={"path": f"/mnt/{cluster}/media/a.mp4", "file_id": f"{cluster}-a",
+                                    "filename": "a.mp4", "size_bytes": 1, "mime_type": "video/mp4",
+                                    "dataset": "media"})
+    generation = client.post("/scans", json={"dataset": "media", "cluster": "c1"}).get_json()["generation_id"]
+
+    assert sweep_generation(generation) == 1
+    paths = [f["path"] for f in client.get("/api/search?dataset=media").get_json()["files"]]
+    assert paths == ["/mnt/c2/media/a.mp4"]
+
+
+def _file(name, dataset="media", directory="/mnt/c1/media"):
+    return {"path": f"{directory}/{name}", "file_id": f"id-{directory}/{name}", "filename": name,
+            "size_bytes": 1, "mime_type": "video/mp4", "dataset": dataset}
+
+
+def test_seen_stamps_known_files_and_returns_unknown_ones(client):
+    _register(client, ("c1", "media"))
+    client.post("/files", json=_file("a.mp4"))
+    generation = client.post("/scans", json={"dataset": "media", "cluster": "c1"}).get_json()["generation_id"]
+
+    response = client.post(f"/scans/{generation}/seen", json={"file_ids": [_file("a.mp4")["file_id"], "new"]})
+    assert response.get_json()["stamped"] == 1 and response.get_json()["unknown"] == ["new"]
+    finished = client.post(f"/scans/{generation}/finish", json={"status": "FAILURE"}).get_json()
+    assert finished["sweep_started"] is False
+
+
+def test_insert_racing_another_insert_of_the_same_file_updates_it(collector_db):
+    from sqlalchemy import event, insert
+    from database.session import SessionLocal
+    from database.models import Inventory
+    from database.crud.inventory import upsert_inventory, fetch_file_info
+    upsert_inventory("other", "/mnt/c1/media/b.mp4", "b.mp4", 1, "video/mp4", "media")
+    raced = []
+
+    def insert_concurrently(session):
+        if not raced:
+            raced.append(True)
+            with collector_db.begin() as conn:
+                conn.execute(insert(Inventory).values(file_id="same", filename="a.mp4", size_bytes=1,
+                                                      dataset="media"))
+
+    event.listen(SessionLocal, "before_commit", insert_concurrently)
+    try:
+        assert upsert_inventory("same", "/mnt/c1/media/a.mp4", "a.mp4", 2, "video/mp4", "media") is False
+    finally:
+        event.remove(SessionLocal, "before_commit", insert_concurrently)
+    assert raced and fetch_file_info("same").size_bytes == 2
+
+
+def test_purge_removes_directories_left_without_files(client):
+    from datetime import datetime, timedelta
+    from database.session import SessionLocal
+    from database.models import Directory, Inventory
+    from database.crud.scans import purge_tombstones
+    from database.crud.directories import purge_orphan_directories
+    client.post("/files", json=_file("a.mp4", directory="/mnt/c1/media/old/deep"))
+    client.post("/files", json=_file("b.mp4", directory="/mnt/c1/media/kept"))
+    with SessionLocal() as session:
+        session.query(Inventory).filter_by(filename="a.mp4").update({"deleted_at": datetime.now() - timedelta(days=90)})
+        session.commit()
+
+    assert purge_tombstones(retention_days=30) == 1
+    assert purge_orphan_directories() == 2
+    with SessionLocal() as session:
+        paths = {d.path for d in session.query(Directory)}
+    assert "/mnt/c1/media/kept" in paths and not any(p.startswith("/mnt/c1/media/old") for p in paths)
+    assert client.post("/files", json=_file("c.mp4", directory="/mnt/c1/media/old")).status_code == 200
+
+
+def test_ingest_interns_the_directory_of_a_new_file(client):
+    from database.crud.inventory import fetch_file_info
+    first = client.post("/files", json=_file("a.mp4", directory="/mnt/c1/media/x/y"))
+    again = client.post("/files", json=_file("a.mp4", directory="/mnt/c1/media/x/y"))
+    assert first.status_code == 200 and again.status_code == 200
+
+    record = fetch_file_info(_file("a.mp4", directory="/mnt/c1/media/x/y")["file_id"])
+    assert record.path is None and record.full_path == "/mnt/c1/media/x/y/a.mp4"
+    listing = client.get("/api/directories?dataset=media&path=/mnt/c1/media/x&recursive=1").get_json()
+    assert [f["path"] for f in listing["files"]] == ["/mnt/c1/media/x/y/a.mp4"]
+    assert listing["directories"] == [{"directory_id": record.directory_id, "path": "/mnt/c1/media/x/y"}]
+
+
+def test_search_pages_by_keyset_and_rejects_bad_limits(client):
+    for name in ('a.mp4', 'b.MKV', 'say "hi".mp4', 'c.txt'):
+        client.post("/files", json=_file(name))
+
+    first = client.get("/api/search?dataset=media&limit=2").get_json()
+    second = client.get(f"/api/search?dataset=media&limit=2&page={first['next']}").get_json()
+    assert [f["filename"] for f in first["files"] + second["files"]] == ['a.mp4', 'b.MKV', 'say "hi".mp4', 'c.txt']
+    last = client.get(f"/api/search?dataset=media&limit=2&page={second['next']}").get_json()
+    assert last == {"files": [], "next": None}
+
+    assert [f["filename"] for f in client.get("/api/search?extension=mkv").get_json()["files"]] == ['b.MKV']
+    assert [f["filename"] for f in client.get('/api/search?contains="hi"').get_json()["files"]] == ['say "hi".mp4']
+    streamed = client.get("/api/search?format=ndjson&extension=.mp4").get_data(as_text=True).splitlines()
+    assert len(streamed) == 2
+
+    for limit in (0, -1, 1001):
+        assert client.get(f"/api/search?limit={limit}").status_code == 400
+    assert client.get("/api/search?format=ndjson&limit=0").status_code == 400
+
+
+def test_fulltext_phrases_cannot_break_out_of_the_phrase():
+    from database.crud.search import fulltext_phrases
+    assert fulltext_phrases("holiday") == '+"holiday"'
+    assert fulltext_phrases('say "hi" now') == '+"say " +"hi" +" now"'
+    assert fulltext_phrases('"a"') is None
+
+
+def test_migration_backfills_extensions(collector_db):
+    from database.session import SessionLocal
+    from database.models import Inventory
+    from database.migrations import backfill_inventory_extensions
+    with SessionLocal() as session:
+        session.add_all([Inventory(file_id="1", path="/d/a.MP4", filename="a.MP4", size_bytes=1),
+                         Inventory(file_id="2", path="/d/README", filename="README", size_bytes=1)])
+        session.commit()
+    assert backfill_inventory_extensions(chunk_size=1) == 1
+    with SessionLocal() as session:
+        assert [r.extension for r in session.query(Inventory).order_by(Inventory.id)] == [".mp4", None]
+
+
+FFPROBE_OUTPUT = """{
+  "streams": [
+    {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": "1080", "avg_frame_rate": "30000/1001"},
+    {"codec_type": "audio", "codec_name": "aac"}
+  ],
+  "format": {"format_name": "mov,mp4,m4a", "duration": "12.5", "bit_rate": "800000"}
+}"""
+
+
+def test_parse_probe_output():
+    from media_probe import parse_probe_output
+    assert parse_probe_output(FFPROBE_OUTPUT) == {
+        "format_name": "mov,mp4,m4a", "duration": 12.5, "bitrate": 800000, "video_codec": "h264",
+        "audio_codec": "aac", "width": 1920, "height": 1080, "frame_rate": 29.97,
+    }
+    assert parse_probe_output('{"streams": [{"codec_type": "video", "r_frame_rate": "0/0"}]}') == {
+        "format_name": None, "duration": None, "bitrate": None, "video_codec": None,
+        "audio_codec": None, "width": None, "height": None, "frame_rate": None,
+    }
+
+
+def _stub_probe_command(tmp_path, output, exit_code=0):
+    script = tmp_path / "probe_stub.py"
+    script.write_text(f"import sys\nsys.stdout.write({output!r})\nsys.exit({exit_code})\n")
+    return f"{sys.executable} {script}"
+
+
+def _probe_task(file_id="id-probe"):
+    from database.session import SessionLocal
+    from database.models import Inventory
+    from database.crud.task_queue import add_task_to_queue, fetch_pending_task
+    with SessionLocal() as session:
+        session.add(Inventory(file_id=file_id, path="/mnt/c1/media/a.mp4", filename="a.mp4", size_bytes=1,
+                              mime_type="video/mp4", dataset="media", checksum="c" * 64))
+        session.commit()
+    add_task_to_queue('PROBE_MEDIA', file_id, dataset="media")
+    return fetch_pending_task()
+
+
+def _task_status(queue_id):
+    from database.session import SessionLocal
+    from database.models import TaskQueue
+    with SessionLocal() as session:
+        task = session.get(TaskQueue, queue_id)
+        return task.status, task.last_error
+
+
+def test_probe_task_with_stub_prober(collector_db, tmp_path):
+    from media_probe import MediaProber
+    from worker import process_probe_task
+    from database.crud.media import fetch_media_metadata
+    task = _probe_task()
+    prober = MediaProber(max_workers=1, command=_stub_probe_command(tmp_path, FFPROBE_OUTPUT))
+    process_probe_task(task, prober)
+    prober.shutdown()
+
+    assert _task_status(task.queue_id) == ("OK", None)
+    assert fetch_media_metadata("c" * 64)["video_codec"] == "h264"
+
+
+def test_failing_stub_prober_and_failing_callback_finish_the_task(collector_db, tmp_path, monkeypatch):
+    import worker
+    from media_probe import MediaProber
+    task = _probe_task()
+    prober = MediaProber(max_workers=1, command=_stub_probe_command(tmp_path, "", exit_code=1))
+    worker.process_probe_task(task, prober)
+    prober.shutdown()
+    assert _task_status(task.queue_id)[0] == "PENDING"
+
+    def broken_store(checksum, metadata):
+        raise RuntimeError("database is gone")
+    monkeypatch.setattr(worker, "store_media_metadata", broken_store)
+    task = _probe_task("id-probe-2")
+    prober = MediaProber(max_workers=1, command=_stub_probe_command(tmp_path, FFPROBE_OUTPUT))
+    worker.process_probe_task(task, prober)
+    prober.shutdown()
+    assert _task_status(task.queue_id) == ("PENDING", "database is gone")
+
+
+def test_stale_running_tasks_are_reaped(collector_db):
+    from database.crud.task_queue import reap_stale_tasks
+    task = _probe_task()
+    assert reap_stale_tasks(stale_seconds=3600) == 0
+    assert reap_stale_tasks(stale_seconds=-1) == 1
+    assert _task_status(task.queue_id) == ("PENDING", "Task timed out")
+
+
+def test_dhash_sets_a_bit_where_a_pixel_is_brighter_than_its_right_neighbour():
+    from fingerprint import dhash
+    assert dhash([0] * 72) == 0
+    assert dhash(list(range(72, 0, -1))) == 2 ** 64 - 1
+    assert dhash(bytes([9, 0, 0, 0, 0, 0, 0, 0, 0] + [0] * 63)) == 1 << 63
+    with pytest.raises(ValueError):
+        dhash([0] * 71)
+
+
+def test_fingerprint_takes_the_majority_of_the_frame_hashes():
+    from fingerprint import dhash, fingerprint_from_thumbnails
+    falling = list(range(72, 0, -1))
+    rising = list(range(72))
+    assert fingerprint_from_thumbnails([falling, falling, rising]) == dhash(falling)
+    assert fingerprint_from_thumbnails([falling, rising]) == 0
+
+
+def test_hamming_index_matches_exact_and_near_signatures_within_the_threshold(collector_db):
+    from similarity import HammingIndex
+    index = HammingIndex()
+    base = 0x0123456789ABCDEF
+    index.add("exact", base)
+    index.add("near", base ^ 0b111)
+    index.add("far", base ^ (2 ** 20 - 1))
+    index.add("replaced", ~base & (2 ** 64 - 1))
+    index.add("replaced", base ^ 0b1)
+    assert len(index) == 4
+
+    assert index.query(base, max_distance=0) == [("exact", 0)]
+    assert index.query(base, max_distance=3) == [("exact", 0), ("replaced", 1), ("near", 3)]
+    assert index.query(base, max_distance=20) == [("exact", 0), ("replaced", 1), ("near", 3), ("far", 20)]
+    assert index.query(base, max_distance=20, limit=2) == [("exact", 0), ("replaced", 1)]
+
+
+def test_similarity_index_is_warmed_up_in_the_background(collector_db, monkeypatch):
+    import similarity
+    from database.crud.fingerprints import store_fingerprint
+    for i in range(5):
+        store_fingerprint(f"{i:064x}", i)
+    monkeypatch.setattr(similarity, "similarity_index", similarity.HammingIndex())
+    similarity.start_warmup().join()
+    assert len(similarity.similarity_index) == 5
+    assert similarity.similarity_index.refresh() == 0
+
+def _claim_all(scheduler, count):
+    from database.session import SessionLocal
+    claimed = []
+    with SessionLocal() as session:
+        for _ in range(count):
+            task = scheduler.claim(session)
+            if task is None:
+                break
+            claimed.append((task.dataset, task.task_type))
+        session.commit()
+    return claimed
+
+
+def test_scheduler_shares_turns_per_dataset_before_task_priority(collector_db):
+    from database.session import SessionLocal
+    from database.models import Dataset
+    from database.crud.task_queue import FairShareScheduler, add_task_to_queue
+    with SessionLocal() as session:
+        session.add_all([Dataset(name="big", weight=2), Dataset(name="small", weight=1)])
+        session.commit()
+    for i in range(20):
+        add_task_to_queue('CALC_FILEHASH', f"big-{i}", dataset="big")
+    for i in range(10):
+        add_task_to_queue('PROBE_MEDIA', f"small-probe-{i}", dataset="small")
+        add_task_to_queue('CALC_FINGERPRINT', f"small-fp-{i}", dataset="small")
+
+    claimed = _claim_all(FairShareScheduler(), 9)
+    assert [dataset for dataset, _ in claimed].count("big") == 6
+    assert [task_type for dataset, task_type in claimed if dataset == "small"] == ['PROBE_MEDIA'] * 3
+
+
+def test_scheduler_gives_a_dataset_with_many_task_types_a_single_share(collector_db):
+    from database.crud.task_queue import FairShareScheduler, add_task_to_queue
+    for task_type in ('CALC_FILEHASH', 'PROBE_MEDIA', 'CALC_FINGERPRINT'):
+        for i in range(5):
+            add_task_to_queue(task_type, f"a-{task_type}-{i}", dataset="a")
+    for i in range(5):
+        add_task_to_queue('CALC_FINGERPRINT', f"b-{i}", dataset="b")
+
+    claimed = _claim_all(FairShareScheduler(), 10)
+    assert [dataset for dataset, _ in claimed].count("a") == 5
+    assert [task_type for dataset, task_type in claimed if dataset == "a"] == ['CALC_FILEHASH'] * 5
+    assert len(_claim_all(FairShareScheduler(), 100)) == 10
+
+
+def test_failed_tasks_back_off_and_end_up_dead(collector_db, monkeypatch):
+    from datetime import datetime
+    from database.session import SessionLocal
+    from database.models import TaskQueue
+    from database.crud import task_queue
+    from database.crud.task_queue import (
+        FairShareScheduler, add_task_to_queue, mark_task_completed, backoff_delay, TASK_BACKOFF_SECONDS
+    )
+    assert TASK_BACKOFF_SECONDS * 0.8 <= backoff_delay(1) <= TASK_BACKOFF_SECONDS * 1.2
+    assert TASK_BACKOFF_SECONDS * 3.2 <= backoff_delay(3) <= TASK_BACKOFF_SECONDS * 4.8
+    monkeypatch.setattr(task_queue, "TASK_MAX_ATTEMPTS", 2)
+
+    add_task_to_queue('PROBE_MEDIA', "retried", dataset="media")
+    add_task_to_queue('PROBE_MEDIA', "broken", dataset="media")
+    scheduler = FairShareScheduler(refresh_seconds=0)
+
+    def claim():
+        with SessionLocal(expire_on_commit=False) as session:
+            task = scheduler.claim(session)
+            session.commit()
+            return task
+
+    first, second = claim(), claim()
+    mark_task_completed(first.queue_id, 'FAIL', error="timeout")
+    mark_task_completed(second.queue_id, 'FAIL', error="not a video", retry=False)
+    assert claim() is None
+    with SessionLocal() as session:
+        task = session.get(TaskQueue, first.queue_id)
+        assert (task.status, task.last_error) == ("PENDING", "timeout") and task.not_before > datetime.now()
+        assert session.get(TaskQueue, second.queue_id).status == "DEAD"
+        task.not_before = None
+        session.commit()
+
+    retried = claim()
+    assert retried.queue_id == first.queue_id and retried.attempts == 2
+    mark_task_completed(retried.queue_id, 'FAIL', error="timeout")
+    with SessionLocal() as session:
+        task = session.get(TaskQueue, first.queue_id)
+        assert (task.status, task.is_completed) == ("DEAD", True)
+
+
+def test_ingest_with_checksum_skips_hashing_and_counts_as_heartbeat(client):
+    from database.session import SessionLocal
+    from database.models import TaskQueue, ExporterNode
+    from database.crud.inventory import fetch_file_info
+    client.post("/files", json={**_file("a.mp4"), "checksum": "A" * 64, "exporter": "host-1"})
+    client.post("/files", json={**_file("b.mp4"), "checksum": "not a checksum"})
+
+    assert fetch_file_info(_file("a.mp4")["file_id"]).checksum == "a" * 64
+    with SessionLocal() as session:
+        assert [(t.task_type, t.file_id) for t in session.query(TaskQueue)] == [
+            ('PROBE_MEDIA', _file("a.mp4")["file_id"]), ('CALC_FILEHASH', _file("b.mp4")["file_id"])]
+        assert [e.name for e in session.query(ExporterNode)] == ["host-1"]
+
+
+def test_claim_reads_the_lane_in_index_order(collector_db):
+    from sqlalchemy import event
+    from database.session import SessionLocal
+    from database.crud.task_queue import FairShareScheduler, add_task_to_queue
+    for i in range(3):
+        add_task_to_queue('PROBE_MEDIA', f"f-{i}", dataset="media")
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "ORDER BY" in statement and "task_queue.task_type = " in statement:
+            statements.append((statement, parameters))
+    event.listen(collector_db, "before_cursor_execute", capture)
+    try:
+        assert _claim_all(FairShareScheduler(), 1) == [("media", 'PROBE_MEDIA')]
+    finally:
+        event.remove(collector_db, "before_cursor_execute", capture)
+
+    statement, parameters = statements[0]
+    with collector_db.connect() as conn:
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    assert any("ix_task_queue_ready_lane" in step for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_empty_full_scan_of_a_dataset_with_files_is_not_swept(client):
+    _register(client, ("c1", "media"))
+    client.post("/files", json=_file("a.mp4"))
+    generation = client.post("/scans", json={"dataset": "media", "cluster": "c1"}).get_json()["generation_id"]
+
+    response = client.post(f"/scans/{generation}/finish", json={"status": "SUCCESS", "files_seen": 0}).get_json()
+    assert response["generation"]["status"] == "FAILURE" and response["sweep_started"] is False
+
+    _register(client, ("c1", "empty"))
+    generation = client.post("/scans", json={"dataset": "empty", "cluster": "c1"}).get_json()["generation_id"]
+    response = client.post(f"/scans/{generation}/finish", json={"status": "SUCCESS", "files_seen": 0}).get_json()
+    assert response["generation"]["status"] == "SUCCESS"
+
+
+def _register_owned(client, exporter, *datasets):
+    response = client.post("/datasets", json={"exporter": exporter, "datasets": [
+        {"cluster": cluster, "dataset": name, "path": f"/mnt/{cluster}/{name}"} for cluster, name in datasets]})
+    assert response.status_code == 200
+
+
+def test_leases_stay_in_the_exporters_cluster_and_bad_checksums_are_rejected(client):
+    from database.crud.inventory import fetch_file_info
+    _register_owned(client, "host-1", ("c1", "media"))
+    _register_owned(client, "host-2", ("c2", "media"))
+    client.post("/files", json=_file("a.mp4"))
+    client.post("/files", json=_file("b.mp4", directory="/mnt/c2/media"))
+
+    tasks = client.post("/leases", json={"exporter": "host-1"}).get_json()["tasks"]
+    assert [t["path"] for t in tasks] == ["/mnt/c1/media/a.mp4"]
+    response = client.post("/leases/results", json={"exporter": "host-1", "results": [
+        {"queue_id": tasks[0]["queue_id"], "checksum": "not a checksum"},
+        {"queue_id": 9999, "checksum": "a" * 64}]}).get_json()
+    assert (response["accepted"], response["ignored"], response["rejected"]) == (0, 1, 1)
+    assert fetch_file_info(_file("a.mp4")["file_id"]).checksum is None
+    assert _task_status(tasks[0]["queue_id"]) == ("PENDING", "Invalid checksum")
+
+    tasks = client.post("/leases", json={"exporter": "host-2"}).get_json()["tasks"]
+    assert [t["path"] for t in tasks] == ["/mnt/c2/media/b.mp4"]
+    response = client.post("/leases/results", json={"exporter": "host-2", "results": [
+        {"queue_id": tasks[0]["queue_id"], "checksum": "B" * 64}]}).get_json()
+    assert response["accepted"] == 1
+    assert fetch_file_info(_file("b.mp4", directory="/mnt/c2/media")["file_id"]).checksum == "b" * 64
+
+
+def test_expired_leases_go_back_to_the_queue_or_die(collector_db):
+    from datetime import datetime, timedelta
+    from database.session import SessionLocal
+    from database.models import TaskQueue
+    from database.crud.leases import expire_leases
+    from database.crud.task_queue import TASK_MAX_ATTEMPTS
+    past = datetime.now() - timedelta(seconds=1)
+    future = datetime.now() + timedelta(hours=1)
+    with SessionLocal() as session:
+        tasks = [TaskQueue(task_type='CALC_FILEHASH', file_id=f"id-{i}", status="RUNNING", attempts=attempts,
+                           lease_owner="host-1", lease_expires_at=expires)
+                 for i, (attempts, expires) in enumerate([(1, past), (TASK_MAX_ATTEMPTS, past), (1, future)])]
+        session.add_all(tasks)
+        session.commit()
+        ids = [task.id for task in tasks]
+
+    assert expire_leases() == 2
+    assert [_task_status(queue_id)[0] for queue_id in ids] == ["PENDING", "DEAD", "RUNNING"]
+
+
+def test_scheduler_leaves_owned_files_to_the_exporter_until_it_goes_silent(client):
+    from datetime import datetime, timedelta
+    from database.session import SessionLocal
+    from database.models import ExporterNode
+    from database.crud.task_queue import FairShareScheduler, EXPORTER_SILENCE_SECONDS
+    _register_owned(client, "host-1", ("c1", "media"), ("c1", "solo"))
+    _register(client, ("c2", "media"))
+    client.post("/files", json=_file("a.mp4"))
+    client.post("/files", json=_file("b.mp4", directory="/mnt/c2/media"))
+    client.post("/files", json=_file("c.mp4", dataset="solo", directory="/mnt/c1/solo"))
+
+    def claim_files():
+        claimed = []
+        with SessionLocal() as session:
+            while (task := FairShareScheduler().claim(session)) is not None:
+                claimed.append(task.file_id)
+            session.commit()
+        return claimed
+
+    assert claim_files() == [_file("b.mp4", directory="/mnt/c2/media")["file_id"]]
+    with SessionLocal() as session:
+        session.get(ExporterNode, "host-1").last_seen = datetime.now() - timedelta(seconds=EXPORTER_SILENCE_SECONDS + 1)
+        session.commit()
+    assert sorted(claim_files()) == sorted([_file("a.mp4")["file_id"],
+                                            _file("c.mp4", dataset="solo", directory="/mnt/c1/solo")["file_id"]])
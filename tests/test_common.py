@@ -1 +1,86 @@
 # Tests für gemeinsam genutzte Module.
+import logging
+import threading
+import time
+
+import pytest
+
+from common import tracing
+from common.profiling import StackSampler, format_folded
+
+
+@pytest.fixture
+def tracing_on(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "SLOW_OP_MS", 40)
+    tracing.reset_span_stats()
+    yield
+    tracing.reset_span_stats()
+
+
+def test_nested_spans_log_slow_operations_with_their_children(tracing_on, caplog):
+    @tracing.traced("inner")
+    def inner(seconds):
+        time.sleep(seconds)
+
+    with caplog.at_level(logging.WARNING, logger=tracing.__name__):
+        with tracing.span("outer", detail="file=a.mp4") as outer:
+            inner(0.001)
+            inner(0.06)
+        assert outer.children["inner"][0] == 2
+
+    slow = [r.getMessage() for r in caplog.records]
+    assert len(slow) == 2
+    assert slow[0].startswith("Slow operation inner took")
+    assert slow[1].startswith("Slow operation outer [file=a.mp4] took")
+    assert " (inner " in slow[1] and slow[1].endswith(" x2)")
+    assert {s["name"]: s["count"] for s in tracing.span_stats()} == {"inner": 2, "outer": 1}
+    assert tracing._stack() == []
+
+
+def test_traced_is_a_no_op_while_tracing_is_off(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", False)
+
+    def fn():
+        pass
+    assert tracing.traced()(fn) is fn
+    assert tracing.span("x").finish() == 0.0
+
+
+def test_instrumented_engine_records_statements_as_children(tracing_on):
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    engine = sqlalchemy.create_engine("sqlite://")
+    tracing.instrument_engine(engine)
+    with tracing.span("query") as query, engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 1"))
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            conn.execute(sqlalchemy.text("SELECT * FROM missing"))
+        conn.execute(sqlalchemy.text("SELECT 2"))
+    assert query.children["db"][0] == 2
+    engine.dispose()
+
+
+def _busy_marker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_stack_sampler_folds_the_stacks_of_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_marker, args=(stop,), name="busy worker")
+    worker.start()
+    try:
+        with StackSampler(interval=0.002) as sampler:
+            time.sleep(0.1)
+    finally:
+        stop.set()
+        worker.join()
+
+    stacks = [stack for stack in sampler.samples if stack.startswith("busy_worker;")]
+    # Der Worker kann auch gerade in stop.is_set() stehen.
+    assert stacks and all("test_common.py:_busy_marker" in stack.split(";") for stack in stacks)
+    assert not any(stack.startswith("stack-sampler;") for stack in sampler.samples)
+    lines = format_folded(sampler.samples).splitlines()
+    assert len(lines) == len(sampler.samples)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert sampler.samples[stack] == int(count) == max(sampler.samples.values())
@@ -1 +1,352 @@
 # Tests für die Exporter-Komponente.
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "exporter"))
+
+import exporter  # noqa: E402
+
+
+class _Log:
+    def info(self, message):
+        pass
+
+    def error(self, message):
+        pass
+
+
+class _FakeCollector:
+    """
+    Stands in for post_record: knows some file ids and rejects some files.
+    """
+
+    def __init__(self, known=(), reject=()):
+        self.known = set(known)
+        self.reject = set(reject)
+        self.calls = []
+
+    def post(self, path, payload, endpoint_url):
+        self.calls.append((path, payload))
+        if path.endswith("/seen"):
+            return {"unknown": [i for i in payload["file_ids"] if i not in self.known]}
+        if path == "/files" and payload["filename"] in self.reject:
+            raise exporter.CollectorRejected("HTTP 400")
+        return {"status": "success"}
+
+    def payloads(self, path):
+        return [payload for called, payload in self.calls if called == path]
+
+
+def _scan(tmp_path, monkeypatch, collector, names=("a.mp4", "b.mp4", "c.mp4"), known=(),
+          endpoints=("http://collector:1",)):
+    dataset_path = tmp_path / "ds"
+    dataset_path.mkdir()
+    for name in names:
+        (dataset_path / name).parent.mkdir(exist_ok=True)
+        (dataset_path / name).write_text(name)
+    collector.known.update(exporter.generate_file_id(str(dataset_path / name)) for name in known)
+    monkeypatch.setattr(exporter, "log", _Log())
+    monkeypatch.setattr(exporter, "spools", {})
+    monkeypatch.setattr(exporter, "post_record", collector.post)
+    monkeypatch.setattr(exporter, "ping_collector", lambda endpoint_url: 200)
+    monkeypatch.setattr(exporter, "start_scan_generation", lambda *args, **kwargs: 7)
+    router = exporter.ShardRouter([{"name": "a", "endpoints": list(endpoints)}])
+    dataset = {"cluster": "c", "dataset": "ds", "path": str(dataset_path), "enabled": True, "last_scan": None}
+    exporter.scan_datasets([dataset], router, [".mp4"])
+    return dataset_path
+
+
+def _router(names):
+    return exporter.ShardRouter([{"name": n, "endpoints": [f"http://{n}:5001"]} for n in names])
+
+
+def test_shard_router_moves_few_keys_when_a_shard_is_added():
+    keys = [f"dataset-{i}" for i in range(1000)]
+    before = _router(["a", "b", "c"])
+    after = _router(["a", "b", "c", "d"])
+    moved = [k for k in keys if before.shard_for(k) != after.shard_for(k)]
+    assert all(after.shard_for(k) == "d" for k in moved)
+    assert len(moved) < len(keys) / 2
+    assert {before.shard_for(k) for k in keys} == {"a", "b", "c"}
+
+
+def test_shard_router_fails_over_to_replica(monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    router = exporter.ShardRouter([{"name": "a", "endpoints": ["http://down:1", "http://up:1"]}])
+
+    def call(endpoint_url):
+        if "down" in endpoint_url:
+            raise ConnectionRefusedError("refused")
+        return endpoint_url
+
+    assert router.call("a", call) == "http://up:1"
+    assert router.endpoints["a"][0] == "http://up:1"
+    with pytest.raises(ConnectionError):
+        router.call("a", lambda endpoint_url: (_ for _ in ()).throw(OSError("down")))
+
+
+def test_shard_router_reorders_endpoints_safely_from_many_threads(monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    router = exporter.ShardRouter([{"name": "a", "endpoints": ["http://x:1", "http://y:1", "http://z:1"]}])
+
+    def call(i, endpoint_url):
+        # Jede Anfrage lehnt einen anderen Endpunkt ab, damit die Threads ständig umsortieren.
+        if endpoint_url.endswith(("x:1", "y:1", "z:1")[i % 3]):
+            raise ConnectionRefusedError("refused")
+        return endpoint_url
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: router.call("a", call, i), range(2000)))
+    assert all(results)
+    assert sorted(router.endpoints["a"]) == ["http://x:1", "http://y:1", "http://z:1"]
+
+
+def test_router_falls_back_to_the_cached_shard_map(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    cache_file = str(tmp_path / "shard-map.json")
+    shard_map = {"shards": [{"name": "a", "endpoints": ["http://a:5001"]}], "vnodes": 8}
+
+    def fetch(endpoint_url):
+        if endpoint_url == "http://down:1":
+            raise ConnectionRefusedError("refused")
+        return shard_map
+    monkeypatch.setattr(exporter, "fetch_shard_map", fetch)
+    router = exporter.ShardRouter.from_collector(["http://down:1", "http://seed:1"], cache_file=cache_file)
+    assert router.endpoints == {"a": ["http://a:5001"]}
+
+    monkeypatch.setattr(exporter, "fetch_shard_map", lambda endpoint_url: fetch("http://down:1"))
+    router = exporter.ShardRouter.from_collector(["http://down:1"], cache_file=cache_file)
+    assert router.endpoints == {"a": ["http://a:5001"]}
+    with pytest.raises(ConnectionError):
+        exporter.ShardRouter.from_collector(["http://down:1"], cache_file=str(tmp_path / "missing.json"))
+
+
+def test_canonical_path_maps_snapshots_to_live_path():
+    assert exporter.canonical_path("/mnt/c/ds/.zfs/snapshot/auto-1/a/b.mp4", "/mnt/c/ds") == "/mnt/c/ds/a/b.mp4"
+    assert exporter.canonical_path("/mnt/c/ds@auto-1/a/b.mp4", "/mnt/c/ds") == "/mnt/c/ds@auto-1/a/b.mp4"
+    assert exporter.canonical_path("/mnt/c/ds/a/b@2x.mp4", "/mnt/c/ds") == "/mnt/c/ds/a/b@2x.mp4"
+
+
+def test_spool_replays_in_order_across_segments_and_restarts(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    spool = exporter.Spool(str(tmp_path), max_bytes=4096, segment_bytes=200)
+    for i in range(10):
+        spool.append({"path": "/files", "payload": {"n": i}, "dataset": "ds"})
+    spool.close()
+    with pytest.raises(exporter.SpoolFull):
+        exporter.Spool(str(tmp_path), max_bytes=100).append({"path": "/files", "payload": {}, "dataset": "ds"})
+
+    spool = exporter.Spool(str(tmp_path), max_bytes=4096, segment_bytes=200)
+    assert spool.depth == 10
+    replayed = []
+    while spool.depth:
+        replayed.append(spool.peek(timeout=0)["payload"]["n"])
+        spool.ack()
+    assert replayed == list(range(10))
+    assert spool.peek(timeout=0) is None
+    assert spool.size_bytes == 0 and os.listdir(tmp_path) == []
+
+
+def test_replay_fsyncs_the_last_appends_while_the_shard_is_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), fsync(fd)))
+    spool = exporter.Spool(str(tmp_path), fsync_seconds=0.3)
+    router = exporter.ShardRouter([{"name": "a", "endpoints": ["http://down:1"]}])
+    monkeypatch.setattr(exporter, "post_record", lambda *args, **kwargs: (_ for _ in ()).throw(OSError("down")))
+    stop = threading.Event()
+    replayer = threading.Thread(target=exporter.replay_spool, args=(spool, router, "a", stop), daemon=True)
+    replayer.start()
+    try:
+        spool.append({"path": "/files", "payload": {"n": 1}, "dataset": "ds"})
+        assert synced == []
+        deadline = time.monotonic() + 3
+        while not synced and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(synced) == 1
+        spool.sync_if_due()
+        assert len(synced) == 1
+    finally:
+        stop.set()
+        replayer.join()
+        spool.close()
+
+
+def test_full_scan_stamps_known_files_and_sends_only_new_ones(tmp_path, monkeypatch):
+    collector = _FakeCollector()
+    _scan(tmp_path, monkeypatch, collector, known=("a.mp4", "b.mp4"))
+    assert [len(p["file_ids"]) for p in collector.payloads("/scans/7/seen")] == [3]
+    assert [p["filename"] for p in collector.payloads("/files")] == ["c.mp4"]
+    assert collector.payloads("/files")[0]["scan_generation"] == 7
+    assert collector.payloads("/scans/7/finish") == [{"status": "SUCCESS", "files_seen": 3}]
+    assert collector.payloads("/update_status")[0]["status"]["files_sent"] == 3
+
+
+def test_rejected_file_closes_the_generation_as_failure(tmp_path, monkeypatch):
+    collector = _FakeCollector(reject={"b.mp4"})
+    _scan(tmp_path, monkeypatch, collector)
+    assert collector.payloads("/scans/7/finish") == [{"status": "FAILURE", "files_seen": 3}]
+    assert collector.payloads("/update_status")[0]["status"]["status"] == "FAILURE"
+
+
+def test_scan_sends_the_content_checksum_read_with_the_file_id(tmp_path, monkeypatch):
+    import hashlib
+    collector = _FakeCollector()
+    _scan(tmp_path, monkeypatch, collector, names=("a.mp4",))
+    payload, = collector.payloads("/files")
+    assert payload["checksum"] == hashlib.sha256(b"a.mp4").hexdigest()
+    assert payload["exporter"] == exporter.EXPORTER_ID
+
+
+def test_hashing_renews_the_leases_of_a_slow_batch(monkeypatch):
+    import time
+    collector = _FakeCollector()
+    monkeypatch.setattr(exporter, "log", _Log())
+    monkeypatch.setattr(exporter, "post_record", collector.post)
+    monkeypatch.setattr(exporter, "LEASE_HEARTBEAT_SECONDS", 0.05)
+    batches = [[{"queue_id": 1, "path": "/big.mkv"}, {"queue_id": 2, "path": None}], []]
+    monkeypatch.setattr(exporter, "lease_hash_tasks", lambda endpoint_url: batches.pop(0))
+    sent = []
+    monkeypatch.setattr(exporter, "send_hash_results", lambda results, endpoint_url: sent.extend(results))
+
+    def slow_checksum(path):
+        time.sleep(0.3)
+        return {"checksum": "c" * 64}
+    monkeypatch.setattr(exporter, "compute_checksum", slow_checksum)
+
+    assert exporter.process_hash_tasks("http://collector:1", max_workers=1) == 2
+    assert len(collector.payloads("/leases/heartbeat")) >= 2
+    assert sorted(r["queue_id"] for r in sent) == [1, 2]
+
+
+def test_get_snapshots_lists_only_the_datasets_own_snapshots(tmp_path, monkeypatch):
+    zfs = tmp_path / "zfs"
+    zfs.write_text(
+        "#!/bin/sh\n"
+        "echo NAME\n"
+        "echo tank/media@auto-2024-01-01_00-00\n"
+        "case \" $* \" in *' -d 1 '*) ;; *) echo tank/media/child@auto-2024-01-02_00-00 ;; esac\n"
+        "echo tank/media@auto-2024-01-03_00-00\n")
+    zfs.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    assert exporter.get_snapshots("/mnt/tank/media") == [
+        "tank/media@auto-2024-01-01_00-00", "tank/media@auto-2024-01-03_00-00"]
+
+
+def test_scan_fails_over_when_the_collector_dies_mid_scan(tmp_path, monkeypatch):
+    class _DyingCollector(_FakeCollector):
+        endpoints = []
+
+        def post(self, path, payload, endpoint_url):
+            if endpoint_url == "http://primary:1" and self.payloads("/files"):
+                raise ConnectionRefusedError("primary is gone")
+            if path == "/files":
+                self.endpoints.append(endpoint_url)
+            return super().post(path, payload, endpoint_url)
+
+    collector = _DyingCollector()
+    monkeypatch.setattr(exporter, "MAX_WORKERS", 1)
+    _scan(tmp_path, monkeypatch, collector, endpoints=("http://primary:1", "http://replica:1"))
+    assert collector.endpoints == ["http://primary:1", "http://replica:1", "http://replica:1"]
+    assert len(collector.payloads("/files")) == 3
+    assert collector.payloads("/scans/7/finish") == [{"status": "SUCCESS", "files_seen": 3}]
+
+
+def test_submit_record_queues_behind_a_non_empty_spool(tmp_path, monkeypatch):
+    collector = _FakeCollector()
+    spool = exporter.Spool(str(tmp_path))
+    spool.append({"path": "/files", "payload": {"n": 0}, "dataset": "ds"})
+    monkeypatch.setattr(exporter, "log", _Log())
+    monkeypatch.setattr(exporter, "post_record", collector.post)
+    monkeypatch.setattr(exporter, "spools", {"a": spool})
+
+    assert exporter.submit_record("/files", {"n": 1}, "ds", _router(["a"]), "a") is None
+    assert collector.calls == []
+    replayed = []
+    while spool.depth:
+        replayed.append(spool.peek(timeout=0)["payload"]["n"])
+        spool.ack()
+    assert replayed == [0, 1]
+    spool.close()
+
+
+class _BusyCollectorHandler(BaseHTTPRequestHandler):
+    """
+    Answers the first request with 503 and Retry-After, rejects files named
+    "bad.mp4" and accepts everything else.
+    """
+    received = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.received:
+            self.received.append(None)
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        self.received.append((self.path, payload))
+        self.send_response(400 if payload.get("filename") == "bad.mp4" else 200)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_replay_spool_waits_for_retry_after_and_quarantines_rejected_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(exporter, "log", _Log())
+    monkeypatch.setattr(_BusyCollectorHandler, "received", [])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BusyCollectorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    router = exporter.ShardRouter([{"name": "a", "endpoints": [f"http://127.0.0.1:{server.server_port}"]}])
+    spool = exporter.Spool(str(tmp_path))
+    for record in ({"path": "/files", "payload": {"filename": "a.mp4"}, "dataset": "ds"},
+                   {"path": "/files", "payload": {"filename": "bad.mp4"}, "dataset": "ds"},
+                   {"path": "/files", "dataset": "ds"},
+                   {"path": "/scans/7/finish", "payload": {"status": "SUCCESS", "files_seen": 3}, "dataset": "ds"},
+                   {"path": "/scans/8/finish", "payload": {"status": "SUCCESS", "files_seen": 1}, "dataset": "other"}):
+        spool.append(record)
+
+    stop = threading.Event()
+    started = time.monotonic()
+    replayer = threading.Thread(target=exporter.replay_spool, args=(spool, router, "a", stop))
+    replayer.start()
+    try:
+        assert spool.wait_empty(10)
+    finally:
+        stop.set()
+        replayer.join()
+        server.shutdown()
+        spool.close()
+
+    assert time.monotonic() - started >= 1
+    assert _BusyCollectorHandler.received[1:] == [
+        ("/files", {"filename": "a.mp4"}), ("/files", {"filename": "bad.mp4"}),
+        ("/scans/7/finish", {"status": "FAILURE", "files_seen": 3}),
+        ("/scans/8/finish", {"status": "SUCCESS", "files_seen": 1})]
+    assert spool.quarantined == 2
+    with open(tmp_path / "quarantine.jsonl") as f:
+        assert [json.loads(line)["record"].get("payload") for line in f] == [{"filename": "bad.mp4"}, None]
+
+
+def test_unlistable_directory_fails_the_scan(tmp_path, monkeypatch):
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if os.path.basename(path) == "sub":
+            raise OSError(5, "Input/output error", path)
+        return scandir(path)
+    monkeypatch.setattr(os, "scandir", failing_scandir)
+    collector = _FakeCollector()
+    _scan(tmp_path, monkeypatch, collector, names=("a.mp4", "sub/b.mp4"))
+    assert [p["filename"] for p in collector.payloads("/files")] == ["a.mp4"]
+    assert collector.payloads("/scans/7/finish") == [{"status": "FAILURE", "files_seen": 1}]